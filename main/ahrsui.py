@@ -34,7 +34,7 @@
 import radarbuttons
 import radarmodes
 import logging
-import requests
+import stratuxclient
 
 # constants
 # globals
@@ -85,18 +85,12 @@ def draw_ahrs(display_control, connected, was_changed, pitch, roll, heading, sli
 
 def zero_drift():
     rlog.debug("Zero drift calibration initiated by button press!")
-    try:
-        requests.post(calibrate_url)
-    except requests.exceptions.RequestException as e:
-        rlog.debug("Error posting calibration request: {0}".format(e))
+    stratuxclient.post_nowait(calibrate_url)
 
 
 def set_level():
     rlog.debug("Levelling initiated by button press!")
-    try:
-        requests.post(cage_url)
-    except requests.exceptions.RequestException as e:
-        rlog.debug("Error posting levelling request: {0}".format(e))
+    stratuxclient.post_nowait(cage_url)
 
 
 def user_input():
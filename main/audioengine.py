@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+
+# Audio engine for continuous cues. Tones are synthesised with numpy period by period and streamed to ALSA
+# with a small period buffer, so latency is bounded by PERIODS * PERIOD_SIZE frames:
+#   ground beep - beeps whose rate increases when ground distance decreases (landing with ground sensor)
+#   vario       - climb: beeping tone rising with climb rate, sink: continuous low tone
+# PCM voices (e.g. synthesised speech) can be played via play() and are mixed with the tones.
+
+import logging
+import threading
+import time
+import alsaaudio
+import numpy
+
+# constants
+SAMPLE_RATE = 16000       # same as speech synthesis, so voices can be mixed without resampling
+PERIOD_SIZE = 256         # frames per period, 16 ms
+PERIODS = 3               # periods in the alsa buffer
+ALSA_DEVICE = 'default'
+TONE_LEVEL = 0.3          # amplitude of tones in relation to full scale
+RAMP_TIME = 0.005         # fade in/out of a beep in secs, avoids clicks
+BEEP_FREQUENCY = 1000.0   # ground beep
+BEEP_LENGTH = 0.07        # secs
+BEEP_MAX_DISTANCE = 50.0  # ft, above no ground beep
+BEEP_MIN_INTERVAL = 0.1   # secs between beeps at zero distance
+BEEP_MAX_INTERVAL = 1.0   # secs between beeps at BEEP_MAX_DISTANCE
+VARIO_CLIMB_THRESHOLD = 100.0    # ft/min, above climb tone
+VARIO_SINK_THRESHOLD = -500.0    # ft/min, below sink tone
+VARIO_BASE_FREQUENCY = 700.0     # Hz at climb threshold
+VARIO_FREQUENCY_PER_FPM = 0.3    # Hz increase per ft/min of climb
+VARIO_MAX_FREQUENCY = 1800.0
+VARIO_SINK_FREQUENCY = 300.0
+VARIO_MIN_INTERVAL = 0.15        # secs between climb beeps at high climb rates
+VARIO_MAX_INTERVAL = 0.6         # secs between climb beeps at threshold
+VARIO_FULL_CLIMB = 1500.0        # ft/min where VARIO_MIN_INTERVAL is reached
+ERROR_BACKOFF = 0.2       # secs to wait after a failed write, increases with every further failure
+MAX_ERROR_BACKOFF = 5.0   # max secs to wait between two attempts
+REOPEN_ERRORS = 5         # failed writes in a row after which the device is reopened (e.g. bluetooth sink lost)
+
+# globals
+rlog = None
+pcm = None
+pcm_device = ALSA_DEVICE
+pcm_period_size = PERIOD_SIZE
+thread = None
+running = False
+lock = threading.Lock()
+beep_interval = None      # secs between ground beeps, None if off
+vario = None              # (frequency, interval) of vario tone, interval None is continuous, None if off
+voices = []               # list of [samples (float array), position]
+sample_no = 0             # running sample counter, gives beep timing
+vario_phase = 0.0         # phase of vario tone, continuous when frequency changes
+
+
+def open_pcm(log_error=True):   # returns the alsa pcm, None if it could not be opened
+    try:
+        return alsaaudio.PCM(type=alsaaudio.PCM_PLAYBACK, mode=alsaaudio.PCM_NORMAL, rate=SAMPLE_RATE, channels=1,
+                             format=alsaaudio.PCM_FORMAT_S16_LE, periodsize=pcm_period_size, periods=PERIODS,
+                             device=pcm_device)
+    except alsaaudio.ALSAAudioError as e:
+        if log_error:
+            rlog.debug("AudioEngine: Could not open alsa device '" + pcm_device + "': " + str(e))
+        return None
+
+
+def init(device=ALSA_DEVICE, period_size=PERIOD_SIZE):
+    global rlog
+    global pcm
+    global pcm_device
+    global pcm_period_size
+    global thread
+    global running
+
+    rlog = logging.getLogger('stratux-radar-log')
+    pcm_device = device
+    pcm_period_size = period_size
+    pcm = open_pcm()
+    if pcm is None:
+        return False
+    running = True
+    thread = threading.Thread(target=audio_streamer, args=(period_size,), daemon=True)
+    thread.start()
+    rlog.debug("AudioEngine: Streaming to '{0}' with {1} x {2} frames latency".format(device, PERIODS, period_size))
+    return True
+
+
+def terminate():
+    global running
+
+    running = False
+    if thread is not None:
+        thread.join()
+    if pcm is not None:
+        pcm.close()
+
+
+def set_ground_distance(distance):   # distance in ft, None switches ground beep off
+    global beep_interval
+
+    if distance is None or distance > BEEP_MAX_DISTANCE:
+        beep_interval = None
+    else:
+        beep_interval = BEEP_MIN_INTERVAL + (BEEP_MAX_INTERVAL - BEEP_MIN_INTERVAL) * \
+                        max(distance, 0.0) / BEEP_MAX_DISTANCE
+
+
+def set_vario(vertical_speed):   # vertical speed in ft/min, None switches vario off
+    global vario
+
+    if vertical_speed is None or VARIO_SINK_THRESHOLD <= vertical_speed <= VARIO_CLIMB_THRESHOLD:
+        vario = None
+    elif vertical_speed < VARIO_SINK_THRESHOLD:
+        vario = (VARIO_SINK_FREQUENCY, None)
+    else:
+        climb = min(vertical_speed, VARIO_FULL_CLIMB)
+        frequency = min(VARIO_MAX_FREQUENCY,
+                        VARIO_BASE_FREQUENCY + (climb - VARIO_CLIMB_THRESHOLD) * VARIO_FREQUENCY_PER_FPM)
+        interval = VARIO_MAX_INTERVAL - (VARIO_MAX_INTERVAL - VARIO_MIN_INTERVAL) * \
+            (climb - VARIO_CLIMB_THRESHOLD) / (VARIO_FULL_CLIMB - VARIO_CLIMB_THRESHOLD)
+        vario = (frequency, interval)
+
+
+def play(samples):   # mixes 16 bit mono pcm (bytes) into the output
+    if not running:
+        return
+    with lock:
+        voices.append([numpy.frombuffer(samples, dtype='<i2').astype(numpy.float32) / 32768.0, 0])
+
+
+def stop_voices():
+    with lock:
+        voices.clear()
+
+
+def busy():   # True if voices are still being played
+    with lock:
+        return len(voices) > 0
+
+
+def _beeps(t, frequency, interval, length):
+    # beep of length at the beginning of each interval, with short ramps at begin and end
+    pos = numpy.mod(t, interval)
+    envelope = numpy.clip(numpy.minimum(pos, length - pos) / RAMP_TIME, 0.0, 1.0)
+    return numpy.sin(2 * numpy.pi * frequency * t) * envelope
+
+
+def _period(size):   # next period of mixed output as float array
+    global sample_no
+    global vario_phase
+
+    t = (sample_no + numpy.arange(size)) / SAMPLE_RATE
+    sample_no += size
+    out = numpy.zeros(size, dtype=numpy.float32)
+    interval = beep_interval
+    if interval is not None:
+        out += TONE_LEVEL * _beeps(t, BEEP_FREQUENCY, interval, BEEP_LENGTH)
+    v = vario
+    if v is not None:
+        frequency, v_interval = v
+        phase = vario_phase + 2 * numpy.pi * frequency * numpy.arange(size) / SAMPLE_RATE
+        vario_phase = (vario_phase + 2 * numpy.pi * frequency * size / SAMPLE_RATE) % (2 * numpy.pi)
+        tone = numpy.sin(phase)
+        if v_interval is not None:
+            pos = numpy.mod(t, v_interval)
+            tone *= numpy.clip(numpy.minimum(pos, v_interval / 2 - pos) / RAMP_TIME, 0.0, 1.0)
+        out += TONE_LEVEL * tone
+    with lock:
+        for voice in voices:
+            samples, position = voice
+            chunk = samples[position:position + size]
+            out[:len(chunk)] += chunk
+            voice[1] = position + size
+        voices[:] = [voice for voice in voices if voice[1] < len(voice[0])]
+    return out
+
+
+def reopen_pcm():   # streamer thread, after repeated write errors
+    global pcm
+
+    if pcm is not None:
+        try:
+            pcm.close()
+        except alsaaudio.ALSAAudioError:
+            pass
+    pcm = open_pcm(log_error=False)
+    if pcm is not None:
+        rlog.debug("AudioEngine: Alsa device '" + pcm_device + "' reopened.")
+
+
+def audio_streamer(size):
+    rlog.debug("AudioEngine: Streamer thread active.")
+    errors = 0   # failed writes in a row
+    while running:
+        out = _period(size)
+        data = (numpy.clip(out, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+        try:
+            if pcm is None:
+                raise alsaaudio.ALSAAudioError("device not open")
+            pcm.write(data)    # blocks until there is space in the alsa buffer
+            if errors > 0:
+                rlog.debug("AudioEngine: Writing to alsa recovered after {0} errors.".format(errors))
+                errors = 0
+        except alsaaudio.ALSAAudioError as e:
+            errors += 1
+            if errors == 1:   # only the first one, device may be gone for a long time
+                rlog.debug("AudioEngine: Error writing to alsa: " + str(e))
+            time.sleep(min(ERROR_BACKOFF * errors, MAX_ERROR_BACKOFF))
+            if errors % REOPEN_ERRORS == 0:
+                reopen_pcm()
+    rlog.debug("AudioEngine: Streamer thread terminated.")
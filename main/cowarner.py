@@ -38,6 +38,8 @@ import radarbuttons
 import ADS1x15       # https://github.com/chandrawi/ADS1x15-ADC
 import time
 import asyncio
+import threading
+from collections import deque
 import statusui
 import radarbluez
 import RPi.GPIO as GPIO
@@ -58,11 +60,12 @@ SENSOR_VOLTAGE = 5.0   # voltage for sensor board and divider
 CO_MEASUREMENT_WINDOW = 60 * 60   # one hour, sliding window that is stored for display of ppm values
 CALIBRATION_TIME = 15   # time for calibration of sensor
 MIN_SENSOR_READ_TIME = 3
-# minimal time in secs when sensor reading thread  is generally started
-MIN_SENSOR_WAIT_TIME = 0.01
-# minimal time in secs to wait when sensor is not yet ready
+# time in secs between two published (filtered) ppm values
 MIN_SENSOR_CALIBRATION_WAIT_TIME = 0.5
 # minimal time in secs to wait during calibration and two sensor readings
+ADC_DATA_RATE = ADS1x15.ADS1115.DR_ADS111X_128   # conversions per second of the ADS in continuous mode
+SAMPLE_RATE = 32    # samples per second read by the sampler thread, below the data rate, every sample is new
+OVERSAMPLING = 16   # number of latest samples for the median used during calibration
 IOPIN = 16   # GPIO16 for indication of co warning, high on alarm (physical #36, connect to ground #34)
 INDICATION_TEST_TIME = 1   # time during startup when indication will be switched on for test
 
@@ -86,7 +89,7 @@ ADS = None
 rlog = None
 g_config = {}
 value_debug_level = 0   # debug level for printing ad-values
-co_values = []    # all values are here in ppm, maximum
+co_values = None    # CoHistory of all values in ppm, created in init
 co_max = 0      # max value read during this run or after reset
 co_warner_status = 0     # 0 - nomal status  1 - calibration in progress  2 - calibration done
 calibration_end = 0.0     # timer for calibration
@@ -98,9 +101,53 @@ co_max_values = 100   # max number of values, is calculated in init
 speak_warning = True
 indicate_co_warning = False    # GPIO 16 indication
 last_warning = 0.0   # timestamp of last warning
+sample_rate = SAMPLE_RATE
+samples = deque(maxlen=OVERSAMPLING)   # latest raw values of the sampler thread
+sample_lock = threading.Lock()
+sampler_stop = threading.Event()
+sampler_thread = None
 #
 
 
+class CoHistory:
+    # ring buffer of ppm values with running sums for the warnlevel windows. Every value is stored twice
+    # (at index and index + size), so the last values are always a contiguous slice of the buffer
+    def __init__(self, size, windows):
+        self.size = size
+        self.buffer = numpy.zeros(2 * size, dtype=numpy.int32)
+        self.head = 0     # next index to write
+        self.count = 0    # number of valid values, max size
+        self.windows = [min(w, size) for w in windows]   # window lengths in number of values
+        self.sums = [0] * len(self.windows)
+
+    def append(self, value):
+        pos = self.head + self.size   # index of the new value in the upper half
+        for i, w in enumerate(self.windows):
+            self.sums[i] += value
+            if self.count >= w > 0:
+                self.sums[i] -= int(self.buffer[pos - w])   # value leaving this window
+        self.buffer[self.head] = value
+        self.buffer[pos] = value
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def average(self, i):   # average of window i, None if not yet enough values
+        w = self.windows[i]
+        if w == 0 or self.count < w:
+            return None
+        return self.sums[i] / w
+
+    def values(self):   # chronological view on the values, no copy
+        end = self.head + self.size
+        return self.buffer[end - self.count:end]
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.sums = [0] * len(self.windows)
+
+
 def ppm(rsr0):
     val = 10 ** ((math.log10(rsr0) - 0.9) / -0.75)
     # val = 10 ** ((rsr0 - 3.3) / -1.33)
@@ -112,7 +159,7 @@ def ppm(rsr0):
     # based on own measurements compared with a CO warner
 
 
-def init(activate, config, debug_level, co_indication):
+def init(activate, config, debug_level, co_indication, rate=SAMPLE_RATE):
     global rlog
     global cowarner_active
     global voltage_factor
@@ -122,7 +169,9 @@ def init(activate, config, debug_level, co_indication):
     global r0
     global co_timeout
     global co_max_values
+    global co_values
     global indicate_co_warning
+    global sample_rate
 
     rlog = logging.getLogger('stratux-radar-log')
     if not activate:
@@ -134,8 +183,10 @@ def init(activate, config, debug_level, co_indication):
         r0 = g_config['CO_warner_R0']
         rlog.debug("CO-Warner: found R0 in config, set to {:.1f} Ohms".format(r0))
     value_debug_level = debug_level
+    sample_rate = rate
     co_timeout = MIN_SENSOR_READ_TIME
     co_max_values = math.floor(CO_MEASUREMENT_WINDOW / co_timeout)
+    co_values = CoHistory(co_max_values, [math.floor(w[1] / MIN_SENSOR_READ_TIME) for w in WARNLEVEL])
     try:
         ADS = ADS1x15.ADS1115(1, 0x48)    # ADS on I2C bus 1 with default adress
     except OSError:
@@ -143,8 +194,10 @@ def init(activate, config, debug_level, co_indication):
         rlog.debug("CO-Warner - AD sensor not found")
         return False
     # set gain to 4.096V max
-    ADS.setMode(ADS.MODE_SINGLE)  # Single shot mode
     ADS.setGain(ADS.PGA_4_096V)
+    ADS.setDataRate(ADC_DATA_RATE)
+    ADS.setMode(ADS.MODE_CONTINUOUS)   # ADS converts all the time, sampler thread only reads the last result
+    ADS.requestADC(0)  # analog 0 input, starts continuous conversion
     voltage_factor = ADS.toVoltage()
     cowarner_active = True
     rlog.debug("CO-Warner: AD converter active.")
@@ -157,12 +210,38 @@ def init(activate, config, debug_level, co_indication):
     return cowarner_active
 
 
-def request_read():
-    return ADS.requestADC(0)  # analog 0 input
-
-
-def ready():
-    return ADS.isReady()
+def sampler(loop, queue):   # sampler thread, publishes the median of all samples of every read period
+    next_read = time.monotonic()
+    next_publish = next_read + co_timeout
+    period = []
+    while not sampler_stop.is_set():
+        try:
+            raw = ADS.getValue()
+        except OSError as e:
+            rlog.debug("CO-Warner: error reading AD converter: " + str(e))
+            raw = None
+        if raw is not None:
+            with sample_lock:
+                samples.append(raw)
+            period.append(raw)
+        now = time.monotonic()
+        if now >= next_publish:
+            if len(period) > 0:
+                loop.call_soon_threadsafe(queue.put_nowait, numpy.median(period))
+            period = []
+            next_publish += co_timeout
+            if next_publish < now:   # thread was delayed, restart cadence
+                next_publish = now + co_timeout
+        next_read += 1 / sample_rate
+        sampler_stop.wait(max(0.0, next_read - time.monotonic()))
+    rlog.debug("CO-Warner: sampler thread terminated")
+
+
+def current_value():   # median of the latest samples, used for calibration
+    with sample_lock:
+        if len(samples) > 0:
+            return numpy.median(samples)
+    return ADS.getValue()
 
 
 def alarm_level():   # to be called from outside, returns 0 if no alarm, 1-5 depending on ALARMLEVEL and alarmstring
@@ -173,10 +252,8 @@ def check_alarm_level():   # check wether new alarm level should be reached, cal
     global alarmlevel
 
     for i in range(len(WARNLEVEL)-1, 0, -1):    # check all warnleves starting high e.g. (50, 3*30, "No CO alarm", None)
-        num_values = math.floor(WARNLEVEL[i][1] / MIN_SENSOR_READ_TIME)   # number of values to take into account
-        if len(co_values) >= num_values:   # if less values available, do not alarm
-            average = numpy.average(co_values[len(co_values)-num_values: len(co_values)])
-            # print("Average " + str(WARNLEVEL[i]) + ": " + str(num_values) + " values " + str(average) + " ppm")
+        average = co_values.average(i)   # running sum over the window of this level
+        if average is not None:   # if less values available, do not alarm
             if average >= WARNLEVEL[i][0]:
                 if alarmlevel != i:
                     alarmlevel = i
@@ -189,26 +266,22 @@ def check_alarm_level():   # check wether new alarm level should be reached, cal
     return False
 
 
-def read_co_value():     # called by sensor_read thread
+def read_co_value(value):     # called by sensor_read coroutine with the filtered ad value
     global cowarner_changed
-    global co_values
     global co_max
 
     cowarner_changed = True  # to display new value
-    value = ADS.getValue()
     sensor_volt = value * voltage_factor
     rs_gas = ((SENSOR_VOLTAGE * R_DIVIDER) / sensor_volt) - R_DIVIDER  # calculate resistor of sensor
     ppm_value = round(ppm(rs_gas / r0))
     rlog.log(value_debug_level,
-             "C0-Warner: Analog0: {0:5d}  {1:.3f} V  RS_gas: {2:5.3f} kOhms   RS_gas/R0: {3:3.3f}    PPM value: {4:d}"
+             "C0-Warner: Analog0: {0:7.1f}  {1:.3f} V  RS_gas: {2:5.3f} kOhms   RS_gas/R0: {3:3.3f}    PPM value: {4:d}"
              .format(value, sensor_volt, rs_gas/1000, rs_gas/r0, ppm_value))
-    # print("C0-Warner: Analog0: {0:5d}  {1:2.3f} V    RS_gas: {2:5.3f} kOhms
+    # print("C0-Warner: Analog0: {0:7.1f}  {1:2.3f} V    RS_gas: {2:5.3f} kOhms
     # RS_gas/R0: {3:3.3f}  PPM value: {4:d}".format(value, sensor_volt, rs_gas/1000, rs_gas / r0, ppm_value))
     if ppm_value > co_max:
         co_max = ppm_value
-    co_values.append(ppm_value)
-    if len(co_values) > co_max_values:    # sliding window, remove the oldest values
-        co_values.pop(0)
+    co_values.append(ppm_value)   # ring buffer, oldest value is dropped if full
     return check_alarm_level()
 
 
@@ -220,7 +293,7 @@ def draw_cowarner(display_control, changed):
         cowarner_changed = False
         display_control.clear()
         if co_warner_status == 0:   # normal mode, display status line
-            display_control.cowarner(co_values, co_max, r0, co_timeout, alarmlevel, WARNLEVEL[alarmlevel][0],
+            display_control.cowarner(co_values.values(), co_max, r0, co_timeout, alarmlevel, WARNLEVEL[alarmlevel][0],
                                      WARNLEVEL[alarmlevel][1])
         elif co_warner_status == 1:   # calibration mode
             countdown = calibration_end - math.floor(time.time())
@@ -232,7 +305,7 @@ def draw_cowarner(display_control, changed):
         display_control.display()
 
 
-def calibration():   # called by user-input thread, performs calibration and ends calibration mode
+def calibration(value):   # called with the filtered ad value, performs calibration and ends calibration mode
     global co_warner_status
     global sample_sum
     global no_samples
@@ -243,7 +316,6 @@ def calibration():   # called by user-input thread, performs calibration and end
     cowarner_changed = True  # to display new value
     countdown = calibration_end - math.floor(time.time())
     if countdown > 0:   # continue sensor reading
-        value = ADS.getValue()
         sensor_volt = value * voltage_factor
         rs_air = ((SENSOR_VOLTAGE * R_DIVIDER) / sensor_volt) - R_DIVIDER  # calculate RS in fresh air
         r0_act = rs_air / RSR0_CLEAN  # r0, based on clean air measurement
@@ -261,7 +333,6 @@ def calibration():   # called by user-input thread, performs calibration and end
 def user_input():
     global cowarner_changed
     global co_max
-    global co_values
     global co_warner_status
     global calibration_end
     global sample_sum
@@ -280,7 +351,7 @@ def user_input():
         calibration_end = math.floor(time.time() + CALIBRATION_TIME)
         sample_sum = 0.0
         no_samples = 0
-        calibration()
+        calibration(current_value())
         co_warner_status = 1
     if button == 0 and btime == 2:  # left and long
         return 3  # start next mode shutdown!
@@ -296,7 +367,8 @@ def speak_co_warning(changed):
     global last_warning
     if speak_warning and alarmlevel > 0:
         if changed or time.time() - last_warning >= WARNLEVEL[alarmlevel][3]:
-            radarbluez.speak("CO Alarm! " + str(WARNLEVEL[alarmlevel][0]) + " ppm")
+            radarbluez.speak("CO Alarm! " + str(WARNLEVEL[alarmlevel][0]) + " ppm", priority=radarbluez.PRIO_CO,
+                            key='co')
             last_warning = time.time()
 
 
@@ -311,27 +383,36 @@ def set_co_indication(changed):
 
 
 async def read_sensors():
+    global sampler_thread
+
     if cowarner_active:
+        queue = asyncio.Queue()   # filtered values published by the sampler thread
         try:
             rlog.debug("Sensor reader active ...")
+            sampler_stop.clear()
+            sampler_thread = threading.Thread(target=sampler, args=(asyncio.get_running_loop(), queue), daemon=True)
+            sampler_thread.start()
             if indicate_co_warning:
                 rlog.debug("CO-Warner: Flashing GPIO Pin " + str(IOPIN) + " to test indication")
                 GPIO.output(IOPIN, GPIO.HIGH)
                 await asyncio.sleep(INDICATION_TEST_TIME)
                 GPIO.output(IOPIN, GPIO.LOW)
             while True:
-                request_read()
-                while not ready():
-                    await asyncio.sleep(MIN_SENSOR_WAIT_TIME)
                 if co_warner_status == 0:   # normal read
-                    changed = read_co_value()
-                    speak_co_warning(changed)
-                    set_co_indication(changed)
-                    await asyncio.sleep(MIN_SENSOR_READ_TIME)
+                    value = await queue.get()
+                    if co_warner_status == 0:   # calibration may have been started while waiting
+                        changed = read_co_value(value)
+                        speak_co_warning(changed)
+                        set_co_indication(changed)
                 else:
-                    calibration()
+                    calibration(current_value())
                     await asyncio.sleep(MIN_SENSOR_CALIBRATION_WAIT_TIME)
+                    if co_warner_status == 0:   # calibration finished, drop values published meanwhile
+                        while not queue.empty():
+                            queue.get_nowait()
         except (asyncio.CancelledError, RuntimeError):
             rlog.debug("Sensor reader terminating ...")
+        finally:
+            sampler_stop.set()
     else:
         rlog.debug("No co-sensor active.")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+
+# Reduction of time series for the graphs of the displays. A series with more values than pixel columns is
+# reduced to a min/max envelope with at most two points per column, so the graph can be drawn as one polyline
+# with a fixed number of segments independent of the length of the series (co values, g-load, vsi, ...).
+
+import math
+import numpy
+
+
+def envelope(data, columns):
+    # returns (column index, value) arrays, at most two values per column. Per column min and max are kept in the
+    # order of the series (rising: min then max, falling: max then min), so the line stays continuous
+    values = numpy.asarray(data, dtype=float)
+    n = len(values)
+    if n <= 2 * columns:
+        return numpy.arange(n) * (columns - 1) / max(n - 1, 1), values
+    starts = (numpy.arange(columns) * n) // columns   # first value of each column
+    ends = numpy.append(starts[1:], n) - 1             # last value of each column
+    lows = numpy.minimum.reduceat(values, starts)
+    highs = numpy.maximum.reduceat(values, starts)
+    rising = values[ends] >= values[starts]
+    pairs = numpy.column_stack((numpy.where(rising, lows, highs), numpy.where(rising, highs, lows)))
+    return numpy.repeat(numpy.arange(columns, dtype=float), 2), pairs.ravel()
+
+
+def polyline(data, xpos, ypos, xsize, ysize, minvalue, maxvalue, yoffset=0):
+    # list of points of the series scaled into the box, values outside are clipped to the box. Empty if less
+    # than two values, nothing to draw then
+    if len(data) < 2:
+        return []
+    columns = max(2, math.floor(xsize))
+    cols, values = envelope(data, columns)
+    xs = xpos + cols * xsize / (columns - 1)
+    ys = ypos + yoffset + ysize - ysize * (values - minvalue) / (maxvalue - minvalue)
+    ys = numpy.clip(ys, ypos, ypos + ysize - 1)
+    return list(zip(xs.tolist(), ys.tolist()))
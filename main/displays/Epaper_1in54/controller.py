@@ -31,12 +31,15 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
 
-from . import epd1in54_V2
 from PIL import Image, ImageDraw, ImageFont
 import math
+import numpy
 import time
 import datetime
 from pathlib import Path
+import displaytiming
+import decimation
+import textcache
 
 # global constants
 VERYLARGE = 30    # timer
@@ -49,6 +52,9 @@ AIRCRAFT_SIZE = 4        # size of aircraft arrow
 MINIMAL_CIRCLE = 10     # minimal size of mode-s circle
 ARCPOSITION_EXCLUDE_FROM = 0
 ARCPOSITION_EXCLUDE_TO = 0
+GHOSTING_MAX_PARTIAL = 600   # max number of changed partial updates before a full refresh is due
+GHOSTING_MAX_AREA = 10.0   # max accumulated changed pixels (in multiples of the display area) before refresh is due
+FLIGHT_LINES = 5   # flights per page of flight log
 # end definitions
 
 # global device properties
@@ -79,6 +85,10 @@ cdraw = None
 draw = None
 cmsize = 14        # length of compass marks
 space = 2
+# ghosting
+last_buffer = None   # buffer of last displayed frame, to compare changed pixels
+partial_updates = 0   # number of partial updates with changes since last full refresh
+changed_area = 0   # accumulated number of changed pixels since last full refresh
 # end device globals
 
 
@@ -94,11 +104,34 @@ def make_font(name, size):
 
 
 def display():
-    device.async_displayPart(device.getbuffer_optimized(epaper_image))
+    global last_buffer
+    global partial_updates
+    global changed_area
+
+    displaytiming.render_done()
+    buf = device.getbuffer_optimized(epaper_image)
+    if last_buffer is not None:
+        changed = int(numpy.unpackbits(numpy.bitwise_xor(buf, last_buffer)).sum())
+        if changed > 0:
+            partial_updates += 1
+            changed_area += changed
+    last_buffer = buf
+    device.async_displayPart(buf)
+    displaytiming.transfer_done()
 
 
 def is_busy():
-    return device.async_is_busy()
+    busy = device.async_is_busy()
+    if busy:
+        displaytiming.busy_polled()
+    else:
+        displaytiming.busy_done()
+    return busy
+
+
+def ghosting_refresh_due():
+    # partial updates leave ghosting on the epaper, after a number of updates or changes a full refresh is due
+    return partial_updates >= GHOSTING_MAX_PARTIAL or changed_area >= GHOSTING_MAX_AREA * sizex * sizey
 
 
 def next_arcposition(old_arcposition):
@@ -124,7 +157,7 @@ def translate(angle, points, zero):
     return result
 
 
-def init(fullcircle=False):
+def init(fullcircle=False, virtual_device=None):
     global sizex
     global sizey
     global zerox
@@ -145,7 +178,11 @@ def init(fullcircle=False):
     global cdraw
     global draw
 
-    device = epd1in54_V2.EPD()
+    if virtual_device is None:
+        from . import epd1in54_V2   # hardware driver only imported when a real display is used
+        device = epd1in54_V2.EPD()
+    else:
+        device = virtual_device   # e.g. handed over by displays/Virtual
     device.init(0)
     device.Clear(0xFF)   # necessary to overwrite everything
     epaper_image = Image.new('1', (device.height, device.width), 0xFF)
@@ -186,27 +223,37 @@ def cleanup():
 
 
 def refresh():
+    global last_buffer
+    global partial_updates
+    global changed_area
+
+    start = time.perf_counter()
     device.Clear(0xFF)  # necessary to overwrite everything
     device.init(1)
+    last_buffer = None
+    partial_updates = 0
+    changed_area = 0
+    displaytiming.full_refresh(time.perf_counter() - start)
 
 
 def clear():
+    displaytiming.render_start()
     draw.rectangle((0, 0, sizex - 1, sizey - 1), fill="white")  # clear everything in image
 
 
 def centered_text(y, text, font, fill):
-    tl = draw.textlength(text, font)
-    draw.text((zerox - tl / 2, y), text, font=font, fill=fill)
+    tl = textcache.textlength(draw, text, font)
+    textcache.text(draw, (zerox - tl / 2, y), text, font, fill)
 
 
 def right_text(y, text, font, fill, offset=0):
-    tl = draw.textlength(text, font)
-    draw.text((sizex - tl - offset, y), text, font=font, fill=fill)
+    tl = textcache.textlength(draw, text, font)
+    textcache.text(draw, (sizex - tl - offset, y), text, font, fill)
 
 
 def bottom_line(left, middle, right, offset=0):  # offset to be able to print letters like p and q
     draw.text((0, sizey - SMALL - offset), left, font=smallfont, fill="black")
-    textlength = draw.textlength(right, smallfont)
+    textlength = textcache.textlength(draw, right, smallfont)
     draw.text((sizex - textlength, sizey - SMALL - offset), right, font=smallfont, fill="black", align="right")
     centered_text(sizey - SMALL - offset, middle, smallfont, fill="black")
 
@@ -231,6 +278,8 @@ def aircraft(x, y, direction, height, vspeed, nspeed_length, tail):
     draw.polygon(((x + p1[0], y + p1[1]), (x + p2[0], y + p2[1]), (x + p3[0], y + p3[1]), (x + p4[0], y + p4[1])),
                  fill="black", outline="black")
     draw.line((x + p1[0], y + p1[1], x + p5[0], y + p5[1]), fill="black", width=3)
+    if height is None:
+        return   # label dropped by radar, e.g. if frame time budget is exceeded
     if height >= 0:
         t = "+" + str(abs(height))
     else:
@@ -239,14 +288,14 @@ def aircraft(x, y, direction, height, vspeed, nspeed_length, tail):
         t = t + '\u2197'
     if vspeed < 0:
         t = t + '\u2198'
-    tl = draw.textlength(t, verylargefont)
+    tl = textcache.textlength(draw, t, verylargefont)
     if tl + x + 4 * AIRCRAFT_SIZE - 2 > sizex:
         # would draw text outside, move to the left
         tposition = (x - 4 * AIRCRAFT_SIZE - tl, int(y - VERYLARGE / 2))
     else:
         tposition = (x + 4 * AIRCRAFT_SIZE + 1, int(y - VERYLARGE / 2))
     # draw.rectangle((tposition, (tposition[0] + tl, tposition[1] + LARGE)), fill="white")
-    draw.text(tposition, t, font=verylargefont, fill="black")
+    textcache.text(draw, tposition, t, verylargefont, "black")
     if tail is not None:
         draw.text((tposition[0], tposition[1] + VERYLARGE), tail, font=verysmallfont, fill="black")
 
@@ -265,12 +314,12 @@ def modesaircraft(radius, height, arcposition, vspeed, tail):
         t = t + '\u2197'
     if vspeed < 0:
         t = t + '\u2198'
-    tl = draw.textlength(t, verylargefont)
+    tl = textcache.textlength(draw, t, verylargefont)
     tposition = (zerox+arctext[0]-tl/2, zeroy+arctext[1]-VERYLARGE/2)
     draw.rectangle((tposition, (tposition[0]+tl, tposition[1]+VERYLARGE)), fill="white")
-    draw.text(tposition, t, font=verylargefont, fill="black")
+    textcache.text(draw, tposition, t, verylargefont, "black")
     if tail is not None:
-        tl = draw.textlength(tail, verysmallfont)
+        tl = textcache.textlength(draw, tail, verysmallfont)
         draw.rectangle((tposition[0], tposition[1] + VERYLARGE, tposition[0] + tl,
                         tposition[1] + VERYLARGE + VERYSMALL), fill="white")
         draw.text((tposition[0], tposition[1] + VERYLARGE), tail, font=verysmallfont, fill="black")
@@ -291,14 +340,14 @@ def situation(connected, gpsconnected, ownalt, course, range, altdifference, bt_
         t = str(int(altdifference / 1000)) + "k"
     else:
         t = str(altdifference)
-    tl = draw.textlength(t, smallfont)
+    tl = textcache.textlength(draw, t, smallfont)
     draw.text((sizex - tl, 0), t, font=smallfont, fill="black", align="right")
     text = "ft"
-    tl = draw.textlength(text, verysmallfont)
+    tl = textcache.textlength(draw, text, verysmallfont)
     draw.text((sizex - tl, SMALL), text, font=verysmallfont, fill="black", align="right")
 
     text = str(course) + '°'
-    tl = draw.textlength(text, smallfont)
+    tl = textcache.textlength(draw, text, smallfont)
     draw.text((sizex - tl, sizey - SMALL), text, font=smallfont, fill="black", align="right")
 
     if not gpsconnected:
@@ -318,7 +367,7 @@ def situation(connected, gpsconnected, ownalt, course, range, altdifference, bt_
                 t += "\uf293"  # bluetooth symbol
         else:
             t = "\uf1f6"  # bell off symbol
-        tl = draw.textlength(t, awesomefont)
+        tl = textcache.textlength(draw, t, awesomefont)
         draw.text((sizex - tl, sizey - 2 * SMALL), t, font=awesomefont, fill="black")
 
     # optical keep alive bar at right side, for the small display only 5 bars
@@ -368,7 +417,7 @@ def meter(current, start_value, end_value, from_degree, to_degree, size, center_
         draw.line(mark, fill="black", width=3)
         # text
         marktext = str(m)
-        tl = draw.textlength(marktext, largefont)
+        tl = textcache.textlength(draw, marktext, largefont)
         t_center = translate(angle, ((0, -size/2 + big_mark_length + LARGE/2 + text_distance), ), (center_x, center_y))
         draw.text((t_center[0][0]-tl/2, t_center[0][1]-LARGE/2), marktext, fill="black", font=largefont)
         m += marks_distance
@@ -384,10 +433,10 @@ def meter(current, start_value, end_value, from_degree, to_degree, size, center_
     draw.ellipse((center_x - 10, center_y - 10, center_x + 10, center_y + 10), fill="black")
 
     if middle_text1 is not None:
-        tl = draw.textlength(middle_text1, smallfont)
+        tl = textcache.textlength(draw, middle_text1, smallfont)
         draw.text((center_x-tl/2, center_y-SMALL-20), middle_text1, font=smallfont, fill="black", align="left")
     if middle_text2 is not None:
-        tl = draw.textlength(middle_text2, smallfont)
+        tl = textcache.textlength(draw, middle_text2, smallfont)
         draw.text((center_x-tl/2, center_y+20), middle_text2, font=smallfont, fill="black", align="left")
 
 
@@ -414,7 +463,7 @@ def compass(heading, error_message):
     draw.bitmap((zerox-96/2+3, zeroy-96/2-2), compass_aircraft, fill="black")
     draw.line((czerox, 15, czerox, 50), fill="black", width=4)
     text = str(heading) + '°'
-    tl = draw.textlength(text, smallfont)
+    tl = textcache.textlength(draw, text, smallfont)
     draw.text((sizex - tl, sizey - SMALL - 5), text, font=smallfont, fill="black", align="right")
     for m in range(0, 360, 10):
         s = math.sin(math.radians(m - heading + 90))
@@ -437,10 +486,10 @@ def compass(heading, error_message):
             else:
                 mark = str(int(m / 10))
             if m % 90 != 0:
-                tl = draw.textlength(mark, largefont)
+                tl = textcache.textlength(draw, mark, largefont)
                 cdraw.text(((LARGE * 2 - tl) / 2, LARGE / 2), mark, 1, font=largefont)
             else:
-                tl = draw.textlength(mark, morelargefont)
+                tl = textcache.textlength(draw, mark, morelargefont)
                 cdraw.text(((LARGE * 2 - tl) / 2, LARGE / 2), mark, 1, font=morelargefont)
             rotmask = mask.rotate(-m + heading, expand=False)
             center = (czerox - (csize - cmsize - LARGE / 2) * c, czeroy - (csize - cmsize - LARGE / 2) * s)
@@ -455,10 +504,10 @@ def vsi(vertical_speed, flight_level, gps_speed, gps_course, gps_altitude, verti
     draw.text((15, sizey/2 - VERYSMALL - 10), "up", font=verysmallfont, fill="black", align="left")
     draw.text((15, sizey/2 + 10), "dn", font=verysmallfont, fill="black", align="left")
     middle_text = "Vert Spd"
-    tl = draw.textlength(middle_text, verysmallfont)
+    tl = textcache.textlength(draw, middle_text, verysmallfont)
     draw.text((sizey/2 - tl/2, sizey/2 - VERYSMALL - 10), middle_text, font=verysmallfont, fill="black", align="left")
     middle_text = "100 ft/min"
-    tl = draw.textlength(middle_text, verysmallfont)
+    tl = textcache.textlength(draw, middle_text, verysmallfont)
     draw.text((sizey/2 - tl / 2, sizey/2 + 10), middle_text, font=verysmallfont, fill="black", align="left")
 
     if error_message is not None:
@@ -600,7 +649,7 @@ def bar(y, text, val, max_val, yellow, red, unit="", valtext=None, minval=0):
 
     draw.text((0, y), text, font=verysmallfont, fill="black", align="left")
     right_val = str(int(max_val)) + unit
-    tl = draw.textlength(right_val, verysmallfont)
+    tl = textcache.textlength(draw, right_val, verysmallfont)
     draw.text((sizex-tl, y), right_val, font=verysmallfont, fill="black", align="right")
     draw.rounded_rectangle([bar_start-3, y-1, bar_end+3, y+VERYSMALL+1], radius=3, fill=None, outline="black", width=1)
     if val < minval:
@@ -616,14 +665,14 @@ def bar(y, text, val, max_val, yellow, red, unit="", valtext=None, minval=0):
         t = valtext
     else:
         t = str(val)
-    tl = draw.textlength(t, verysmallfont)
+    tl = textcache.textlength(draw, t, verysmallfont)
     draw.text(((bar_end-bar_start)/2+bar_start-tl/2, y), t, font=verysmallfont, fill="black",
               stroke_width=1, stroke_fill="white")
     return y+VERYSMALL+6
 
 
 def round_text(x, y, text, color, yesno=True, out=None):
-    tl = draw.textlength(text, verysmallfont)
+    tl = textcache.textlength(draw, text, verysmallfont)
     draw.rounded_rectangle([x, y-2, x+tl+10, y+VERYSMALL+3], radius=4, fill=color, outline=out)
     draw.text((x+5, y), text, font=verysmallfont, fill="black")
     if not yesno:
@@ -675,9 +724,12 @@ def stratux(stat, altitude, gps_alt, gps_quality):
     right_text(starty, "GAlt" + alt + "ft", verysmallfont, "black")
 
 
-def flighttime(last_flights):
+def flighttime(last_flights, page, pages, totals, confirm_clear=False):   # totals: secs today and this month
     starty = 0
-    centered_text(0, "Flight Logs", smallfont, fill="black")
+    if pages > 1:
+        centered_text(0, "Flights {0}/{1}".format(page + 1, pages), smallfont, fill="black")
+    else:
+        centered_text(0, "Flight Logs", smallfont, fill="black")
     starty += SMALL + 5
 
     draw.text((0, starty), "Date", font=verysmallfont, fill="black")
@@ -686,7 +738,7 @@ def flighttime(last_flights):
     draw.text((155, starty), "Ldg", font=verysmallfont, fill="black")
     starty += VERYSMALL + 5
 
-    maxlines = 6
+    maxlines = FLIGHT_LINES
     for f in last_flights:
         f[0] = f[0].replace(second=0, microsecond=0)   # round down start time to minutes
         draw.text((0, starty), f[0].strftime("%d.%m."), font=verysmallfont, fill="black")
@@ -707,11 +759,15 @@ def flighttime(last_flights):
         maxlines -= 1
         if maxlines <= 0:
             break
-    bottom_line("", "Mode", "Clear")
+    starty = SMALL + 5 + VERYSMALL + 5 + FLIGHT_LINES * (VERYSMALL + 2)
+    today = '{:02}:{:02}'.format(int(totals[0] // 3600), int(totals[0] % 3600 // 60))
+    month = '{:02}:{:02}'.format(int(totals[1] // 3600), int(totals[1] % 3600 // 60))
+    centered_text(starty, "Day " + today + " Mon " + month, verysmallfont, fill="black")
+    bottom_line("Page" if pages > 1 else "", "Mode", "Confirm" if confirm_clear else "Clear")
 
 
 def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value_line2, timeout):
-    tl = draw.textlength(str(maxvalue), verysmallfont)    # for adjusting x and y
+    tl = textcache.textlength(draw, str(maxvalue), verysmallfont)    # for adjusting x and y
     # adjust zero lines to have room for text
     xpos = xpos + tl + space
     xsize = xsize - tl - space
@@ -719,19 +775,19 @@ def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value
     ysize = ysize - VERYSMALL
 
     vlmin_y = ypos + ysize - 1
-    tl = draw.textlength(str(minvalue), verysmallfont)
+    tl = textcache.textlength(draw, str(minvalue), verysmallfont)
     draw.text((xpos - tl - space, vlmin_y - VERYSMALL), str(minvalue), font=verysmallfont, fill="black")
 
     vl1_y = ypos + ysize - ysize * (value_line1 - minvalue) / (maxvalue - minvalue)
-    tl = draw.textlength(str(value_line1), verysmallfont)
+    tl = textcache.textlength(draw, str(value_line1), verysmallfont)
     draw.text((xpos - tl - space, vl1_y - VERYSMALL/2), str(value_line1), font=verysmallfont, fill="black")
 
     vl2_y = ypos + ysize - ysize * (value_line2 - minvalue) / (maxvalue - minvalue)
-    tl = draw.textlength(str(value_line2), verysmallfont)
+    tl = textcache.textlength(draw, str(value_line2), verysmallfont)
     draw.text((xpos - tl - space, vl2_y - VERYSMALL/2), str(value_line2), font=verysmallfont, fill="black")
 
     vlmax_y = ypos
-    tl = draw.textlength(str(maxvalue), verysmallfont)
+    tl = textcache.textlength(draw, str(maxvalue), verysmallfont)
     draw.text((xpos - tl - space, vlmax_y - VERYSMALL/2), str(maxvalue), font=verysmallfont, fill="black")
 
     draw.rectangle((xpos, ypos, xpos+xsize-1, ypos+ysize-1), outline="black", width=3, fill="white")
@@ -740,7 +796,7 @@ def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value
     no_of_values = len(data)
     full_time = timeout * no_of_values   # time for full display in secs
     timestr = time.strftime("%H:%M", time.gmtime())
-    tl = draw.textlength(timestr, verysmallfont)
+    tl = textcache.textlength(draw, timestr, verysmallfont)
     no_of_time = math.floor(xsize / tl / 2) + 1   # calculate maximum number of time indications
     time_offset = full_time / no_of_time
     offset = math.floor((xsize-1) / no_of_time)
@@ -751,19 +807,9 @@ def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value
         timestr = time.strftime("%H:%M", time.gmtime(math.floor(acttime - (no_of_time-i) * time_offset)))
         draw.text((x - tl/2, ypos+ysize-1 + 1), timestr, font=verysmallfont, fill="black")
         x = x + offset
-    lastpoint = None
-    for i in range(0, len(data)):
-        y = ypos-1 + ysize - ysize * (data[i] - minvalue) / (maxvalue - minvalue)
-        if y < ypos:
-            y = ypos   # if value is outside
-        if y > ypos+ysize-1:
-            x = ypos+ysize-1
-        if i >= 1:  # we need at least two points before we draw
-            x = xpos + i * xsize / (len(data)-1)
-            draw.line([lastpoint, (x, y)], fill="black", width=2)
-        else:
-            x = xpos
-        lastpoint = (x, y)
+    points = decimation.polyline(data, xpos, ypos, xsize, ysize, minvalue, maxvalue, yoffset=-1)
+    if len(points) >= 2:   # at most two points per pixel column, drawn as one line
+        draw.line(points, fill="black", width=2, joint="curve")
     # value_line 1
     y = ypos + ysize - ysize * (value_line1 - minvalue) / (maxvalue - minvalue)
     for x in range(xpos, xpos+xsize, 6):
@@ -796,7 +842,7 @@ def dashboard(x, y, sizex, lines):
     starty = y
     for line in lines:
         draw.text((x, starty), line[0], font=smallfont, fill="black", align="left")
-        tl = draw.textlength(line[1], smallfont)
+        tl = textcache.textlength(draw, line[1], smallfont)
         draw.text((x+sizex-tl, starty), line[1], font=smallfont, fill="black")
         starty += SMALL+2
     return starty
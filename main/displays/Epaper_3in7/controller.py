@@ -31,12 +31,15 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
 
-from . import epd3in7
 from PIL import Image, ImageDraw, ImageFont
 import math
+import numpy
 import time
 import datetime
 from pathlib import Path
+import displaytiming
+import decimation
+import textcache
 import logging
 
 # global constants
@@ -50,6 +53,9 @@ AIRCRAFT_SIZE = 6        # size of aircraft arrow
 MINIMAL_CIRCLE = 20     # minimal size of mode-s circle
 ARCPOSITION_EXCLUDE_FROM = 110
 ARCPOSITION_EXCLUDE_TO = 250
+GHOSTING_MAX_PARTIAL = 600   # max number of changed partial updates before a full refresh is due
+GHOSTING_MAX_AREA = 10.0   # max accumulated changed pixels (in multiples of the display area) before refresh is due
+FLIGHT_LINES = 7   # flights per page of flight log
 # end definitions
 
 # global device properties
@@ -81,6 +87,10 @@ draw = None
 cmsize = 20        # length of compass marks
 # co warner
 space = 3  # space between scale figures and zero line
+# ghosting
+last_buffer = None   # buffer of last displayed frame, to compare changed pixels
+partial_updates = 0   # number of partial updates with changes since last full refresh
+changed_area = 0   # accumulated number of changed pixels since last full refresh
 # end device globals
 
 top_index = 0    # top index being displayed in checklist
@@ -99,11 +109,34 @@ def make_font(name, size):
 
 
 def display():
-    device.async_display_1Gray(device.getbuffer_optimized(epaper_image))
+    global last_buffer
+    global partial_updates
+    global changed_area
+
+    displaytiming.render_done()
+    buf = device.getbuffer_optimized(epaper_image)
+    if last_buffer is not None:
+        changed = int(numpy.unpackbits(numpy.bitwise_xor(buf, last_buffer)).sum())
+        if changed > 0:
+            partial_updates += 1
+            changed_area += changed
+    last_buffer = buf
+    device.async_display_1Gray(buf)
+    displaytiming.transfer_done()
 
 
 def is_busy():
-    return device.async_is_busy()
+    busy = device.async_is_busy()
+    if busy:
+        displaytiming.busy_polled()
+    else:
+        displaytiming.busy_done()
+    return busy
+
+
+def ghosting_refresh_due():
+    # partial updates leave ghosting on the epaper, after a number of updates or changes a full refresh is due
+    return partial_updates >= GHOSTING_MAX_PARTIAL or changed_area >= GHOSTING_MAX_AREA * sizex * sizey
 
 
 def next_arcposition(old_arcposition):
@@ -129,7 +162,7 @@ def translate(angle, points, zero):
     return result
 
 
-def init(fullcircle=False):
+def init(fullcircle=False, virtual_device=None):
     global sizex
     global sizey
     global zerox
@@ -152,7 +185,11 @@ def init(fullcircle=False):
     global draw
 
     rlog = logging.getLogger('stratux-radar-log')
-    device = epd3in7.EPD()
+    if virtual_device is None:
+        from . import epd3in7   # hardware driver only imported when a real display is used
+        device = epd3in7.EPD()
+    else:
+        device = virtual_device   # e.g. handed over by displays/Virtual
     device.init(0)
     device.Clear(0xFF, 0)   # necessary to overwrite everything
     epaper_image = Image.new('1', (device.height, device.width), 0xFF)
@@ -198,27 +235,37 @@ def cleanup():
 
 
 def refresh():
+    global last_buffer
+    global partial_updates
+    global changed_area
+
+    start = time.perf_counter()
     device.Clear(0xFF, 0)  # necessary to overwrite everything
     device.init(1)
+    last_buffer = None
+    partial_updates = 0
+    changed_area = 0
+    displaytiming.full_refresh(time.perf_counter() - start)
 
 
 def clear():
+    displaytiming.render_start()
     draw.rectangle((0, 0, sizex - 1, sizey - 1), fill="white")  # clear everything in image
 
 
 def centered_text(y, text, font, fill):
-    tl = draw.textlength(text, font)
-    draw.text((zerox - tl / 2, y), text, font=font, fill=fill)
+    tl = textcache.textlength(draw, text, font)
+    textcache.text(draw, (zerox - tl / 2, y), text, font, fill)
 
 
 def right_text(y, text, font, fill, offset=0):
-    tl = draw.textlength(text, font)
-    draw.text((sizex-5-tl-offset, y), text, font=font, fill=fill)
+    tl = textcache.textlength(draw, text, font)
+    textcache.text(draw, (sizex-5-tl-offset, y), text, font, fill)
 
 
 def bottom_line(left, middle, right):
     draw.text((5, sizey - SMALL - 3), left, font=smallfont, fill="black")
-    textlength = draw.textlength(right, smallfont)
+    textlength = textcache.textlength(draw, right, smallfont)
     draw.text((sizex - textlength - 8, sizey - SMALL - 3), right, font=smallfont, fill="black", align="right")
     centered_text(sizey - SMALL - 3, middle, smallfont, fill="black")
 
@@ -244,6 +291,8 @@ def aircraft(x, y, direction, height, vspeed, nspeed_length, tail):
     draw.polygon(((x + p1[0], y + p1[1]), (x + p2[0], y + p2[1]), (x + p3[0], y + p3[1]), (x + p4[0], y + p4[1])),
                  fill="black", outline="black")
     draw.line((x + p1[0], y + p1[1], x + p5[0], y + p5[1]), fill="black", width=3)
+    if height is None:
+        return   # label dropped by radar, e.g. if frame time budget is exceeded
     if height >= 0:
         t = "+" + str(abs(height))
     else:
@@ -252,13 +301,13 @@ def aircraft(x, y, direction, height, vspeed, nspeed_length, tail):
         t = t + '\u2197'
     if vspeed < 0:
         t = t + '\u2198'
-    w = draw.textlength(t, largefont)
+    w = textcache.textlength(draw, t, largefont)
     if w + x + 4 * AIRCRAFT_SIZE - 2 > sizex:
         # would draw text outside, move to the left
         tposition = (x - 4 * AIRCRAFT_SIZE - w, int(y - LARGE/2))
     else:
         tposition = (x + 4 * AIRCRAFT_SIZE + 1, int(y - LARGE/2))
-    draw.text(tposition, t, font=largefont, fill="black")
+    textcache.text(draw, tposition, t, largefont, "black")
     if tail is not None:
         draw.text((tposition[0], tposition[1] + LARGE), tail, font=verysmallfont, fill="black")
 
@@ -277,12 +326,12 @@ def modesaircraft(radius, height, arcposition, vspeed, tail):
         t = t + '\u2197'
     if vspeed < 0:
         t = t + '\u2198'
-    w = draw.textlength(t, largefont)
+    w = textcache.textlength(draw, t, largefont)
     tposition = (zerox+arctext[0]-w/2, zeroy+arctext[1]-LARGE/2)
     draw.rectangle((tposition, (tposition[0]+w, tposition[1]+LARGE+2)), fill="white")
-    draw.text(tposition, t, font=largefont, fill="black")
+    textcache.text(draw, tposition, t, largefont, "black")
     if tail is not None:
-        tl = draw.textlength(tail, verysmallfont)
+        tl = textcache.textlength(draw, tail, verysmallfont)
         draw.rectangle((tposition[0], tposition[1] + LARGE, tposition[0] + tl,
                         tposition[1] + LARGE + VERYSMALL), fill="white")
         draw.text((tposition[0], tposition[1] + LARGE), tail, font=verysmallfont, fill="black")
@@ -309,11 +358,11 @@ def situation(connected, gpsconnected, ownalt, course, range, altdifference, bt_
     draw.text((5, SMALL+10), t, font=verysmallfont, fill="black")
 
     t = "FL"+str(round(ownalt / 100))
-    textlength = draw.textlength(t, verysmallfont)
+    textlength = textcache.textlength(draw, t, verysmallfont)
     draw.text((sizex - textlength - 5, SMALL+10), t, font=verysmallfont, fill="black")
 
     t = str(altdifference) + " ft"
-    textlength = draw.textlength(t, smallfont)
+    textlength = textcache.textlength(draw, t, smallfont)
     draw.text((sizex - textlength - 5, 1), t, font=smallfont, fill="black", align="right")
 
     text = str(course) + '°'
@@ -335,7 +384,7 @@ def situation(connected, gpsconnected, ownalt, course, range, altdifference, bt_
                 t += "\uf293"  # bluetooth symbol
         else:
             t = "\uf1f6"  # bell off symbol
-        textlength = draw.textlength(t, awesomefont)
+        textlength = textcache.textlength(draw, t, awesomefont)
         draw.text((sizex - textlength - 5, sizey - SMALL), t, font=awesomefont, fill="black")
 
     # optical keep alive bar at right side
@@ -353,7 +402,7 @@ def timer(utctime, stoptime, laptime, laptime_head, left_text, middle_text, righ
             centered_text(3*SMALL+2*VERYLARGE, laptime, verylargefont, fill="black")
 
     draw.text((5, sizey-SMALL-3), left_text, font=smallfont, fill="black")
-    textlength = draw.textlength(right_t, smallfont)
+    textlength = textcache.textlength(draw, right_t, smallfont)
     draw.text((sizex-textlength-8, sizey-SMALL-3), right_t, font=smallfont, fill="black", align="right")
     centered_text(sizey-SMALL-3, middle_text, smallfont, fill="black")
 
@@ -389,7 +438,7 @@ def meter(current, start_value, end_value, from_degree, to_degree, size, center_
         draw.line(mark, fill="black", width=4)
         # text
         marktext = str(m)
-        tl = draw.textlength(marktext, largefont)
+        tl = textcache.textlength(draw, marktext, largefont)
         t_center = translate(angle, ((0, -size/2 + big_mark_length + LARGE/2 + text_distance), ), (center_x, center_y))
         draw.text((t_center[0][0]-tl/2, t_center[0][1]-LARGE/2), marktext, fill="black", font=largefont)
         m += marks_distance
@@ -405,10 +454,10 @@ def meter(current, start_value, end_value, from_degree, to_degree, size, center_
     draw.ellipse((center_x - 10, center_y - 10, center_x + 10, center_y + 10), fill="black")
 
     if middle_text1 is not None:
-        tl = draw.textlength(middle_text1, smallfont)
+        tl = textcache.textlength(draw, middle_text1, smallfont)
         draw.text((center_x - tl/2, center_y - SMALL - 20), middle_text1, font=smallfont, fill="black", align="left")
     if middle_text2 is not None:
-        tl = draw.textlength(middle_text2, smallfont)
+        tl = textcache.textlength(draw, middle_text2, smallfont)
         draw.text((center_x-tl/2, center_y+20), middle_text2, font=smallfont, fill="black", align="left")
 
 
@@ -418,7 +467,7 @@ def gmeter(current, maxg, ming, error_message):
 
     right_center_x = (sizex-gm_size)/2+gm_size    # center of remaining part
     t = "G-Meter"
-    tl = draw.textlength(t, largefont)
+    tl = textcache.textlength(draw, t, largefont)
     draw.text((right_center_x - tl / 2, 30), t, font=largefont, fill="black", align="left")
     draw.text((gm_size+30, 98), "max", font=smallfont, fill="black")
     right_text(95, "{:+1.2f}".format(maxg), largefont, fill="black")
@@ -442,7 +491,7 @@ def compass(heading, error_message):
     draw.bitmap((zerox - 60, 70), compass_aircraft, fill="black")
     draw.line((czerox, 20, czerox, 70), fill="black", width=4)
     text = str(heading) + '°'
-    tl = draw.textlength(text, smallfont)
+    tl = textcache.textlength(draw, text, smallfont)
     draw.text((sizex - tl - 100, sizey - SMALL - 10), text, font=smallfont, fill="black", align="right")
     for m in range(0, 360, 10):
         s = math.sin(math.radians(m - heading + 90))
@@ -465,10 +514,10 @@ def compass(heading, error_message):
             else:
                 mark = str(int(m / 10))
             if m % 90 != 0:
-                tl = draw.textlength(mark, largefont)
+                tl = textcache.textlength(draw, mark, largefont)
                 cdraw.text(((LARGE * 2 - tl) / 2, LARGE / 2), mark, 1, font=largefont)
             else:
-                tl = draw.textlength(mark, morelargefont)
+                tl = textcache.textlength(draw, mark, morelargefont)
                 cdraw.text(((LARGE * 2 - tl) / 2, (LARGE * 2 - MORELARGE) / 2), mark, 1, font=morelargefont)
             rotmask = mask.rotate(-m + heading, expand=False)
             center = (czerox - (csize - cmsize - LARGE / 2) * c, czeroy - (csize - cmsize - LARGE / 2) * s)
@@ -483,10 +532,10 @@ def vsi(vertical_speed, flight_level, gps_speed, gps_course, gps_altitude, verti
     draw.text((35, sizey/2 - VERYSMALL - 25), "up", font=verysmallfont, fill="black", align="left")
     draw.text((35, sizey/2 + 25), "dn", font=verysmallfont, fill="black", align="left")
     middle_text = "Vertical Speed"
-    tl = draw.textlength(middle_text, verysmallfont)
+    tl = textcache.textlength(draw, middle_text, verysmallfont)
     draw.text((sizey/2 - tl / 2, sizey/2 - VERYSMALL - 10), middle_text, font=verysmallfont, fill="black", align="left")
     middle_text = "100 feet per min"
-    tl = draw.textlength(middle_text, verysmallfont)
+    tl = textcache.textlength(draw, middle_text, verysmallfont)
     draw.text((sizey/2 - tl / 2, sizey/2 + 10), middle_text, font=verysmallfont, fill="black", align="left")
 
     # right data display
@@ -646,7 +695,7 @@ def bar(y, text, val, max_val, yellow, red, unit="", valtext=None, minval=0):
 
     draw.text((5, y), text, font=verysmallfont, fill="black", align="left")
     right_val = str(int(max_val)) + unit
-    textlength = draw.textlength(right_val, verysmallfont)
+    textlength = textcache.textlength(draw, right_val, verysmallfont)
     draw.text((sizex - textlength - 5, y), right_val, font=verysmallfont, fill="black", align="right")
     draw.rounded_rectangle([bar_start-2, y-2, bar_end+2, y+VERYSMALL+2], radius=3, fill=None, outline="black", width=1)
     color = "black"
@@ -663,14 +712,14 @@ def bar(y, text, val, max_val, yellow, red, unit="", valtext=None, minval=0):
         t = valtext
     else:
         t = str(val)
-    tl = draw.textlength(t, verysmallfont)
+    tl = textcache.textlength(draw, t, verysmallfont)
     draw.text(((bar_end-bar_start)/2+bar_start-tl/2, y), t, font=verysmallfont, fill="black",
               stroke_width=1, stroke_fill="white")
     return y+VERYSMALL+12
 
 
 def round_text(x, y, text, color, yesno=True, out=None):
-    tl = draw.textlength(text, verysmallfont)
+    tl = textcache.textlength(draw, text, verysmallfont)
     draw.rounded_rectangle([x, y, x+tl+10, y+VERYSMALL+2], radius=4, fill=color, outline=out)
     draw.text((x+5, y), text, font=verysmallfont, fill="black")
     if not yesno:
@@ -732,9 +781,12 @@ def stratux(stat, altitude, gps_alt, gps_quality):
     bottom_line("+10 ft", "Mode", "-10 ft")
 
 
-def flighttime(last_flights):
+def flighttime(last_flights, page, pages, totals, confirm_clear=False):   # totals: secs today and this month
     starty = 0
-    centered_text(0, "Flight Logs ", smallfont, fill="black")
+    if pages > 1:
+        centered_text(0, "Flight Logs {0}/{1}".format(page + 1, pages), smallfont, fill="black")
+    else:
+        centered_text(0, "Flight Logs ", smallfont, fill="black")
     starty += SMALL + 10
     draw.text((20, starty), "Date", font=verysmallfont, fill="black")
     draw.text((120, starty), "Start", font=verysmallfont, fill="black")
@@ -742,7 +794,7 @@ def flighttime(last_flights):
     draw.text((350, starty), "Ldg", font=verysmallfont, fill="black")
     starty += VERYSMALL + 10
 
-    maxlines = 8
+    maxlines = FLIGHT_LINES
     for f in last_flights:
         f[0] = f[0].replace(second=0, microsecond=0)  # round down start time to minutes
         draw.text((20, starty), f[0].strftime("%d.%m.%y"), font=verysmallfont, fill="black")
@@ -763,11 +815,15 @@ def flighttime(last_flights):
         maxlines -= 1
         if maxlines <= 0:
             break
-    bottom_line("", "Mode", "Clear")
+    starty = SMALL + 10 + VERYSMALL + 10 + FLIGHT_LINES * (VERYSMALL + 5)
+    today = '{:02}:{:02}'.format(int(totals[0] // 3600), int(totals[0] % 3600 // 60))
+    month = '{:02}:{:02}'.format(int(totals[1] // 3600), int(totals[1] % 3600 // 60))
+    centered_text(starty, "Today " + today + "   Month " + month, verysmallfont, fill="black")
+    bottom_line("Page" if pages > 1 else "", "Mode", "Confirm" if confirm_clear else "Clear")
 
 
 def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value_line2, timeout):
-    tl = math.floor(draw.textlength(str(maxvalue), verysmallfont))    # for adjusting x and y
+    tl = math.floor(textcache.textlength(draw, str(maxvalue), verysmallfont))    # for adjusting x and y
     # adjust zero lines to have room for text
     xpos = xpos + tl + space
     xsize = xsize - tl - space
@@ -775,18 +831,18 @@ def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value
     ysize = ysize - VERYSMALL
 
     vlmin_y = ypos + ysize - 1
-    tl = draw.textlength(str(minvalue), verysmallfont)
+    tl = textcache.textlength(draw, str(minvalue), verysmallfont)
     draw.text((xpos - tl - space, vlmin_y - VERYSMALL), str(minvalue), font=verysmallfont, fill="black")
 
     vl1_y = ypos + ysize - ysize * (value_line1 - minvalue) / (maxvalue - minvalue)
-    tl = draw.textlength(str(value_line1), verysmallfont)
+    tl = textcache.textlength(draw, str(value_line1), verysmallfont)
     draw.text((xpos - tl - space, vl1_y - VERYSMALL/2), str(value_line1), font=verysmallfont, fill="black")
     vl2_y = math.floor(ypos + ysize - ysize * (value_line2 - minvalue) / (maxvalue - minvalue))
-    tl = draw.textlength(str(value_line2), verysmallfont)
+    tl = textcache.textlength(draw, str(value_line2), verysmallfont)
     draw.text((xpos - tl - space, vl2_y - VERYSMALL/2), str(value_line2), font=verysmallfont, fill="black")
 
     vlmax_y = ypos
-    tl = draw.textlength(str(maxvalue), verysmallfont)
+    tl = textcache.textlength(draw, str(maxvalue), verysmallfont)
     draw.text((xpos - tl - space, vlmax_y - VERYSMALL/2), str(maxvalue), font=verysmallfont, fill="black")
 
     draw.rectangle((xpos, ypos, xpos+xsize, ypos+ysize), outline="black", width=3, fill="white")
@@ -795,7 +851,7 @@ def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value
     no_of_values = len(data)
     full_time = timeout * no_of_values   # time for full display in secs
     timestr = time.strftime("%H:%M", time.gmtime())
-    tl = draw.textlength(timestr, verysmallfont)
+    tl = textcache.textlength(draw, timestr, verysmallfont)
     no_of_time = math.floor(xsize / tl / 2) + 1  # calculate maximum number of time indications
     time_offset = full_time / no_of_time
     offset = math.floor((xsize-1) / no_of_time)
@@ -806,19 +862,9 @@ def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value
         timestr = time.strftime("%H:%M", time.gmtime(math.floor(acttime - (no_of_time-i) * time_offset)))
         draw.text((x - tl/2, ypos+ysize-1 + 1), timestr, font=verysmallfont, fill="black")
         x = x + offset
-    lastpoint = None
-    for i in range(0, len(data)):
-        y = ypos-4 + ysize - ysize * (data[i] - minvalue) / (maxvalue - minvalue)
-        if y < ypos:
-            y = ypos   # if value is outside
-        if y > ypos+ysize-1:
-            x = ypos+ysize-1
-        if i >= 1:  # we need at least two points before we draw
-            x = xpos + i * xsize / (len(data)-1)
-            draw.line([lastpoint, (x, y)], fill="black", width=3)
-        else:
-            x = xpos
-        lastpoint = (x, y)
+    points = decimation.polyline(data, xpos, ypos, xsize, ysize, minvalue, maxvalue, yoffset=-4)
+    if len(points) >= 2:   # at most two points per pixel column, drawn as one line
+        draw.line(points, fill="black", width=3, joint="curve")
     # value_line 1
     y = ypos + ysize - ysize * (value_line1 - minvalue) / (maxvalue - minvalue)
     for x in range(xpos, xpos+xsize, 6):
@@ -855,7 +901,7 @@ def cowarner(co_values, co_max, r0, timeout, alarmlevel, alarmppm, alarmperiod):
 
 def data_item(leftx, y, rightx, text, value):
     draw.text((leftx, y + (SMALL-VERYSMALL) / 2), text, font=verysmallfont, fill="black", align="left")
-    tl = draw.textlength(value, smallfont)
+    tl = textcache.textlength(draw, value, smallfont)
     draw.text((rightx - tl, y), value, font=smallfont, fill="black")
 
 
@@ -864,13 +910,13 @@ def dashboard(x, y, dsizex, rounding, headline, lines):
     starty = y + VERYSMALL/2
     for line in lines:
         draw.text((x + 7, starty + (SMALL - VERYSMALL) / 2), line[0], font=verysmallfont, fill="black", align="left")
-        tl = draw.textlength(line[1], smallfont)
+        tl = textcache.textlength(draw, line[1], smallfont)
         draw.text((x + dsizex - 7 - tl, starty), line[1], font=smallfont, fill="black")
         starty += SMALL + 3
     if rounding:
         starty += VERYSMALL/2
         draw.rounded_rectangle([x, y, x + dsizex, starty], radius=6, fill=None, outline="black", width=2)
-        tl = draw.textlength(headline, verysmallfont)
+        tl = textcache.textlength(draw, headline, verysmallfont)
         draw.rectangle([x + 20, y - SMALL/2, x + 20 + tl + 8, y + SMALL/2], fill="white", outline=None)
     draw.text((x+20+4, y - VERYSMALL/2), headline, font=verysmallfont, fill="black")
     return starty
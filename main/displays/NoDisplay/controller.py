@@ -34,6 +34,7 @@
 
 import logging
 
+FLIGHT_LINES = 10   # flights per page of flight log
 
 # just the skeleton of all functions to be able to start without display
 def display():
@@ -44,6 +45,10 @@ def is_busy():
     pass
 
 
+def ghosting_refresh_due():
+    return False
+
+
 def next_arcposition(old_arcposition):
     pass
 
@@ -120,7 +125,7 @@ def stratux(stat, altitude, gps_alt, gps_quality):
     pass
 
 
-def flighttime(last_flights):
+def flighttime(last_flights, page, pages, totals, confirm_clear=False):   # totals: secs today and this month
     pass
 
 
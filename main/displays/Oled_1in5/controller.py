@@ -35,8 +35,10 @@ import math
 import time
 import datetime
 from pathlib import Path
+import displaytiming
+import decimation
+import textcache
 from PIL import Image, ImageFont, ImageDraw
-from . import radar_opts
 
 # global constants
 VERYLARGE = 24
@@ -47,6 +49,7 @@ VERYSMALL = 10  # used for "nm" and "ft"
 AIRCRAFT_SIZE = 3  # size of aircraft arrow
 MINIMAL_CIRCLE = 10  # minimal size of mode-s circle
 PITCH_SCALE = 1.5
+FLIGHT_LINES = 6   # flights per page of flight log
 # end definitions
 
 # device properties
@@ -91,7 +94,7 @@ def make_font(name, size):
     return ImageFont.truetype(font_path, size)
 
 
-def init(fullcircle=False):
+def init(fullcircle=False, virtual_device=None):
     global sizex
     global sizey
     global zerox
@@ -109,8 +112,12 @@ def init(fullcircle=False):
     global cdraw
     global draw
 
-    config_path = str(Path(__file__).resolve().parent.joinpath('ssd1351.conf'))
-    device = radar_opts.get_device(['-f', config_path])
+    if virtual_device is None:
+        from . import radar_opts   # luma driver only imported when a real display is used
+        config_path = str(Path(__file__).resolve().parent.joinpath('ssd1351.conf'))
+        device = radar_opts.get_device(['-f', config_path])
+    else:
+        device = virtual_device   # e.g. handed over by displays/Virtual
     image = Image.new(device.mode, device.size)
     draw = ImageDraw.Draw(image)
     sizex = device.width
@@ -142,24 +149,27 @@ def cleanup():
 
 
 def centered_text(y, text, font, fill):
-    tl = draw.textlength(text, font)
+    tl = textcache.textlength(draw, text, font)
     draw.text((zerox - tl / 2, y), text, font=font, fill=fill)
 
 
 def bottom_line(left, middle, right, offset=0):  # offset to be able to print letters like p and q
     draw.text((0, sizey - SMALL - offset), left, font=smallfont, fill="green")
-    textlength = draw.textlength(right, smallfont)
+    textlength = textcache.textlength(draw, right, smallfont)
     draw.text((sizex - textlength, sizey - SMALL - offset), right, font=smallfont, fill="green", align="right")
     centered_text(sizey - SMALL - offset, middle, smallfont, fill="green")
 
 
 def right_text(y, text, font, fill, offset=0):
-    tl = draw.textlength(text, font)
+    tl = textcache.textlength(draw, text, font)
     draw.text((sizex - tl - offset, y), text, font=font, fill=fill)
 
 
 def display():
+    displaytiming.render_done()
     device.display(image)
+    displaytiming.transfer_done()
+    displaytiming.busy_done()   # oled is synchronous, no busy time
 
 
 def is_busy():
@@ -167,6 +177,11 @@ def is_busy():
     return False
 
 
+def ghosting_refresh_due():
+    # oled has no ghosting, never needs a refresh
+    return False
+
+
 def next_arcposition(old_arcposition):
     # defines next position of height indicator on circle. Can be used to exclude several ranges or
     # be used to define the next angle on the circle
@@ -174,6 +189,7 @@ def next_arcposition(old_arcposition):
 
 
 def clear():
+    displaytiming.render_start()
     draw.rectangle((0, 0, sizex - 1, sizey - 1), fill="black")
 
 
@@ -203,6 +219,8 @@ def aircraft(x, y, direction, height, vspeed, nspeed_length, tail):
     draw.polygon(((x + p1[0], y + p1[1]), (x + p2[0], y + p2[1]), (x + p3[0], y + p3[1]), (x + p4[0], y + p4[1])),
                  fill="red", outline="white")
     draw.line((x + p1[0], y + p1[1], x + p5[0], y + p5[1]), fill="white", width=1)
+    if height is None:
+        return   # label dropped by radar, e.g. if frame time budget is exceeded
     if height >= 0:
         t = "+" + str(abs(height))
     else:
@@ -211,7 +229,7 @@ def aircraft(x, y, direction, height, vspeed, nspeed_length, tail):
         t = t + '\u2191'
     if vspeed < 0:
         t = t + '\u2193'
-    tl = draw.textlength(t, largefont)
+    tl = textcache.textlength(draw, t, largefont)
     if tl + x + 4 * AIRCRAFT_SIZE - 2 > sizex:
         # would draw text outside, move to the left
         tposition = (x - 4 * AIRCRAFT_SIZE - tl, int(y - LARGE / 2))
@@ -235,7 +253,7 @@ def modesaircraft(radius, height, arcposition, vspeed, tail):
         t = t + '\u2191'
     if vspeed < 0:
         t = t + '\u2193'
-    tl = draw.textlength(t, largefont)
+    tl = textcache.textlength(draw, t, largefont)
     tposition = (64 + arctext[0] - tl / 2, 64 + arctext[1] - LARGE / 2)
     draw.rectangle((tposition, (tposition[0] + tl, tposition[1] + LARGE)), fill="black")
     draw.text(tposition, t, font=largefont, fill="white")
@@ -255,15 +273,15 @@ def situation(connected, gpsconnected, ownalt, course, range, altdifference, bt_
         t = str(int(altdifference / 1000)) + "k"
     else:
         t = str(altdifference)
-    tl = draw.textlength(t, smallfont)
+    tl = textcache.textlength(draw, t, smallfont)
     draw.text((sizex - tl, 0), t, font=smallfont, fill="floralwhite", align="right")
 
     text = "ft"
-    tl = draw.textlength(text, smallfont)
+    tl = textcache.textlength(draw, text, smallfont)
     draw.text((sizex - tl, SMALL), text, font=verysmallfont, fill="floralwhite", align="right")
 
     text = str(course) + '°'
-    tl = draw.textlength(text, smallfont)
+    tl = textcache.textlength(draw, text, smallfont)
     draw.text((sizex - tl, sizey - SMALL), text, font=smallfont, fill="floralwhite", align="right")
 
     if extsound or bt_devices > 0:   # extsound means and sound devices has been found
@@ -279,7 +297,7 @@ def situation(connected, gpsconnected, ownalt, course, range, altdifference, bt_
         else:
             btcolor = "red"
             text = '\uf1f6'  # bell off symbol
-        tl = draw.textlength(text, webfont)
+        tl = textcache.textlength(draw, text, webfont)
         draw.text((sizex - tl, sizey - 2 * SMALL), text, font=webfont, fill=btcolor, align="right")
 
     if not gpsconnected:
@@ -291,7 +309,7 @@ def situation(connected, gpsconnected, ownalt, course, range, altdifference, bt_
         centered_text(sizey-2*SMALL, co_alarmstring, smallfont, fill="red")
     if basemode:
         text = "Ground mode"
-        tl = draw.textlength(text, smallfont)
+        tl = textcache.textlength(draw, text, smallfont)
         centered_text(sizey - SMALL, text, smallfont, fill="red")
 
 
@@ -361,7 +379,7 @@ def meter(current, start_value, end_value, from_degree, to_degree, size, center_
         draw.line(mark, fill="white", width=2)
         # text
         marktext = str(m)
-        tl = draw.textlength(marktext, largefont)
+        tl = textcache.textlength(draw, marktext, largefont)
         t_center = translate(angle, ((0, -size/2 + big_mark_length + LARGE/2 + text_distance), ), (center_x, center_y))
         draw.text((t_center[0][0]-tl/2, t_center[0][1]-LARGE/2), marktext, fill="white", font=largefont)
         m += marks_distance
@@ -377,10 +395,10 @@ def meter(current, start_value, end_value, from_degree, to_degree, size, center_
     draw.ellipse((center_x - 5, center_y - 5, center_x + 5, center_y + 5), fill="white")
 
     if middle_text1 is not None:
-        tl = draw.textlength(middle_text1, smallfont)
+        tl = textcache.textlength(draw, middle_text1, smallfont)
         draw.text((center_x-tl/2, center_y-SMALL-15), middle_text1, font=smallfont, fill="yellow", align="left")
     if middle_text2 is not None:
-        tl = draw.textlength(smiddle_text2, smallfont)
+        tl = textcache.textlength(draw, smiddle_text2, smallfont)
         draw.text((center_x-tl/2, center_y+15), middle_text2, font=smallfont, fill="yellow", align="left")
 
 
@@ -403,7 +421,7 @@ def compass(heading, error_message):
     image.paste(compass_aircraft, (round(zerox) - 30, 30))
     draw.line((zerox, 10, zerox, 30), fill="white", width=1)
     text = str(heading) + '°'
-    tl = draw.textlength(text, smallfont)
+    tl = textcache.textlength(draw, text, smallfont)
     draw.text((sizex - tl, sizey - SMALL), text, font=smallfont, fill="floralwhite", align="right")
     for m in range(0, 360, 10):
         s = math.sin(math.radians(m - heading + 90))
@@ -427,7 +445,7 @@ def compass(heading, error_message):
                 mark = str(int(m/10))
                 color = "white"
             cdraw.rectangle((0, 0, LARGE*2, LARGE*2), fill="black")
-            tl = draw.textlength(mark, largefont)
+            tl = textcache.textlength(draw, mark, largefont)
             cdraw.text(((LARGE*2-tl)/2, LARGE/2), mark, 1, font=largefont)
             rotmask = mask.rotate(-m+heading, expand=False)
             center = (zerox - (csize - cmsize - LARGE / 2) * c, zeroy - (csize - cmsize - LARGE / 2) * s)
@@ -446,10 +464,10 @@ def vsi(vertical_speed, flight_level, gps_speed, gps_course, gps_altitude, verti
     draw.text((12, zeroy - VERYSMALL - 12), "up", font=verysmallfont, fill="white", align="left")
     draw.text((12, zeroy + 12), "dn", font=verysmallfont, fill="white", align="left")
     middle_text = "Vert Spd"
-    tl = draw.textlength(middle_text, verysmallfont)
+    tl = textcache.textlength(draw, middle_text, verysmallfont)
     draw.text((zerox - tl / 2, zeroy - VERYSMALL - 10), middle_text, font=verysmallfont, fill="white", align="left")
     middle_text = "100 ft/min"
-    tl = draw.textlength(middle_text, verysmallfont)
+    tl = textcache.textlength(draw, middle_text, verysmallfont)
     draw.text((zerox - tl / 2, zeroy + 10), middle_text, font=verysmallfont, fill="white", align="left")
 
     scale = 170.0 / 2000.0
@@ -463,7 +481,7 @@ def vsi(vertical_speed, flight_level, gps_speed, gps_course, gps_altitude, verti
             draw.line((zerox - (csize - 1) * c, zeroy - (csize - 1) * s, zerox - (csize - vmsize_l) * c,
                        zeroy - (csize - vmsize_l) * s), fill="white", width=3)
             mark = str(round(abs(m / 100)))
-            tl = draw.textlength(mark, largefont)
+            tl = textcache.textlength(draw, mark, largefont)
             if m != 2000 and m != -2000:
                 center = (zerox-(csize-1-vmsize_l-LARGE/2) * c, zeroy-(csize-5-vmsize_l-LARGE/2) * s)
                 draw.text((center[0] - tl / 2, center[1] - LARGE / 2), mark, fill="white", font=largefont)
@@ -576,7 +594,7 @@ def ahrs(pitch, roll, heading, slipskid, error_message):
     left_text = "Levl"
     right_text = "Zero"
     draw.text((0, sizey - SMALL), left_text, font=smallfont, fill="white")
-    tl = draw.textlength(right_text, smallfont)
+    tl = textcache.textlength(draw, right_text, smallfont)
     draw.text((sizex - tl, sizey - SMALL), right_text, font=smallfont, fill="white", align="right")
 
 
@@ -588,7 +606,7 @@ def text_screen(headline, subline, text, left, middle, right):
         txt_starty += LARGE
     draw.text((0, txt_starty), text, font=smallfont, fill="white")
     draw.text((0, sizey - SMALL - 3), left, font=smallfont, fill="green")
-    tl = draw.textlength(right, smallfont)
+    tl = textcache.textlength(draw, right, smallfont)
     draw.text((sizex - tl, sizey - SMALL - 3), right, font=smallfont, fill="green", align="right")
     centered_text(sizey - SMALL - 3, middle, smallfont, fill="green")
 
@@ -609,7 +627,7 @@ def screen_input(headline, subline, text, left, middle, right, prefix, inp, suff
     draw.text((bbox_rect[2], bbox[3]), suffix, font=mediumfont, fill="white")
 
     draw.text((0, sizey - SMALL - 3), left, font=smallfont, fill="green")
-    tl = draw.textlength(right, smallfont)
+    tl = textcache.textlength(draw, right, smallfont)
     draw.text((sizex - tl, sizey - SMALL - 3), right, font=smallfont, fill="green", align="right")
     centered_text(sizey - SMALL - 3, middle, smallfont, fill="green")
 
@@ -620,7 +638,7 @@ def bar(y, text, val, max_val, yellow, red, unit="", valtext=None, minval=0):
 
     draw.text((0, y), text, font=verysmallfont, fill="white", align="left")
     right_val = str(int(max_val)) + unit
-    tl = draw.textlength(right_val, verysmallfont)
+    tl = textcache.textlength(draw, right_val, verysmallfont)
     draw.text((sizex - tl, y), right_val, font=verysmallfont, fill="white", align="right")
     draw.rounded_rectangle([bar_start-2, y-2, bar_end+2, y+VERYSMALL+2], radius=3, fill=None, outline="white", width=1)
     if red == 0:
@@ -642,20 +660,20 @@ def bar(y, text, val, max_val, yellow, red, unit="", valtext=None, minval=0):
         t = valtext
     else:
         t = str(val)
-    tl = draw.textlength(t, verysmallfont)
+    tl = textcache.textlength(draw, t, verysmallfont)
     draw.text(((bar_end-bar_start)/2+bar_start-tl/2, y), t, font=verysmallfont, fill="white")
     return y+VERYSMALL+5
 
 
 def round_text(x, y, text, color):
-    tl = draw.textlength(text, verysmallfont)
+    tl = textcache.textlength(draw, text, verysmallfont)
     draw.rounded_rectangle([x-2, y-1, x+tl+2, y+VERYSMALL+2], radius=4, fill=color)
     draw.text((x, y), text, font=verysmallfont, fill="white")
     return x+tl+5
 
 
 def centered_round_text(y, text, color):
-    tl = draw.textlength(text, verysmallfont)
+    tl = textcache.textlength(draw, text, verysmallfont)
     x = sizex/2 - tl/2  # center box
     draw.rounded_rectangle([x-2, y-1, x+tl+2, y+VERYSMALL+2], radius=4, fill=color)
     draw.text((x, y), text, font=verysmallfont, fill="white")
@@ -687,19 +705,19 @@ def stratux(stat, altitude, gps_alt, gps_quality):
     draw.rounded_rectangle([55, starty, 75, starty + VERYSMALL + 1], radius=4, fill="DarkOrange", outline=None)
     draw.rounded_rectangle([75, starty, 95, starty + VERYSMALL + 1], radius=4, fill="red", outline=None)
     t = str(stat['GPS_satellites_locked'])
-    tl = draw.textlength(t, verysmallfont)
+    tl = textcache.textlength(draw, t, verysmallfont)
     draw.text((48-tl/2, starty), t, font=verysmallfont, fill="white", align="middle")
     t = str(stat['GPS_satellites_seen'])
-    tl = draw.textlength(t, verysmallfont)
+    tl = textcache.textlength(draw, t, verysmallfont)
     draw.text((67-tl/2, starty), t, font=verysmallfont, fill="white", align="middle")
     t = str(stat['GPS_satellites_tracked'])
-    tl = draw.textlength(t, verysmallfont)
+    tl = textcache.textlength(draw, t, verysmallfont)
     draw.text((87-tl/2, starty), t, font=verysmallfont, fill="white", align="middle")
     if stat['GPS_position_accuracy'] < 19999:
         gps = str(round(stat['GPS_position_accuracy'], 1)) + "m"
     else:
         gps = "NoFix"
-    tl = draw.textlength(gps, verysmallfont)
+    tl = textcache.textlength(draw, gps, verysmallfont)
     draw.text((sizex - tl, starty), gps, font=verysmallfont, fill="white")
     starty += VERYSMALL+4
 
@@ -726,9 +744,12 @@ def stratux(stat, altitude, gps_alt, gps_quality):
     bottom_line("+10ft", "Mode", "-10ft")
 
 
-def flighttime(last_flights):
+def flighttime(last_flights, page, pages, totals, confirm_clear=False):   # totals: secs today and this month
     starty = 0
-    centered_text(0, "Flight Logs", smallfont, fill="yellow")
+    if pages > 1:
+        centered_text(0, "Flight Logs {0}/{1}".format(page + 1, pages), smallfont, fill="yellow")
+    else:
+        centered_text(0, "Flight Logs", smallfont, fill="yellow")
     starty += SMALL + 5
 
     draw.text((0, starty), "Date", font=verysmallfont, fill="white")
@@ -737,7 +758,7 @@ def flighttime(last_flights):
     draw.text((105, starty), "Ldg", font=verysmallfont, fill="white")
     starty += VERYSMALL + 3
 
-    maxlines = 7
+    maxlines = FLIGHT_LINES
     for f in last_flights:
         draw.text((0, starty), f[0].strftime("%d.%m."), font=verysmallfont, fill="green")
         draw.text((30, starty), f[0].strftime("%H:%M"), font=verysmallfont, fill="white")
@@ -755,11 +776,15 @@ def flighttime(last_flights):
         maxlines -= 1
         if maxlines <= 0:
             break
-    bottom_line("", "Mode", "Clear")
+    starty = SMALL + 5 + VERYSMALL + 3 + FLIGHT_LINES * (VERYSMALL + 1)
+    today = '{:02}:{:02}'.format(int(totals[0] // 3600), int(totals[0] % 3600 // 60))
+    month = '{:02}:{:02}'.format(int(totals[1] // 3600), int(totals[1] % 3600 // 60))
+    centered_text(starty, "Day " + today + " Mon " + month, verysmallfont, fill="white")
+    bottom_line("Page" if pages > 1 else "", "Mode", "Confirm" if confirm_clear else "Clear")
 
 
 def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value_line2, timeout):
-    tl = draw.textlength(str(maxvalue), verysmallfont)    # for adjusting x and y
+    tl = textcache.textlength(draw, str(maxvalue), verysmallfont)    # for adjusting x and y
     # adjust zero lines to have room for text
     xpos = xpos + tl + space
     xsize = xsize - tl - space
@@ -767,19 +792,19 @@ def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value
     ysize = ysize - VERYSMALL
 
     vlmin_y = ypos + ysize - 1
-    tl = draw.textlength(str(minvalue), verysmallfont)
+    tl = textcache.textlength(draw, str(minvalue), verysmallfont)
     draw.text((xpos - tl - space, vlmin_y - VERYSMALL), str(minvalue), font=verysmallfont, fill="white")
 
     vl1_y = ypos + ysize - ysize * (value_line1 - minvalue) / (maxvalue - minvalue)
-    tl = draw.textlength(str(value_line1), verysmallfont)
+    tl = textcache.textlength(draw, str(value_line1), verysmallfont)
     draw.text((xpos - tl - space, vl1_y - VERYSMALL/2), str(value_line1), font=verysmallfont, fill="white")
 
     vl2_y = ypos + ysize - ysize * (value_line2 - minvalue) / (maxvalue - minvalue)
-    tl = draw.textlength(str(value_line2), verysmallfont)
+    tl = textcache.textlength(draw, str(value_line2), verysmallfont)
     draw.text((xpos - tl - space, vl2_y - VERYSMALL/2), str(value_line2), font=verysmallfont, fill="white")
 
     vlmax_y = ypos
-    tl = draw.textlength(str(maxvalue), verysmallfont)
+    tl = textcache.textlength(draw, str(maxvalue), verysmallfont)
     draw.text((xpos - tl - space, vlmax_y - VERYSMALL/2), str(maxvalue), font=verysmallfont, fill="white")
 
     draw.rectangle((xpos, ypos, xpos+xsize-1, ypos+ysize-1), outline="white", width=1, fill="black")
@@ -788,7 +813,7 @@ def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value
     no_of_values = len(data)
     full_time = timeout * no_of_values   # time for full display in secs
     timestr = time.strftime("%H:%M", time.gmtime())
-    tl = draw.textlength(timestr, verysmallfont)
+    tl = textcache.textlength(draw, timestr, verysmallfont)
     no_of_time = math.floor(xsize / tl / 2) + 1   # calculate maximum number of time indications
     time_offset = full_time / no_of_time
     offset = math.floor((xsize-1) / no_of_time)
@@ -799,19 +824,9 @@ def graph(xpos, ypos, xsize, ysize, data, minvalue, maxvalue, value_line1, value
         timestr = time.strftime("%H:%M", time.gmtime(math.floor(acttime - (no_of_time-i) * time_offset)))
         draw.text((x - tl/2, ypos+ysize-1 + 1), timestr, font=verysmallfont, fill="white")
         x = x + offset
-    lastpoint = None
-    for i in range(0, len(data)):
-        y = ypos-1 + ysize - ysize * (data[i] - minvalue) / (maxvalue - minvalue)
-        if y < ypos:
-            y = ypos   # if value is outside
-        if y > ypos+ysize-1:
-            x = ypos+ysize-1
-        if i >= 1:  # we need at least two points before we draw
-            x = xpos + i * xsize / (len(data)-1)
-            draw.line([lastpoint, (x, y)], fill="cyan", width=2)
-        else:
-            x = xpos
-        lastpoint = (x, y)
+    points = decimation.polyline(data, xpos, ypos, xsize, ysize, minvalue, maxvalue, yoffset=-1)
+    if len(points) >= 2:   # at most two points per pixel column, drawn as one line
+        draw.line(points, fill="cyan", width=2, joint="curve")
     # value_line 1
     y = ypos + ysize - ysize * (value_line1 - minvalue) / (maxvalue - minvalue)
     for x in range(xpos, xpos+xsize, 6):
@@ -856,7 +871,7 @@ def dashboard(x, y, sizex, lines):
     starty = y
     for line in lines:
         draw.text((x, starty), line[0], font=smallfont, fill="white", align="left")
-        tl = draw.textlength(line[1], smallfont)
+        tl = textcache.textlength(draw, line[1], smallfont)
         draw.text((x+sizex-tl, starty), line[1], font=smallfont, fill="white")
         starty += SMALL+2
     return starty
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+# Headless display for testing and benchmarking, start with "-d Virtual".
+# The geometry (-vd) selects which controller is used for drawing. That controller runs unchanged, only its
+# hardware device is replaced by a virtual one, so rendering costs are the same as on the real display.
+# Frames can be written as png files (-vp) or into a mmap'd raw framebuffer (-vfb).
+
+import importlib
+import logging
+from . import virtualdevice
+
+GEOMETRIES = {
+    'Epaper_3in7': virtualdevice.VirtualEpaper3in7,
+    'Epaper_1in54': virtualdevice.VirtualEpaper1in54,
+    'Oled_1in5': virtualdevice.VirtualOled,
+}
+DEFAULT_GEOMETRY = 'Epaper_3in7'
+
+# globals
+geometry = DEFAULT_GEOMETRY
+png_dir = None       # directory for png frames, None if no frames are written
+fb_path = None       # file for raw framebuffer, None if not used
+emulate_timing = True
+controller = None    # controller module of the geometry, does all the drawing
+device = None        # virtual device handed over to the controller
+rlog = None
+
+
+def configure(geo, png_directory=None, framebuffer=None, timing=True):   # called by radar.py before init
+    global geometry
+    global png_dir
+    global fb_path
+    global emulate_timing
+
+    if geo not in GEOMETRIES:
+        raise ValueError("Virtual display: unknown geometry '{0}', use one of {1}".format(geo, list(GEOMETRIES)))
+    geometry = geo
+    png_dir = png_directory
+    fb_path = framebuffer
+    emulate_timing = timing
+
+
+def init(fullcircle=False):
+    global controller
+    global device
+    global rlog
+
+    rlog = logging.getLogger('stratux-radar-log')
+    controller = importlib.import_module('displays.' + geometry + '.controller')
+    device = GEOMETRIES[geometry](png_dir, fb_path, emulate_timing)
+    rlog.debug("Running Radar with Virtual display, geometry " + geometry + ", timing emulation " +
+               str(emulate_timing))
+    return controller.init(fullcircle, virtual_device=device)
+
+
+def __getattr__(name):
+    # all drawing functions (clear, display, aircraft, situation, ...) are the ones of the selected geometry
+    if controller is None:
+        raise AttributeError("Virtual display: '{0}' used before init".format(name))
+    return getattr(controller, name)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+# Virtual display devices. They offer the same methods as the hardware drivers (epd3in7, epd1in54_V2 and
+# the luma device of the oled), so the unchanged controllers can draw into them. Instead of SPI every frame
+# is kept in memory, optionally written as png file or into a mmap'd raw framebuffer. Busy and refresh
+# times of the real hardware are emulated so that the scheduling in radar.py behaves like on the device.
+
+import logging
+import mmap
+import time
+from pathlib import Path
+import numpy
+
+# emulated timing of the hardware in seconds
+SPI_SPEED = 32000000       # bits per second as configured in epdconfig
+OLED_SPI_SPEED = 16000000  # default spi speed of luma
+EPD3IN7_PARTIAL_TIME = 0.32   # A2 waveform, 1Gray
+EPD3IN7_FULL_TIME = 3.1       # 4Gray clear
+EPD1IN54_PARTIAL_TIME = 0.30
+EPD1IN54_FULL_TIME = 2.0
+EPD_INIT_TIME = 0.3           # reset and init of the epaper controller
+
+rlog = logging.getLogger('stratux-radar-log')
+
+
+class VirtualDevice:
+    width = 0
+    height = 0
+
+    def __init__(self, png_dir=None, fb_path=None, emulate_timing=True):
+        self.png_dir = png_dir
+        self.fb_path = fb_path
+        self.emulate_timing = emulate_timing
+        self.busy_until = 0.0
+        self.frame_no = 0
+        self.last_image = None   # last image handed over, frame is taken from this one
+        self.fb_file = None
+        self.fb_map = None
+        if self.png_dir is not None:
+            Path(self.png_dir).mkdir(parents=True, exist_ok=True)
+
+    def _wait(self, seconds):   # synchronous wait, the hardware drivers also block here
+        if self.emulate_timing and seconds > 0:
+            time.sleep(seconds)
+
+    def _start_busy(self, seconds):   # asynchronous wait, busy pin is set for this time
+        if self.emulate_timing:
+            self.busy_until = time.perf_counter() + seconds
+
+    def _wait_busy(self):
+        if self.emulate_timing:
+            rest = self.busy_until - time.perf_counter()
+            if rest > 0:
+                time.sleep(rest)
+
+    def _transfer(self, no_bytes, speed=SPI_SPEED):
+        self._wait(no_bytes * 8 / speed)
+
+    def _open_framebuffer(self, size):
+        self.fb_file = open(self.fb_path, 'w+b')
+        self.fb_file.truncate(size)
+        self.fb_map = mmap.mmap(self.fb_file.fileno(), size)
+        rlog.debug("Virtual display: raw framebuffer {0} with {1} bytes, mode '{2}' size {3}x{4}"
+                   .format(self.fb_path, size, self.last_image.mode, self.last_image.width,
+                           self.last_image.height))
+
+    def output_frame(self):
+        if self.last_image is None:
+            return
+        self.frame_no += 1
+        if self.fb_path is not None:
+            raw = self.last_image.tobytes()
+            if self.fb_map is None:
+                self._open_framebuffer(len(raw))
+            self.fb_map[0:len(raw)] = raw
+        if self.png_dir is not None:
+            self.last_image.save(str(Path(self.png_dir).joinpath('frame_{0:06d}.png'.format(self.frame_no))))
+
+    def async_is_busy(self):
+        # 0: idle, 1: busy, same as the busy pin of the epaper
+        if time.perf_counter() < self.busy_until:
+            return 1
+        return 0
+
+    def close(self):
+        if self.fb_map is not None:
+            self.fb_map.flush()
+            self.fb_map.close()
+            self.fb_map = None
+        if self.fb_file is not None:
+            self.fb_file.close()
+            self.fb_file = None
+
+
+class VirtualEpaper(VirtualDevice):   # common part of both epaper drivers
+    partial_time = 0.0
+    full_time = 0.0
+
+    def init(self, mode):
+        self._wait(EPD_INIT_TIME)
+        return 0
+
+    def getbuffer_optimized(self, image):
+        self.last_image = image
+        pb = numpy.packbits(numpy.rot90(numpy.asarray(image)))
+        return pb
+        # same conversion as the hardware driver, it is part of the time needed per frame
+
+    def _display(self, image, sync):
+        self._wait_busy()
+        self._transfer(len(image))
+        self.output_frame()
+        self._start_busy(self.partial_time)
+        if sync:
+            self._wait_busy()
+
+    def _clear(self):
+        self._wait_busy()
+        self._transfer(self.width * self.height // 8)
+        self._start_busy(self.full_time)
+        self._wait_busy()
+
+
+class VirtualEpaper3in7(VirtualEpaper):
+    width = 280
+    height = 480
+    partial_time = EPD3IN7_PARTIAL_TIME
+    full_time = EPD3IN7_FULL_TIME
+
+    def display_1Gray(self, image):
+        self._display(image, True)
+
+    def async_display_1Gray(self, image):
+        self._display(image, False)
+
+    def Clear(self, color, mode):
+        self._clear()
+
+    def sleep(self):
+        pass
+
+    def Dev_exit(self):
+        self.close()
+
+
+class VirtualEpaper1in54(VirtualEpaper):
+    width = 200
+    height = 200
+    partial_time = EPD1IN54_PARTIAL_TIME
+    full_time = EPD1IN54_FULL_TIME
+
+    def displayPart_mod(self, image):
+        self._display(image, True)
+
+    def async_displayPart(self, image):
+        self._display(image, False)
+
+    def Clear(self, color):
+        self._clear()
+
+    def sleep_nowait(self):
+        self.close()
+
+
+class VirtualOled(VirtualDevice):   # same attributes as the luma ssd1351 device
+    width = 128
+    height = 128
+    mode = 'RGB'
+    size = (width, height)
+
+    def contrast(self, level):
+        pass
+
+    def display(self, image):
+        self.last_image = image
+        self._transfer(self.width * self.height * 2, OLED_SPI_SPEED)   # 16 bit colour on the wire
+        self.output_frame()
+
+    def cleanup(self):
+        self.close()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+# Timing telemetry of the display drivers. Every controller reports the phases of a frame:
+#   render   - from clear() until display() is called (drawing into the image)
+#   transfer - conversion of the image and spi transfer in display()
+#   busy     - time until the display is no longer busy after the transfer (epaper refresh). The busy pin is
+#              polled, the end is taken as the middle between the last poll seeing busy and the first seeing idle,
+#              so the poll interval does not add to the measured time
+# Values are kept in rolling histograms over the last HISTORY_LENGTH frames. The medians are shown in the status
+# display, the histograms are logged when radar terminates.
+
+import logging
+import time
+import math
+from collections import deque
+
+# constants
+HISTORY_LENGTH = 200   # number of frames in the rolling window
+MIN_SAMPLES = 5        # min number of frames before measured values replace the value measured in init
+BUCKET_LIMITS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, math.inf)   # upper limits in secs
+
+rlog = logging.getLogger('stratux-radar-log')
+
+
+class RollingHistogram:
+    def __init__(self, window=HISTORY_LENGTH, limits=BUCKET_LIMITS):
+        self.samples = deque(maxlen=window)
+        self.limits = limits
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def count(self):
+        return len(self.samples)
+
+    def percentile(self, perc):   # perc in 0..100, returns None if no samples
+        if len(self.samples) == 0:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, math.floor(len(ordered) * perc / 100))
+        return ordered[index]
+
+    def maximum(self):
+        if len(self.samples) == 0:
+            return None
+        return max(self.samples)
+
+    def histogram(self):   # list of (upper limit, number of samples) for the current window
+        buckets = [0] * len(self.limits)
+        for s in self.samples:
+            for i, limit in enumerate(self.limits):
+                if s <= limit:
+                    buckets[i] += 1
+                    break
+        return list(zip(self.limits, buckets))
+
+    def clear(self):
+        self.samples.clear()
+
+
+# globals
+render = RollingHistogram()
+transfer = RollingHistogram()
+busy = RollingHistogram()
+full = RollingHistogram()      # duration of full refreshes (clear of epaper)
+partial_count = 0
+full_count = 0
+render_started = None    # perf_counter timestamps of the phase currently running, None if not running
+transfer_started = None
+busy_started = None
+busy_seen = None         # perf_counter timestamp of the last poll that found the display busy
+
+
+def render_start():   # called by controller in clear()
+    global render_started
+
+    render_started = time.perf_counter()
+
+
+def render_done():   # called by controller at the beginning of display()
+    global render_started
+    global transfer_started
+
+    now = time.perf_counter()
+    if render_started is not None:
+        render.add(now - render_started)
+        render_started = None
+    transfer_started = now
+
+
+def transfer_done():   # called by controller when the (partial) frame was handed to the display
+    global transfer_started
+    global busy_started
+    global busy_seen
+    global partial_count
+
+    now = time.perf_counter()
+    if transfer_started is not None:
+        transfer.add(now - transfer_started)
+        transfer_started = None
+    partial_count += 1
+    busy_started = now
+    busy_seen = None
+
+
+def busy_polled():   # called by controller if display reports busy
+    global busy_seen
+
+    if busy_started is not None:
+        busy_seen = time.perf_counter()
+
+
+def busy_done():   # called by controller if display reports not busy
+    global busy_started
+    global busy_seen
+
+    if busy_started is not None:
+        last_busy = busy_seen if busy_seen is not None else busy_started
+        end = (last_busy + time.perf_counter()) / 2   # display got idle somewhere between the two polls
+        busy.add(end - busy_started)
+        busy_started = None
+        busy_seen = None
+
+
+def full_refresh(duration):   # called by controller after a full (synchronous) refresh
+    global full_count
+    global busy_started
+
+    full.add(duration)
+    full_count += 1
+    busy_started = None   # the partial frame before was overwritten, no reasonable busy value
+
+
+def reset():   # e.g. after startup screen, which is displayed longer than a normal frame
+    global partial_count
+    global full_count
+    global render_started
+    global transfer_started
+    global busy_started
+    global busy_seen
+
+    for hist in (render, transfer, busy, full):
+        hist.clear()
+    partial_count = 0
+    full_count = 0
+    render_started = None
+    transfer_started = None
+    busy_started = None
+    busy_seen = None
+
+
+def refresh_time(default):
+    # time a display update takes (transfer + busy), used for scheduling. Median of the window, as long as there
+    # are not enough values the default (measured once in init) is returned
+    if transfer.count() < MIN_SAMPLES or busy.count() < MIN_SAMPLES:
+        return default
+    return transfer.percentile(50) + busy.percentile(50)
+
+
+def summary():   # median values in ms and counts, for the status display
+    def ms(hist):
+        p = hist.percentile(50)
+        if p is None:
+            return None
+        return round(p * 1000)
+    return {'render': ms(render), 'transfer': ms(transfer), 'busy': ms(busy), 'full': ms(full),
+            'partial_count': partial_count, 'full_count': full_count}
+
+
+def log_histograms():   # e.g. when terminating, distribution of the phases of the last frames
+    for name, hist in (('render', render), ('transfer', transfer), ('busy', busy), ('full', full)):
+        if hist.count() == 0:
+            continue
+        buckets = ", ".join("<={0}ms: {1}".format(round(limit * 1000) if limit != math.inf else "inf", n)
+                            for limit, n in hist.histogram() if n > 0)
+        rlog.debug("Display timing {0}: median {1:.0f} ms, max {2:.0f} ms, {3}"
+                  .format(name, hist.percentile(50) * 1000, hist.maximum() * 1000, buckets))
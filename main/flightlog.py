@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+
+# Log of all flights, stored in stratux-radar.flightlog with one json line per flight:
+# {"takeoff": "2023-12-11T14:19:57.296707+00:00", "landing": "2023-12-11T14:50:10.197035+00:00", "duration": 1813,
+#  "ground": {"start_time": ..., "takeoff_distance": ..., ...}}
+# "ground" are the takeoff/landing statistics of grounddistance, only if they were measured for this flight.
+# The history is unlimited, it is never read as a whole:
+# - stratux-radar.flightlog.idx holds the file offset of every line (8 bytes per flight), so a page of the flight
+#   list reads only the lines shown
+# - stratux-radar.flightlog.totals holds number of flights and flight time per day (json), monthly totals are
+#   summed from it
+# If the index does not fit to the log (e.g. power loss between both writes), it is rebuilt from the log.
+
+import datetime
+import json
+import logging
+import os
+from array import array
+import storage
+
+# constants
+PAIRING_TOLERANCE = 120   # secs, max difference of landing time of flighttime and grounddistance to pair them
+
+# globals
+rlog = None
+log_path = None       # None if not initialized
+index_path = None
+totals_path = None
+offsets = array('Q')  # offset of every line in the log, oldest first
+log_size = 0          # size of the log including all requested writes
+totals = {}           # 'YYYY-MM-DD' -> [number of flights, seconds]
+written = {}          # index -> record of all flights written in this session, may not yet be on disk
+pending_stats = None  # ground statistics measured before flighttime detected the landing, paired in add_flight
+
+
+def default(obj):
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+
+
+def stats_match(landing, stats):   # landing of a flight as datetime
+    return abs((landing - stats['landing_time']).total_seconds()) <= PAIRING_TOLERANCE
+
+
+def init(flightlog_file):
+    global rlog
+    global log_path
+    global index_path
+    global totals_path
+    global totals
+
+    rlog = logging.getLogger('stratux-radar-log')
+    log_path = flightlog_file
+    index_path = flightlog_file + '.idx'
+    totals_path = flightlog_file + '.totals'
+    if not load_index():
+        rebuild()
+    else:
+        totals = storage.load_json(totals_path) or {}
+    rlog.debug("Flightlog: {0} flights in {1}".format(len(offsets), log_path))
+
+
+def read_line(offset):
+    with open(storage.current_path(log_path), 'rb') as f:
+        f.seek(offset)
+        return f.readline()
+
+
+def load_index():   # returns False if index is missing or does not match the log
+    global offsets
+    global log_size
+
+    try:
+        log_size = os.path.getsize(storage.current_path(log_path))
+    except OSError:
+        log_size = 0
+    offsets = array('Q')
+    try:
+        with open(storage.current_path(index_path), 'rb') as f:
+            data = f.read()
+        offsets.frombytes(data[:len(data) - len(data) % offsets.itemsize])
+    except OSError:
+        return log_size == 0
+    if len(offsets) == 0:
+        return log_size == 0
+    try:
+        last = read_line(offsets[-1])   # last line has to end exactly at the end of the log
+    except OSError:
+        return False
+    return len(last) > 0 and offsets[-1] + len(last) == log_size
+
+
+def rebuild():   # reads the complete log once, creates index and totals
+    global offsets
+    global log_size
+    global totals
+
+    offsets = array('Q')
+    totals = {}
+    pos = 0
+    try:
+        with open(storage.current_path(log_path), 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    rlog.debug("Flightlog: Damaged line at " + str(pos) + " ignored")
+                    break
+                offsets.append(pos)
+                add_totals(record)
+                pos += len(line)
+    except OSError:
+        pass
+    if pos < log_size:   # cut damaged end
+        storage.submit(storage.replace_tail, log_path, pos, b'')
+    log_size = pos
+    storage.submit(storage.write_atomic, index_path, offsets.tobytes())
+    storage.save_json(totals_path, totals)
+    rlog.debug("Flightlog: Index rebuilt, {0} flights".format(len(offsets)))
+
+
+def add_totals(record):
+    day = record['takeoff'][:10]
+    t = totals.setdefault(day, [0, 0])
+    t[0] += 1
+    t[1] += record.get('duration', 0)
+
+
+def count():
+    return len(offsets)
+
+
+def read(start, number):
+    # returns up to number records, newest first, start 0 is the latest flight
+    records = []
+    for i in range(len(offsets) - 1 - start, max(len(offsets) - 1 - start - number, -1), -1):
+        if i in written:
+            records.append(written[i])
+            continue
+        try:
+            records.append(json.loads(read_line(offsets[i])))
+        except (OSError, ValueError) as e:
+            rlog.debug("Flightlog: Error " + str(e) + " reading flight " + str(i))
+    return records
+
+
+def add_flight(takeoff, landing):   # takeoff and landing as datetime
+    global log_size
+    global pending_stats
+
+    if log_path is None:
+        return
+    record = {'takeoff': takeoff.isoformat(), 'landing': landing.isoformat(),
+              'duration': round((landing - takeoff).total_seconds())}
+    if pending_stats is not None:
+        if stats_match(landing, pending_stats):
+            record['ground'] = pending_stats
+        else:
+            rlog.debug("Flightlog: pending ground statistics do not match new flight, not paired")
+        pending_stats = None
+    data = (json.dumps(record, default=default) + '\n').encode()
+    written[len(offsets)] = json.loads(data)
+    offsets.append(log_size)
+    log_size += len(data)
+    add_totals(record)
+    storage.submit(storage.append_lines, log_path, data)
+    storage.submit(storage.append_lines, index_path, offsets[-1:].tobytes())
+    storage.save_json(totals_path, totals)
+
+
+def attach_ground_stats(stats):
+    # pairs the statistics of grounddistance with the last flight, if landing times match. The last line of the
+    # log is rewritten, the offset stays the same. If flighttime did not yet detect the landing (grounddistance
+    # detects the stop earlier after hard braking), the statistics are kept until the next add_flight
+    global log_size
+    global pending_stats
+
+    if log_path is None or 'landing_time' not in stats:
+        return
+    last = read(0, 1)
+    if len(last) == 0 or 'ground' in last[0] \
+            or not stats_match(datetime.datetime.fromisoformat(last[0]['landing']), stats):
+        rlog.debug("Flightlog: ground statistics do not match last flight, kept until next flight is added")
+        pending_stats = stats
+        return
+    record = last[0]
+    record['ground'] = stats
+    data = (json.dumps(record, default=default) + '\n').encode()
+    written[len(offsets) - 1] = json.loads(data)
+    log_size = offsets[-1] + len(data)
+    storage.submit(storage.replace_tail, log_path, offsets[-1], data)
+
+
+def day_totals(day):   # (flights, seconds) of a date
+    t = totals.get(day.isoformat(), [0, 0])
+    return t[0], t[1]
+
+
+def month_totals(day):   # (flights, seconds) of the month of date
+    prefix = day.isoformat()[:7]
+    flights = 0
+    seconds = 0
+    for key, t in totals.items():
+        if key.startswith(prefix):
+            flights += t[0]
+            seconds += t[1]
+    return flights, seconds
+
+
+def clear():   # deletes the complete log
+    global offsets
+    global log_size
+    global totals
+    global pending_stats
+
+    if log_path is None:
+        return
+    offsets = array('Q')
+    log_size = 0
+    totals = {}
+    pending_stats = None
+    written.clear()
+    storage.submit(storage.write_atomic, log_path, b'')
+    storage.submit(storage.write_atomic, index_path, b'')
+    storage.save_json(totals_path, totals)
@@ -32,31 +32,21 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-# flight times are store in stratux-radar.flights
-# This file contains json formatted start and landing times. Here is an example:
-# {
-#    "last_flights": [
-#        [
-#            "2023-12-11T14:19:57.296707+00:00",
-#            "2023-12-11T14:50:10.197035+00:00"
-#       ],
-#        [
-#            "2023-12-10T16:47:00+00:00",
-#            "2023-12-10T17:57:00+00:00"
-#        ],
-#        [
-#            "2023-12-10T13:08:00+00:00",
-#            "2023-12-10T15:21:00+00:00"
-#        ]
-#    ]
-# }
+# finished flights are stored in the flight log, see flightlog.py. The flight currently in the air is only kept
+# in memory. Older versions stored the last 20 flights in stratux-radar.flights (json document or journal with
+# one line per flight), these are moved into the flight log once, the old file is renamed afterwards.
 
 
 import datetime
 import logging
-import json
+import os
+import time
 import radarbuttons
 import radarmodes
+import simulation
+import storage
+import flightlog
+import math
 
 
 # constants
@@ -69,11 +59,16 @@ TRIGGER_PERIOD_LANDING = 5
 # min time in seconds threshold has to be underrug before landing is triggered (to compensate gps errors)
 TRIGGER_PERIOD_STOP = 10
 # min time in seconds threshold has to be underrun before stop is triggered which will change display
-FLIGHT_LIST_LENGTH = 20   # maximum length of flightlist which are remembered
+CLEAR_CONFIRM_TIME = 5
+# time in seconds in which clearing the flight list has to be confirmed by a second button press
+MIGRATED_SUFFIX = ".migrated"
+# suffix of the saved flights of older versions after they were moved into the flight log
 
 
 # global variables
-g_saved_flights = None   # filename of saved flights, set in init
+g_saved_flights = None   # filename of saved flights of older versions, set in init
+current_flight = None    # takeoff time of flight in the air, None if not flying
+page = 0                 # page of flight list displayed
 measurement_enabled = False
 takeoff_time = None
 landing_time = None
@@ -86,81 +81,68 @@ takeoff_delta = datetime.timedelta(seconds=TRIGGER_PERIOD_TAKEOFF)
 landing_delta = datetime.timedelta(seconds=TRIGGER_PERIOD_LANDING)
 stop_delta = datetime.timedelta(seconds=TRIGGER_PERIOD_STOP)
 flighttime_changed = True
+clear_requested = None      # monotonic time when clearing was requested, None if no confirmation pending
 rlog = None
-g_config = {}
 
 
-def default(obj):
-    if isinstance(obj, (datetime.date, datetime.datetime)):
-        return obj.isoformat()
-
-
-def init(activated, saved_flights):
+def init(activated, saved_flights, flightlog_file):
     global rlog
     global measurement_enabled
-    global g_config
     global g_saved_flights
 
     rlog = logging.getLogger('stratux-radar-log')
     rlog.debug("Flighttime: time-measurement initialized")
     measurement_enabled = activated
     g_saved_flights = saved_flights
-    fl = read_flights()
-    if fl is not None:
-        g_config = fl
-    if 'last_flights' in g_config:
-        rlog.debug("Flighttime: Last flights read from config: " + json.dumps(g_config['last_flights'], indent=4,
-                                                                              default=default))
-
-
-def new_flight(flight):
-    if 'last_flights' not in g_config:
-        g_config['last_flights'] = []
-    g_config['last_flights'].insert(0, flight)
-    if len(g_config['last_flights']) > FLIGHT_LIST_LENGTH:
-        del g_config['last_flights'][FLIGHT_LIST_LENGTH-1]
+    flightlog.init(flightlog_file)
+    if not os.path.exists(saved_flights):
+        return
+    last_flights = read_flights()
+    if last_flights is None:
+        return
+    if flightlog.count() == 0:   # otherwise they were moved before, but renaming did not happen
+        for f in reversed(last_flights):   # oldest first
+            if f[1] != 0:
+                flightlog.add_flight(f[0], f[1])
+        storage.flush()   # flight log is on the sd card before the old file is renamed
+        rlog.debug("Flighttime: {0} flights moved from {1} to flight log".format(flightlog.count(),
+                                                                                  saved_flights))
+    try:
+        os.replace(saved_flights, saved_flights + MIGRATED_SUFFIX)
+    except OSError as e:
+        rlog.debug("Flighttime: Error " + str(e) + " renaming " + saved_flights)
 
 
 def read_flights():
-    global rlog
-
-    if rlog is None:   # may be called before init
-        rlog = logging.getLogger('stratux-radar-log')
-    try:
-        with open(g_saved_flights) as f:
-            config = json.load(f)
-    except (OSError, IOError, ValueError) as e:
-        rlog.debug("FlighttimeUI: Error " + str(e) + " reading " + g_saved_flights)
+    # reads flights stored by older versions, newest first. Either a journal with records
+    # {"takeoff": time, "landing": time} per flight or {"clear": true}, or a document {"last_flights": [...]}
+    records = storage.Journal(g_saved_flights).read()
+    if len(records) == 0:
         return None
-
-    # read back last_flights to datetime
-    if 'last_flights' in config:
-        for i in config['last_flights']:
+    last_flights = []
+    try:
+        for record in records:
+            if 'last_flights' in record:
+                last_flights = [[f[0], f[1]] for f in record['last_flights']]
+            elif 'clear' in record:
+                last_flights.clear()
+            elif len(last_flights) > 0 and last_flights[0][0] == record['takeoff']:
+                last_flights[0][1] = record['landing']
+            else:
+                last_flights.insert(0, [record['takeoff'], record['landing']])
+        # read back last_flights to datetime
+        for i in last_flights:
             i[0] = datetime.datetime.fromisoformat(i[0])
             if i[1] != 0:    # if in the air this is 0
                 i[1] = datetime.datetime.fromisoformat(i[1])
-    return config
-
-
-def write_flights():
-    global rlog
-
-    if rlog is None:   # may be called before init
-        rlog = logging.getLogger('stratux-radar-log')
-    try:
-        with open(g_saved_flights, 'wt') as out:
-            json.dump(g_config, out, sort_keys=True, indent=4, default=default)
-    except (OSError, IOError, ValueError) as e:
-        rlog.debug("FlighttimeUI: Error " + str(e) + " writing " + g_saved_flights)
-    rlog.debug("FlighttimeUI: Configuration saved to " + g_saved_flights + ": " +
-               json.dumps(g_config, sort_keys=True, indent=4, default=default))
+    except (KeyError, TypeError, ValueError) as e:
+        rlog.debug("FlighttimeUI: Error " + str(e) + " reading " + g_saved_flights)
+        return None
+    return last_flights
 
 
 def current_starttime():
-    if 'last_flights' in g_config and len(g_config['last_flights']) > 0 and g_config['last_flights'][0][1] == 0:
-        # means we are in the air
-        return g_config['last_flights'][0][0]
-    return None
+    return current_flight   # None if not in the air
 
 
 def trigger_measurement(valid_gps, situation, ahrs, current_mode):
@@ -173,10 +155,11 @@ def trigger_measurement(valid_gps, situation, ahrs, current_mode):
     global new_flight_info
     global flighttime_changed
     global switch_back_mode
+    global current_flight
 
     if not valid_gps or not measurement_enabled:
         return 0
-    now = datetime.datetime.now(datetime.timezone.utc)
+    now = simulation.now()   # accelerated time if a simulation scenario is played
     if not flying:
         if trigger_timestamp is None and situation['gps_speed'] >= SPEED_THRESHOLD_TAKEOFF:
             trigger_timestamp = now
@@ -185,7 +168,7 @@ def trigger_measurement(valid_gps, situation, ahrs, current_mode):
             if now - trigger_timestamp >= takeoff_delta:
                 takeoff_time = now
                 rlog.debug("Flighttime: Takeoff detected at " + str(now))
-                new_flight([now, 0])  # means not yet finished
+                current_flight = now  # not yet finished
                 flighttime_changed = True
                 flying = True
                 trigger_timestamp = None
@@ -202,6 +185,7 @@ def trigger_measurement(valid_gps, situation, ahrs, current_mode):
             elif stop_timestamp is not None and situation['gps_speed'] < SPEED_THRESHOLD_STOPPED:
                 if now - stop_timestamp >= stop_delta:
                     rlog.debug("Flighttime: Stop detected at " + str(now))
+                    storage.persist_nowait()   # aircraft stopped, write flight log to sd card
                     stop_timestamp = None
                     new_flight_info = False   # stop is only triggered once
                     switch_back_mode = current_mode
@@ -220,10 +204,9 @@ def trigger_measurement(valid_gps, situation, ahrs, current_mode):
             if now - trigger_timestamp >= landing_delta:
                 landing_time = now
                 rlog.debug("Flighttime: Landing detected at " + str(now))
-                if 'last_flights' in g_config and len(g_config['last_flights']) > 0:
-                    # do not do that, if list was cleared
-                    g_config['last_flights'][0][1] = now
-                write_flights()
+                if current_flight is not None:   # do not do that, if list was cleared
+                    flightlog.add_flight(current_flight, now)
+                    current_flight = None
                 flying = False
                 new_flight_info = True
                 trigger_timestamp = None
@@ -234,40 +217,76 @@ def trigger_measurement(valid_gps, situation, ahrs, current_mode):
     return 0
 
 
+def flights_page(page_no, lines):
+    # flights of the page, newest first, as [takeoff, landing], landing is 0 if in the air. Flight in the air is
+    # the first entry of the first page
+    flights = []
+    in_air = 1 if current_flight is not None else 0
+    if in_air and page_no == 0:
+        flights.append([current_flight, 0])
+    start = max(0, page_no * lines - in_air)
+    for record in flightlog.read(start, lines - len(flights)):
+        flights.append([datetime.datetime.fromisoformat(record['takeoff']),
+                        datetime.datetime.fromisoformat(record['landing'])])
+    return flights
+
+
+def no_of_pages(lines):
+    in_air = 1 if current_flight is not None else 0
+    return max(1, math.ceil((flightlog.count() + in_air) / lines))
+
+
 def draw_flighttime(display_control, changed):
     global flighttime_changed
+    global page
+    global clear_requested
 
+    if clear_requested is not None and time.monotonic() - clear_requested > CLEAR_CONFIRM_TIME:
+        clear_requested = None   # not confirmed, show normal labels again
+        flighttime_changed = True
     if changed or flighttime_changed:
         flighttime_changed = False
         display_control.clear()
-        if 'last_flights' in g_config:
-            last_flights = g_config['last_flights']
-        else:
-            last_flights = []
-        display_control.flighttime(last_flights)
+        lines = display_control.FLIGHT_LINES
+        pages = no_of_pages(lines)
+        if page >= pages:
+            page = 0
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        totals = (flightlog.day_totals(today)[1], flightlog.month_totals(today)[1])   # flight time in secs
+        display_control.flighttime(flights_page(page, lines), page, pages, totals, clear_requested is not None)
         display_control.display()
 
 
 def user_input():
     global flighttime_changed
     global switch_back_mode
-    global g_config
+    global current_flight
+    global page
+    global clear_requested
 
     btime, button = radarbuttons.check_buttons()
     if btime == 0:
         return 0  # stay in current mode
     flighttime_changed = True
     switch_back_mode = 0    # cancel any switchback, if button was pressed
+    confirmed = clear_requested is not None
+    clear_requested = None   # any other button cancels a pending clear
     if button == 1 and (btime == 1 or btime == 2):  # middle in any case
         return radarmodes.next_mode_sequence(17)  # next mode
+    if button == 0 and btime == 1:  # left and short, next page of flight list
+        page += 1    # wraps around in draw_flighttime
+        return 17
     if button == 0 and btime == 2:  # left and long
         return 3  # start next mode shutdown!
     if button == 2 and btime == 2:  # right and long, refresh
         return 18  # start next mode for display driver: refresh called
-    if button == 2 and btime == 1:  # right and short, clear flight list
-        if 'last_flights' in g_config:
-            g_config['last_flights'].clear()
+    if button == 2 and btime == 1 and not confirmed:  # right and short, clear flight list after confirmation
+        clear_requested = time.monotonic()
+        return 17
+    if button == 2 and btime == 1:  # right and short again, clear flight list
+        current_flight = None
+        page = 0
+        flightlog.clear()  # also clear stored flights
         rlog.debug("Flight list cleared by button press")
-        write_flights()  # also clear stored flights
         return 17  # start next mode for display driver: refresh called
     return 17  # no mode change
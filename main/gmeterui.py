@@ -33,7 +33,7 @@
 
 import radarbuttons
 import logging
-import requests
+import stratuxclient
 import radarmodes
 
 # constants
@@ -55,10 +55,7 @@ def init(url):
 
 def reset_gmeter():
     rlog.debug("GMeterUI: Reset gmeter triggered")
-    try:
-        requests.post(url_gmeter_reset)
-    except requests.exceptions.RequestException as e:
-        rlog.debug("Posting gmeter-reset exception: ", e)
+    stratuxclient.post_nowait(url_gmeter_reset)
 
 
 def draw_gmeter(display_control, ui_changed, connected, gmeter):
@@ -36,22 +36,10 @@
 # dtoverlay=miniuart-bt
 
 # start and landing statistics are stored in stratux-radar.stat
-# This file has json coded statistics for every flight, see this example
-# {
-#    "start_time": "2023-01-15 12:57:21.873912+00:00",
-#    "start_altitude": 879.8726,
-#    "takeoff_distance": 0.0,
-#    "landing_time": "2023-01-15 12:57:22.106499+00:00",
-#    "landing_altitude": 879.8606,
-#    "landing_distance": 0.0
-# }{
-#    "start_time": "2023-01-15 12:57:28.223856+00:00",
-#    "start_altitude": 880.92865,
-#    "takeoff_distance": 0.0,
-#    "landing_time": "2023-01-15 12:57:28.444494+00:00",
-#    "landing_altitude": 880.77216,
-#    "landing_distance": 0.0
-# }
+# This file is a journal with one json coded line of statistics for every flight, see this example
+# {"start_time": "2023-01-15 12:57:21.873912+00:00", "start_altitude": 879.8726, "takeoff_distance": 0.0, ...}
+# {"start_time": "2023-01-15 12:57:28.223856+00:00", "start_altitude": 880.92865, "takeoff_distance": 0.0, ...}
+# older versions wrote pretty printed json objects one after the other, storage.Journal reads both
 
 import logging
 import radarmodes
@@ -63,15 +51,31 @@ import math
 import serial
 import simulation
 import radarbluez
+import audioengine
 import radarbuttons
 import binascii
+import storage
+import flightlog
+import threading
+from collections import deque
+import numpy
 
 rlog = None  # radar specific logger
 
 # constants
 MEASUREMENTS_PER_SECOND = 10     # number of distance ranging meaurements per second
 # A22 usonic sensor allows approx. 10 per second
-# TFMini-Plus sensor allows 100 per second
+# TFMini-Plus sensor allows 100 per second, all frames are read by the reader thread of the sensor
+SERIAL_READ_TIMEOUT = 0.1    # max time in secs the reader thread blocks in one read
+SENSOR_STREAM_LENGTH = 256   # max number of distance values kept until they are taken
+ZERO_DISTANCE_WAIT = 1.0     # max time in secs to wait for the first distance during start
+# filter of the full rate distance stream: median against outliers, alpha-beta filter for height and sink rate
+FILTER_MEDIAN_LENGTH = 5     # number of raw values for the median
+FILTER_ALPHA = 0.3           # correction factor of height
+FILTER_BETA = 0.05           # correction factor of rate
+FILTER_TIMEOUT = 0.3         # secs without valid value, then height is invalid and filter restarts
+MIN_SINK_RATE = 50           # mm/s, below this no time to touchdown is predicted
+CALLOUT_LEAD_TIME = 0.5      # secs, callouts are spoken on predicted height to compensate speech latency
 
 # GPS-Measurement of start-distance
 DISTANCE_START_DETECTED = 30 * 10  # in mm where measurement assumes that plane is in the air
@@ -83,6 +87,7 @@ STOP_SPEED = 5  # in kts, speed when before runup or after landing a stop is ass
 STATS_PER_SECOND = 5  # how many statistics are written per second
 STATS_FOR_SITUATION_CHANGE = 3  # no of values in a row before a situation is changed (landing/flying)
 STATS_TOTAL_TIME = 120  # time in seconds how long statistic window is
+SAVED_STATS_KEPT = 100  # no of landings kept in the statistics file when it is compacted, all are in the flight log
 INVALID_GDISTANCE = -9999   # indicates no valid grounddistance
 
 MIN_GPS_V_ACCURACY = 150   # minimum horizontal accuracy of gps, if not met, no speech warnings are spoken
@@ -90,6 +95,11 @@ MIN_GPS_V_ACCURACY = 150   # minimum horizontal accuracy of gps, if not met, no
 GEAR_DOWN_WARNING = '<pitch level="110"> Gear down! </pitch>'    # warning to be spoken, when gear_
 GEAR_NOT_DOWN_GO_AROUND = '<pitch level="130"> Go around! Gear not down! </pitch>'
 
+STAT_DTYPE = numpy.dtype([   # one row of the statistics, Time is stored as posix timestamp
+    ('Time', 'f8'), ('baro_valid', '?'), ('own_altitude', 'f8'), ('gps_active', '?'), ('longitude', 'f8'),
+    ('latitude', 'f8'), ('gps_speed', 'f8'), ('gps_altitude', 'f8'), ('gps_h_accuracy', 'f8'),
+    ('gps_v_accuracy', 'f8'), ('g_distance_valid', '?'), ('g_distance', 'f8'), ('gear_down', '?')])
+
 
 # globals
 ground_distance_active = False  # True if sensor is found and activated
@@ -99,7 +109,6 @@ zero_distance = 0.0  # distance of sensor when aircraft is on ground
 value_debug_level = 0  # set during init
 simulation_mode = False  # set during init
 # statistics for calculating values
-statistics = []  # values for calculating everything
 stats_max_values = STATS_PER_SECOND * STATS_TOTAL_TIME
 stats_next_store = 0
 global_situation = None
@@ -112,12 +121,13 @@ obstacle_up_clear = None  # situation values when obstacle clearance was reached
 obstacle_down_clear = None  # situation values when obstacle clearance was last reacheds when landing
 landing_situation = None  # situation when wheels touch the ground
 stop_situation = None  # siuation values when the aircraft is stopped on the runway
+airborne_time = None  # time of last liftoff (start or touch and go), landing is searched after this time
 
 stats_before_airborne = 0
-stats_before_landing = 0
 stats_before_stop = 0
 stats_before_obstacle_clear = 0
 saved_statistics = None    # filename for statistics, set in init
+stats_journal = None       # storage.Journal of saved_statistics
 
 gps_warnings = (1000, 500)    # speech warnings in feet, when calculated with gps
 gps_upper = [False] * len(gps_warnings)  # is true, if height + hysteresis was met
@@ -159,15 +169,29 @@ def set_dest_elevation(dest_increment):
     rlog.debug('Grounddistance: Destination Altitude set to {0:5.0f}'.format(dest_elevation))
 
 
-class UsonicSensor:   # definition adapted from DFRobot code
-    distance_max = 3000
-    distance_min = 5
-    ser = None
-    distance = 0
+class SerialSensor:
+    # base class for sensors streaming frames via uart. A reader thread reads all bytes, the streaming parser
+    # finds every frame and verifies its checksum, every distance is published with its timestamp
+    header = b''
+    frame_length = 0
+    distance_max = 0
+    distance_min = 0
+
+    def __init__(self):
+        self.ser = None
+        self.distance = 0
+        self.distance_time = 0.0    # time.monotonic() of last distance
+        self.pending = bytearray()  # received bytes not yet parsed
+        self.stream = deque(maxlen=SENSOR_STREAM_LENGTH)   # (timestamp, distance in mm), 0 is invalid
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.reader = None
+        self.frames = 0
+        self.checksum_errors = 0
 
     def init(self):
-        self.ser = serial.Serial("/dev/ttyAMA0", 115200)     # A22 module has 115200 baud
-        self.ser.flushInput()
+        self.ser = serial.Serial("/dev/ttyAMA0", 115200, timeout=SERIAL_READ_TIMEOUT)   # both modules have 115200
+        self.ser.reset_input_buffer()
         if not self.ser.isOpen():
             return False
         return True
@@ -176,105 +200,212 @@ class UsonicSensor:   # definition adapted from DFRobot code
         self.distance_max = maxi
         self.distance_min = mini
 
-    @staticmethod
-    def _check_sum(le):
-        return (le[0] + le[1] + le[2]) & 0x00ff
-
     def last_distance(self):
         return self.distance
 
-    async def calc_distance(self):
-        data = [0] * 4
-        timenow = time.time()
-        while self.ser.inWaiting() < 4:
-            await asyncio.sleep(UART_WAIT_TIME)
-            if (time.time() - timenow) > UART_BREAK_TIME:
+    def checksum_ok(self, frame):
+        return False
+
+    def frame_distance(self, frame):   # distance in mm of a verified frame
+        return 0
+
+    def parse(self, data):   # streaming parser, returns list of complete frames with valid checksum
+        self.pending += data
+        frames = []
+        pos = 0
+        while True:
+            start = self.pending.find(self.header, pos)
+            if start < 0:   # keep bytes which might be the beginning of a header
+                pos = max(pos, len(self.pending) - len(self.header) + 1)
                 break
-        rlt = self.ser.read(self.ser.inWaiting())
-        if len(rlt) >= 4:
-            index = len(rlt) - 4
-            while True:
-                try:
-                    data[0] = ord(rlt[index])
-                except TypeError:
-                    data[0] = rlt[index]
-                if data[0] == 0xFF:
-                    break
-                elif index > 0:
-                    index = index - 1
-                else:
-                    break
-            if data[0] == 0xFF:
-                try:
-                    data[1] = ord(rlt[index + 1])
-                    data[2] = ord(rlt[index + 2])
-                    data[3] = ord(rlt[index + 3])
-                except TypeError:
-                    data[1] = rlt[index + 1]
-                    data[2] = rlt[index + 2]
-                    data[3] = rlt[index + 3]
-                sumd = self._check_sum(data)
-                if sumd == data[3]:
-                    self.distance = data[1] * 256 + data[2]
-                    if self.distance > self.distance_max or self.distance < self.distance_min:
-                        self.distance = 0
-
-
-class LidarSensor:   # Implementation for TFMini-Plus Lidar Sensor
-    lidar_bytes = 9
+            if start + self.frame_length > len(self.pending):   # frame not yet complete
+                pos = start
+                break
+            frame = self.pending[start:start + self.frame_length]
+            if self.checksum_ok(frame):
+                frames.append(bytes(frame))
+                pos = start + self.frame_length
+            else:   # header bytes were part of data, resync one byte later
+                self.checksum_errors += 1
+                rlog.log(value_debug_level, "Distance-Sensor: Invalid checksum " + str(binascii.hexlify(frame)))
+                pos = start + 1
+        del self.pending[:pos]
+        return frames
+
+    def publish(self, frame):
+        distance = self.frame_distance(frame)
+        if distance > self.distance_max or distance < self.distance_min:
+            distance = 0
+        now = time.monotonic()
+        with self.lock:
+            self.distance = distance
+            self.distance_time = now
+            self.stream.append((now, distance))
+        self.frames += 1
+
+    def read_loop(self):   # reader thread
+        while not self.stop_event.is_set():
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting))   # blocks max SERIAL_READ_TIMEOUT
+            except (serial.SerialException, OSError) as e:
+                rlog.debug("Distance-Sensor: Error reading serial: " + str(e))
+                self.stop_event.wait(SERIAL_READ_TIMEOUT)
+                continue
+            for frame in self.parse(data):
+                self.publish(frame)
+        rlog.debug("Distance-Sensor: reader thread terminated after {0} frames, {1} checksum errors"
+                   .format(self.frames, self.checksum_errors))
+
+    def start(self):
+        self.stop_event.clear()
+        self.reader = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.reader is not None:
+            self.reader.join(2 * SERIAL_READ_TIMEOUT)
+            self.reader = None
+
+    def new_samples(self):   # all (timestamp, distance) received since the last call
+        with self.lock:
+            samples = list(self.stream)
+            self.stream.clear()
+        return samples
+
+
+class UsonicSensor(SerialSensor):   # definition adapted from DFRobot code, A22 module
+    header = b'\xff'
+    frame_length = 4
+    distance_max = 3000
+    distance_min = 5
+
+    def checksum_ok(self, frame):
+        return (frame[0] + frame[1] + frame[2]) & 0x00ff == frame[3]
+
+    def frame_distance(self, frame):
+        return frame[1] * 256 + frame[2]
+
+
+class LidarSensor(SerialSensor):   # Implementation for TFMini-Plus Lidar Sensor
+    header = b'\x59\x59'
+    frame_length = 9
     distance_max = 5000    # sensor is able to detect till 12 meters but reliable only to 4 m in bad conditions
     distance_min = 100     # 10 cm min
-    ser = None
-    distance = 0
-    strength = 0
-    celsius = 0
 
-    def init(self):
-        self.ser = serial.Serial("/dev/ttyAMA0", 115200)     # Lidar module has 115200 baud
-        self.ser.flushInput()
-        if not self.ser.isOpen():
-            return False
-        return True
-
-    def last_distance(self):
-        return self.distance
-    def calc_distance(self):
-        if  self.ser.inWaiting() < self.lidar_bytes:
-            rlog.debug("Error, no data received from Lidar sensor")
+    def __init__(self):
+        super().__init__()
+        self.strength = 0
+        self.celsius = 0
+
+    def checksum_ok(self, frame):
+        return (sum(frame[0:8]) & 0xFF) == frame[8]
+
+    def frame_distance(self, frame):
+        self.strength = frame[4] + frame[5] * 256
+        self.celsius = (frame[6] + frame[7] * 256) / 8 - 256   # convert temp code to degrees Celsius
+        return 10 * (frame[2] + frame[3] * 256)
+
+
+class DistanceFilter:   # median and alpha-beta filter on the distance stream, all values in mm and mm/s
+    def __init__(self):
+        self.window = deque(maxlen=FILTER_MEDIAN_LENGTH)
+        self.height = None   # filtered height above zero distance, None if not yet valid
+        self.rate = 0.0      # change of height, negative if descending
+        self.last_time = 0.0
+
+    def reset(self):
+        self.window.clear()
+        self.height = None
+        self.rate = 0.0
+
+    def update(self, timestamp, height):
+        if self.height is not None and timestamp - self.last_time > FILTER_TIMEOUT:
+            self.reset()   # gap in the stream, do not extrapolate over it
+        self.window.append(height)
+        measured = sorted(self.window)[len(self.window) // 2]
+        if self.height is None:
+            self.height = measured
+            self.rate = 0.0
+            self.last_time = timestamp
             return
-        result = self.ser.read(self.ser.inWaiting())
-        rlog.log(value_debug_level, f"Lidar sensor - Bytes received: {len(result)} : {binascii.hexlify(result)} ")
-        if len(result) >= self.lidar_bytes:
-            index = len(result) - self.lidar_bytes
-            while True:   # find last 0x59 0x59
-                 if result[index] == 0x59 and result[index + 1] == 0x59:
-                     break
-                 else:
-                     if index > 0:
-                         index = index - 1
-                     else:
-                         rlog.debug("Lidar-Sensor: Frame Header not found")
-                         return
-            # here we found two 0x59, now check checksum
-            checksum = 0x00
-            for i in range(self.lidar_bytes - 1):
-                checksum += result[index + i]
-            if (checksum & 0xFF) == result[index + 8]:  # checksum check
-                # now calculate distance and strength
-                self.distance = 10 * (result[index + 2] + result[index + 3] * 256)
-                if self.distance > self.distance_max or self.distance < self.distance_min:
-                    self.distance = 0
-                self.strength = result[index + 4] + result[index + 3] * 256
-                self.celsius = result[index + 6] + result[index + 7] * 256
-                #  Convert temp code to degrees Celsius.
-                self.celsius =  self.celsius / 8 - 256
-                rlog.log(value_debug_level, "Lidar-Sensor: Distance {self.distance} Strength {self.strength} Celsius {self.celsius}")
-            else:
-                 rlog.debug(f"Lidar-Sensor: Invalid checksum")
+        dt = timestamp - self.last_time
+        if dt <= 0:
+            return
+        predicted = self.height + self.rate * dt
+        residual = measured - predicted
+        self.height = predicted + FILTER_ALPHA * residual
+        self.rate = self.rate + FILTER_BETA * residual / dt
+        self.last_time = timestamp
+
+    def valid(self, now):
+        return self.height is not None and now - self.last_time <= FILTER_TIMEOUT
+
+    def time_to_touchdown(self):   # predicted secs until height is zero, None if not descending
+        if self.height is None or self.rate > -MIN_SINK_RATE:
+            return None
+        return max(0.0, self.height / -self.rate)
+
+
+class StatsBuffer:
+    # ring buffer of statistic rows in a structured array. Every row is stored twice (at index and index + size),
+    # so the chronological window is always a contiguous slice and can be searched vectorised
+    def __init__(self, size):
+        self.size = size
+        self.buffer = numpy.zeros(2 * size, dtype=STAT_DTYPE)
+        self.head = 0     # next index to write
+        self.count = 0    # number of valid rows, max size
+
+    def append(self, stat):
+        row = tuple(stat['Time'].timestamp() if name == 'Time' else stat[name] for name in STAT_DTYPE.names)
+        self.buffer[self.head] = row
+        self.buffer[self.head + self.size] = row
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def values(self):   # chronological view on the rows, no copy
+        end = self.head + self.size
+        return self.buffer[end - self.count:end]
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def crossing(self, column, valid, threshold, rising, since=None):
+        # finds the last crossing of threshold in column (rising or falling) between two rows where valid is set,
+        # only rows from time since (datetime) on if given.
+        # Returns a situation interpolated to the time of the crossing, None if there is no crossing in the window
+        rows = self.values()
+        if len(rows) < 2:
+            return None
+        values = rows[column]
+        both_valid = rows[valid][:-1] & rows[valid][1:]
+        if since is not None:
+            both_valid &= rows['Time'][:-1] >= since.timestamp()
+        if rising:
+            hits = both_valid & (values[:-1] < threshold) & (values[1:] >= threshold)
         else:
-              rlog.debug(f"Lidar-Sensor: Error less bytes read than expected")
+            hits = both_valid & (values[:-1] > threshold) & (values[1:] <= threshold)
+        found = numpy.flatnonzero(hits)
+        if len(found) == 0:
+            return None
+        before = rows[found[-1]]
+        after = rows[found[-1] + 1]
+        fraction = (threshold - before[column]) / (after[column] - before[column])
+        stat = {}
+        for name in STAT_DTYPE.names:
+            if STAT_DTYPE[name].kind == 'b':
+                stat[name] = bool(after[name])
+            else:
+                stat[name] = float(before[name] + fraction * (after[name] - before[name]))
+        stat['Time'] = datetime.datetime.fromtimestamp(stat['Time'], datetime.timezone.utc)
+        return stat
 
 
+statistics = StatsBuffer(stats_max_values)  # values for calculating everything
+ground_filter = DistanceFilter()   # filtered height of the ground sensor
+
 
 def reset_values():
     global runup_situation
@@ -285,9 +416,11 @@ def reset_values():
     global stop_situation
     global zero_distance
     global fly_status
+    global airborne_time
 
     runup_situation = None
     start_situation = None
+    airborne_time = None
     obstacle_up_clear = None
     obstacle_down_clear = None
     landing_situation = None
@@ -298,6 +431,7 @@ def reset_values():
         new_zero_distance = distance_sensor.last_distance()   # take last value, don't wait (no async function)
         if new_zero_distance > 0:
             zero_distance = new_zero_distance
+            ground_filter.reset()
             rlog.debug('Ground Zero Distance reset to: {0:5.2f} cm'.format(zero_distance / 10))
         else:
             rlog.debug('Error resetting gound zero distance')
@@ -313,6 +447,7 @@ def init(activate, stat_file, debug_level, distance_indication, situation, sim_m
     global zero_distance
     global simulation_mode
     global saved_statistics
+    global stats_journal
     global global_config
 
     simulation_mode = sim_mode
@@ -336,6 +471,11 @@ def init(activate, stat_file, debug_level, distance_indication, situation, sim_m
     ground_distance_active = True
     value_debug_level = debug_level
     saved_statistics = stat_file
+    stats_journal = storage.Journal(stat_file, compact_lines=2 * SAVED_STATS_KEPT)
+    records = stats_journal.read()
+    if stats_journal.compaction_due():
+        stats_journal.compact(records[-SAVED_STATS_KEPT:], default=str)
+        rlog.debug("Grounddistance: Statistics file compacted to last {0} landings".format(SAVED_STATS_KEPT))
     global_situation = situation  # to be able to read and store situation info
     rlog.debug("Ground Distance Measurement - Ground sensor active.")
 
@@ -346,16 +486,10 @@ def init(activate, stat_file, debug_level, distance_indication, situation, sim_m
     return ground_distance_active
 
 
-def write_stats():
-    global rlog
-
-    if rlog is None:  # may be called before init
-        rlog = logging.getLogger('stratux-radar-log')
-    try:
-        with open(saved_statistics, 'at') as out:
-            json.dump(calculate_output_values(), out, indent=4, default=str)
-    except (OSError, IOError, ValueError) as e:
-        rlog.debug("Grounddistance: Error " + str(e) + " writing " + saved_statistics)
+def write_stats():   # appended as one line to the journal, written by the storage thread
+    stats = calculate_output_values()
+    stats_journal.append(stats, default=str)
+    flightlog.attach_ground_stats(stats)   # store with the flight in the flight log
     rlog.debug("Grounddistance: Statistics saved to " + saved_statistics)
 
 
@@ -365,10 +499,20 @@ def prepare_sounds():
     global gear_not_down_warning_sound
     global go_around_warning_sound
 
-    gps_warnings_sounds = radarbluez.prepare_sounds_tuple(gps_warnings)
-    sensor_warnings_sounds = radarbluez.prepare_sounds_tuple(sensor_warnings)
-    gear_not_down_warning_sound = radarbluez.prepare_sounds_string(GEAR_DOWN_WARNING)
-    go_around_warning_sound = radarbluez.prepare_sounds_string(GEAR_NOT_DOWN_GO_AROUND)
+    # all sounds in one call, so that they are synthesised in parallel if not yet cached
+    texts = [str(i) for i in gps_warnings] + [str(i) for i in sensor_warnings] + \
+        [GEAR_DOWN_WARNING, GEAR_NOT_DOWN_GO_AROUND]
+    sounds = radarbluez.prepare_sounds(texts)
+    if sounds is None:
+        gps_warnings_sounds = None
+        sensor_warnings_sounds = None
+        gear_not_down_warning_sound = None
+        go_around_warning_sound = None
+        return
+    gps_warnings_sounds = sounds[:len(gps_warnings)]
+    sensor_warnings_sounds = sounds[len(gps_warnings):len(gps_warnings) + len(sensor_warnings)]
+    gear_not_down_warning_sound = sounds[-2]
+    go_around_warning_sound = sounds[-1]
 
 
 def calc_distance_speaker(stat):
@@ -377,14 +521,15 @@ def calc_distance_speaker(stat):
     else:
         gps_distance = 0.0
     if stat['g_distance_valid']:
-        ground_distance = stat['g_distance'] / 328.1    # g_distance is in mm, here we need ft
+        # height predicted for the time the callout is heard, g_distance is in mm, here we need ft
+        ground_distance = (stat['g_distance'] - stat['g_sink_rate'] * CALLOUT_LEAD_TIME) / 304.8
     else:
         ground_distance = 0.0
     if indicate_distance and fly_status == 1:
         for (i, height) in enumerate(gps_warnings):
             if gps_distance <= height and gps_upper[i]:
                 # distance is reached and was before higher than hysteresis
-                if gps_warnings_sounds is not None:
+                if gps_warnings_sounds is not None and gps_warnings_sounds[i] is not None:
                     radarbluez.speak_sound(gps_warnings_sounds[i])
                 gps_upper[i] = False
             if gps_distance >= height * hysteresis:
@@ -392,7 +537,7 @@ def calc_distance_speaker(stat):
         for (i, height) in enumerate(sensor_warnings):
             if ground_distance <= height and sensor_upper[i]:
                 # distance is reached and was before higher than hysteresis
-                if sensor_warnings_sounds is not None:
+                if sensor_warnings_sounds is not None and sensor_warnings_sounds[i] is not None:
                     radarbluez.speak_sound(sensor_warnings_sounds[i])
                 sensor_upper[i] = False
             if ground_distance >= height * hysteresis:
@@ -428,17 +573,14 @@ def is_airborne():
     return False
 
 
-def has_landed():
-    global stats_before_landing
-
-    if global_situation['g_distance_valid'] and global_situation['g_distance'] <= DISTANCE_LANDING_DETECTED:
-        stats_before_landing += 1
-        if stats_before_landing >= STATS_FOR_SITUATION_CHANGE:
-            stats_before_landing = 0
-            return True
-    else:
-        stats_before_landing = 0
-    return False
+def has_landed():   # on filtered height, no values in a row needed
+    if not global_situation['g_distance_valid']:
+        return False
+    if global_situation['g_distance'] <= DISTANCE_LANDING_DETECTED:
+        return True
+    # touchdown expected before next evaluation
+    return global_situation['g_distance'] < DISTANCE_START_DETECTED and \
+        global_situation['g_touchdown'] is not None and global_situation['g_touchdown'] <= 1 / STATS_PER_SECOND
 
 
 def has_stopped():
@@ -523,51 +665,66 @@ def evaluate_statistics(latest_stat):
     global landing_situation
     global obstacle_down_clear
     global stop_situation
+    global airborne_time
 
     if fly_status == 0:  # run up
         if is_airborne():
             fly_status = 1  # start detected
-            start_situation = latest_stat  # store this value
+            start_situation = statistics.crossing('g_distance', 'g_distance_valid', DISTANCE_START_DETECTED, True)
+            if start_situation is None:
+                start_situation = latest_stat  # no crossing in window, take this value
+            airborne_time = start_situation['Time']
             obstacle_down_clear = None  # in case a second start is done, clear all values
             obstacle_up_clear = None
             landing_situation = None
             stop_situation = None
             rlog.debug("Grounddistance: Start detected " +
                        json.dumps(start_situation, indent=4, sort_keys=True, default=str))
-            for stat in reversed(statistics):  # ... find begin of start where gps_speed <= STOP_SPEED
-                if stat['gps_active'] and stat['gps_speed'] <= STOP_SPEED:
-                    runup_situation = stat
-                    break
+            # ... find begin of start where gps_speed exceeded STOP_SPEED
+            runup_situation = statistics.crossing('gps_speed', 'gps_active', STOP_SPEED, True)
     elif fly_status == 1:  # start was detected
         if obstacle_up_clear is None:  # do not search for if already set
             if latest_stat['baro_valid'] and start_situation['baro_valid'] and \
                     obstacle_is_clear(latest_stat['own_altitude'], start_situation['own_altitude'] + OBSTACLE_HEIGHT):
-                obstacle_up_clear = latest_stat
+                obstacle_up_clear = statistics.crossing('own_altitude', 'baro_valid',
+                                                        start_situation['own_altitude'] + OBSTACLE_HEIGHT, True)
+                if obstacle_up_clear is None:
+                    obstacle_up_clear = latest_stat
                 rlog.debug("Grounddistance: Obstacle clearance up detected " +
                            json.dumps(obstacle_up_clear, indent=4, sort_keys=True, default=str))
         if has_landed():
             fly_status = 2
-            landing_situation = latest_stat
+            # only since last liftoff, not an older touchdown of a touch and go
+            landing_situation = statistics.crossing('g_distance', 'g_distance_valid', DISTANCE_LANDING_DETECTED,
+                                                    False, airborne_time)
+            if landing_situation is None:   # e.g. detected by predicted touchdown, height not yet crossed
+                landing_situation = dict(latest_stat)
+                if latest_stat['g_touchdown'] is not None:
+                    landing_situation['Time'] += datetime.timedelta(seconds=latest_stat['g_touchdown'])
             rlog.debug("Grounddistance: Landing detected " +
                        json.dumps(landing_situation, indent=4, sort_keys=True, default=str))
-            if obstacle_down_clear is None:
-                for stat in reversed(statistics):
-                    if stat['baro_valid'] and landing_situation['baro_valid'] and \
-                      obstacle_is_clear(stat['own_altitude'], landing_situation['own_altitude'] + OBSTACLE_HEIGHT):
-                        obstacle_down_clear = stat
-                        rlog.debug("Grounddistance: Obstacle clearance down found " +
-                                   json.dumps(obstacle_down_clear, indent=4, sort_keys=True, default=str))
-                        break
+            if obstacle_down_clear is None and landing_situation['baro_valid']:
+                # last time the altitude went below obstacle height
+                obstacle_down_clear = statistics.crossing('own_altitude', 'baro_valid',
+                                                          landing_situation['own_altitude'] + OBSTACLE_HEIGHT, False,
+                                                          airborne_time)
+                if obstacle_down_clear is not None:
+                    rlog.debug("Grounddistance: Obstacle clearance down found " +
+                               json.dumps(obstacle_down_clear, indent=4, sort_keys=True, default=str))
     elif fly_status == 2:  # landing detected, waiting for stop to calculate distance
         if has_stopped():
             fly_status = 0
-            stop_situation = latest_stat
+            stop_situation = statistics.crossing('gps_speed', 'gps_active', STOP_SPEED, False)
+            if stop_situation is None:
+                stop_situation = latest_stat
             rlog.debug("Grounddistance: Stop detected " +
                        json.dumps(stop_situation, indent=4, sort_keys=True, default=str))
             write_stats()
+            storage.persist_nowait()   # aircraft stopped, write statistics to sd card
             statistics.clear()  # start fresh with statistics
         elif is_airborne():  # touch and go performed!
             fly_status = 1  # go back to flying mode
+            airborne_time = latest_stat['Time']
             landing_situation = None  # clear landing situation, only last landing is recorded
             obstacle_down_clear = None  # clear obstacle down, only last landing is recorded
             rlog.debug("Grounddistance: Re-Start detected without stop, keeping first start " +
@@ -586,6 +743,8 @@ def store_statistics(sit):
             else:
                 sit['g_distance_valid'] = False
                 sit['g_distance'] = INVALID_GDISTANCE
+            sit['g_sink_rate'] = 0.0   # simulation has no stream to filter
+            sit['g_touchdown'] = None
             if 'gps_speed' in sim_data:
                 sit['gps_speed'] = sim_data['gps_speed']
                 sit['gps_active'] = True
@@ -602,16 +761,15 @@ def store_statistics(sit):
                 sit['gear_down'] = False
     if time.perf_counter() > stats_next_store:
         stats_next_store = time.perf_counter() + (1 / STATS_PER_SECOND)
-        now = datetime.datetime.now(datetime.timezone.utc)
+        now = simulation.now()   # accelerated time if a simulation scenario is played
         stat_value = {'Time': now, 'baro_valid': sit['baro_valid'], 'own_altitude': sit['own_altitude'],
                       'gps_active': sit['gps_active'], 'longitude': sit['longitude'], 'latitude': sit['latitude'],
                       'gps_speed': sit['gps_speed'], 'gps_altitude': sit['gps_altitude'],
                       'gps_h_accuracy': sit['gps_h_accuracy'], 'gps_v_accuracy': sit['gps_v_accuracy'],
                       'g_distance_valid': sit['g_distance_valid'], 'g_distance': sit['g_distance'],
-                      'gear_down': sit['gear_down']}
-        statistics.append(stat_value)
-        if len(statistics) > stats_max_values:     # sliding window, remove old values
-            statistics.pop(0)
+                      'gear_down': sit['gear_down'], 'g_sink_rate': sit['g_sink_rate'],
+                      'g_touchdown': sit['g_touchdown']}
+        statistics.append(stat_value)     # sliding window, oldest value is overwritten
         evaluate_statistics(stat_value)
 
 
@@ -620,7 +778,10 @@ async def read_ground_sensor():
 
     if ground_distance_active:
         rlog.debug("Ground distance reader active ...")
-        distance_sensor.calc_distance()
+        distance_sensor.start()
+        wait_until = time.monotonic() + ZERO_DISTANCE_WAIT
+        while distance_sensor.last_distance() == 0 and time.monotonic() < wait_until:
+            await asyncio.sleep(1 / MEASUREMENTS_PER_SECOND)
         new_zero_distance = distance_sensor.last_distance()  # distance in mm this is zero
         if new_zero_distance > 0:
             zero_distance = new_zero_distance  # distance in mm this is zero
@@ -633,25 +794,38 @@ async def read_ground_sensor():
                 now = time.perf_counter()
                 await asyncio.sleep(next_read - now)  # wait for next time of measurement
                 next_read = next_read + (1 / MEASUREMENTS_PER_SECOND)
-                distance_sensor.calc_distance()
-                distance = distance_sensor.last_distance()  # distance in mm
-                if distance > 0:
+                for (timestamp, distance) in distance_sensor.new_samples():   # distance in mm, full sensor rate
+                    if distance > 0:
+                        ground_filter.update(timestamp, distance - zero_distance)
+                if ground_filter.valid(time.monotonic()):
                     global_situation['g_distance_valid'] = True
-                    global_situation['g_distance'] = distance - zero_distance
+                    global_situation['g_distance'] = ground_filter.height
+                    global_situation['g_sink_rate'] = -ground_filter.rate
+                    global_situation['g_touchdown'] = ground_filter.time_to_touchdown()
                     rlog.log(value_debug_level,
-                             'Ground Distance: {0:5.2f} cm'.format(global_situation['g_distance'] / 10))
+                             'Ground Distance: {0:5.2f} cm sink rate {1:5.1f} cm/s'
+                             .format(global_situation['g_distance'] / 10, global_situation['g_sink_rate'] / 10))
                 else:
                     global_situation['g_distance_valid'] = False
                     global_situation['g_distance'] = INVALID_GDISTANCE   # just to be safe
+                    global_situation['g_sink_rate'] = 0.0
+                    global_situation['g_touchdown'] = None
                     rlog.log(value_debug_level, 'Ground Distance: Sensor value invalid, maybe out of range')
                 if global_config['gear_indication_active']:
                     global_situation['gear_down'] = radarbuttons.gear_is_down()
                     rlog.log(value_debug_level, 'Ground Distance: gear-down: {0}'.format(global_situation['gear_down']))
                 else:
                     global_situation['gear_down'] = False   # default value if not to be indicated
+                if indicate_distance:
+                    if global_situation['g_distance_valid'] and fly_status == 1:
+                        audioengine.set_ground_distance(global_situation['g_distance'] / 304.8)   # mm to ft
+                    else:
+                        audioengine.set_ground_distance(None)
                 store_statistics(global_situation)
         except (asyncio.CancelledError, RuntimeError):
             rlog.debug("Ground distance reader terminating ...")
+        finally:
+            distance_sensor.stop()
     else:
         rlog.debug("No ground distance sensor active.")
 
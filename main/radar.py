@@ -41,6 +41,7 @@ import logging
 import math
 import time
 import radarbluez
+import audioengine
 import radarui
 import timerui
 import shutdownui
@@ -50,9 +51,10 @@ import gmeterui
 import compassui
 import verticalspeed
 import importlib
-import subprocess
 import radarbuttons
 import stratuxstatus
+import stratuxclient
+import storage
 import flighttime
 import cowarner
 import distance
@@ -60,6 +62,7 @@ import grounddistance
 import radarmodes
 import simulation
 import checklist
+import displaytiming
 from datetime import datetime, timezone
 from pathlib import Path
 import sys
@@ -80,7 +83,6 @@ LOST_CONNECTION_TIMEOUT = 0.3
 RADAR_CUTOFF = 29
 UI_REACTION_TIME = 0.1
 MINIMAL_WAIT_TIME = 0.01  # give other coroutines some time to do their jobs
-BLUEZ_CHECK_TIME = 3.0
 SPEED_ARROW_TIME = 60  # time in seconds for the line that displays the speed
 WATCHDOG_TIMER = 3.0  # time after "no connection" is assumed, if no new situation is received
 CHECK_CONNECTION_TIMEOUT = 5.0
@@ -89,10 +91,24 @@ MIN_DISPLAY_REFRESH_TIME = 0.1
 # minimal time to wait for a display refresh, to give time for situation and traffic
 MAX_TIMER_OFFSET = 10
 # max time the local system time and the received GPS-Time may differ. If they differ, system time will be set
+TIME_SYNC_INTERVAL = 10.0
+# time in secs between checks of system time against GPS-Time
 OPTICAL_ALIVE_BARS = 10
 # number of bars for an optical alive
 OPTICAL_ALIVE_TIME = 3
 # time in secs after which the optical alive bar moves on
+FRAME_BUDGET_FACTOR = 0.25
+# share of the display refresh time that drawing of all aircraft may take, if exceeded details are dropped
+MIN_FRAME_BUDGET = 0.02
+# min budget in secs for drawing all aircraft, for fast displays
+FULL_DETAIL_TARGETS = 3
+# number of highest threats which are always drawn with all details
+MAX_DETAIL_REDUCTION = 3
+# 0: all details, 1: no tails, 2: additionally no speed vectors, 3: additionally no labels (for low threats)
+GROUND_SPEED_IDLE = flighttime.SPEED_THRESHOLD_LANDING
+# below this speed in kts the aircraft is on ground, automatic epaper refreshes may be done
+AUTO_REFRESH_MODES = (1, 2, 5, 7, 9, 11, 13, 15, 17, 19, 21, 23)
+# display modes in which automatic refreshes against ghosting are done, not in refresh modes or shutdown
 
 # global variables
 DEFAULT_URL_HOST_BASE = "192.168.10.1"
@@ -103,6 +119,7 @@ CONFIG_FILE = str(Path(__file__).resolve().parent.parent.joinpath(CONFIG_DIR, "s
 DEFAULT_CHECKLIST = str(Path(__file__).resolve().parent.parent.joinpath(CONFIG_DIR, "checklist.xml"))
 SAVED_FLIGHTS = str(Path(__file__).resolve().parent.parent.joinpath(CONFIG_DIR, "stratux-radar.flights"))
 SAVED_STATISTICS = str(Path(__file__).resolve().parent.parent.joinpath(CONFIG_DIR, "stratux-radar.stat"))
+SAVED_FLIGHTLOG = str(Path(__file__).resolve().parent.parent.joinpath(CONFIG_DIR, "stratux-radar.flightlog"))
 
 url_host_base = DEFAULT_URL_HOST_BASE
 url_situation_ws = ""
@@ -114,6 +131,8 @@ url_status_get = ""
 url_status_set = ""
 device = ""
 sound_mixer = None
+alsa_period = audioengine.PERIOD_SIZE  # period size of alsa sound output in frames
+use_pygame = False  # True if pygame is used for speech output instead of alsa
 all_ac = {}
 aircraft_changed = True
 ui_changed = True
@@ -121,7 +140,7 @@ situation = {'was_changed': True, 'last_update': 0.0, 'connected': False, 'gps_a
              'own_altitude': -99.0, 'latitude': 0.0, 'longitude': 0.0, 'RadarRange': 5, 'RadarLimits': 10000,
              'gps_quality': 0, 'gps_h_accuracy': 20000, 'gps_v_accuracy': 20000, 'gps_speed': -100.0, 'gps_altitude': -99.0,
              'vertical_speed': 0.0, 'baro_valid': False, 'g_distance_valid': False,
-             'g_distance': grounddistance.INVALID_GDISTANCE}
+             'g_distance': grounddistance.INVALID_GDISTANCE, 'g_sink_rate': 0.0, 'g_touchdown': None}
 vertical_max = 0.0  # max value for vertical speed
 vertical_min = 0.0  # min valud for vertical spee
 
@@ -131,7 +150,6 @@ ahrs = {'was_changed': True, 'pitch': 0, 'roll': 0, 'heading': 0, 'slipskid': 0,
 gmeter = {'was_changed': True, 'current': 0.0, 'max': 0.0, 'min': 0.0}
 # status information as received from stratux
 global_config = {}
-last_bt_checktime = 0.0
 
 max_pixel = 0
 zerox = 0
@@ -160,15 +178,45 @@ co_indication = False  # True if indication via GPIO Pin 16 is on for co
 gear_indication = False # True if indication vio GPIO Pin 19 is on for reading gear statux (pull down if gear is down)
 grounddistance_activated = False  # True if measurement of grounddistance via VL53L1x is activated
 groundbeep = False  # True if indication of ground distance via audio
+variotone = False  # True if vertical speed is indicated by vario tones
+gps_time = None  # (timestamp of last valid GPS-Time, time.monotonic() of reception)
+time_synced = asyncio.Event()  # set by time_sync if system time was corrected
 simulation_mode = False  # if true, do simulation mode for grounddistance (for testing purposes)
+detail_reduction = 0  # current reduction of details for low threat targets, see MAX_DETAIL_REDUCTION
+
+
+def threat_rank(ac):
+    # lower value means higher threat: relative distance and relative altitude within the displayed limits
+    return ac['gps_distance'] / situation['RadarRange'] + abs(ac.get('height', 0)) * 100 / situation['RadarLimits']
+
+
+def adapt_detail_reduction(duration):
+    # more reduction if drawing took longer than the budget, less if there is enough headroom again
+    global detail_reduction
+
+    # measured refresh time of the display, the value of init as long as there are not enough measurements
+    budget = max(MIN_FRAME_BUDGET, FRAME_BUDGET_FACTOR * displaytiming.refresh_time(display_refresh_time))
+    if duration > budget and detail_reduction < MAX_DETAIL_REDUCTION:
+        detail_reduction += 1
+        rlog.debug("Radar: drawing aircraft took {0:.3f} s, reducing details to level {1}"
+                   .format(duration, detail_reduction))
+    elif duration < budget / 2 and detail_reduction > 0:
+        detail_reduction -= 1
+        rlog.debug("Radar: drawing aircraft took {0:.3f} s, increasing details to level {1}"
+                   .format(duration, detail_reduction))
 
 
 def draw_all_ac(allac):
+    start = time.perf_counter()
+    low_threats = set()
+    if detail_reduction > 0:
+        threat_sorted = sorted(allac.keys(), key=lambda icao: threat_rank(allac[icao]))
+        low_threats = set(threat_sorted[FULL_DETAIL_TARGETS:])
     dist_sorted = sorted(allac.items(), key=lambda el: el[1]['gps_distance'], reverse=True)
     for icao, ac in dist_sorted:
         # first draw mode-s
         if 'circradius' in ac:
-            if global_config['display_tail'] and 'tail' in ac:
+            if global_config['display_tail'] and 'tail' in ac and icao not in low_threats:
                 tail = ac['tail']
             else:
                 tail = None
@@ -179,16 +227,35 @@ def draw_all_ac(allac):
         # then draw adsb
         if 'x' in ac:
             if 0 < ac['x'] <= max_pixel and ac['y'] <= max_pixel:
-                if 'nspeed_length' in ac:
+                reduced = detail_reduction if icao in low_threats else 0
+                if 'nspeed_length' in ac and reduced < 2:
                     line_length = ac['nspeed_length']
                 else:
                     line_length = 0
-                if global_config['display_tail'] and 'tail' in ac:
+                if global_config['display_tail'] and 'tail' in ac and reduced < 1:
                     tail = ac['tail']
                 else:
                     tail = None
-                display_control.aircraft(ac['x'], ac['y'], ac['direction'], ac['height'], ac['vspeed'],
+                if reduced < 3:
+                    height = ac['height']
+                else:
+                    height = None   # no label
+                display_control.aircraft(ac['x'], ac['y'], ac['direction'], height, ac['vspeed'],
                                          line_length, tail)
+    adapt_detail_reduction(time.perf_counter() - start)
+
+
+def display_idle():
+    # true if an automatic full refresh of the epaper does not disturb: no traffic nearby, or on ground with no
+    # traffic alert active. Without gps (flying is possible) or in timer mode only if there is no traffic at all
+    if len(all_ac) == 0:
+        return True
+    for ac in all_ac.values():
+        if ac['was_spoken']:
+            return False
+    if global_mode == 2 or not situation['gps_active']:
+        return False
+    return situation['gps_speed'] < GROUND_SPEED_IDLE
 
 
 def draw_display():
@@ -236,19 +303,20 @@ def calc_gps_distance(lat, lng):
     return distradius, angle
 
 
-def speaktraffic(hdiff, direction=None, dist=None):
+def speaktraffic(hdiff, direction=None, dist=None, icao=None):
+    # spoken as fragments which are cached, see ttscache.presynthesize
     if sound_on:
         feet = hdiff * 100
         sign = 'plus'
         if hdiff < 0:
             sign = 'minus'
-        txt = 'Traffic '
+        parts = ['Traffic']
         if direction:
-            txt += str(direction) + ' o\'clock '
-        txt += sign + ' ' + str(abs(feet)) + ' feet'
+            parts.append(str(direction) + ' o\'clock')
+        parts.append(sign + ' ' + str(abs(feet)) + ' feet')
         if global_config['distance_warnings'] and dist:
-            txt += str(dist) + ' miles '
-        radarbluez.speak(txt)
+            parts.append(str(dist) + ' miles')
+        radarbluez.speak_fragments(parts, priority=radarbluez.PRIO_TRAFFIC, key=icao)
 
 
 def new_traffic(json_str):
@@ -324,7 +392,7 @@ def new_traffic(json_str):
                     if oclock > 12:
                         oclock -= 12
                     if not ac['was_spoken']:
-                        speaktraffic(ac['height'], oclock, round(gps_rad))
+                        speaktraffic(ac['height'], oclock, round(gps_rad), traffic['Icao_addr'])
                         ac['was_spoken'] = True
                 else:
                     # implement hysteresis, speak traffic again if aircraft was once outside 3/4 of display radius
@@ -354,7 +422,7 @@ def new_traffic(json_str):
 
             if ac['gps_distance'] <= situation['RadarRange'] / 2:
                 if not ac['was_spoken']:
-                    speaktraffic(ac['height'], None, round(ac['gps_distance']))
+                    speaktraffic(ac['height'], None, round(ac['gps_distance']), traffic['Icao_addr'])
                     ac['was_spoken'] = True
             else:
                 # implement hysteresis, speak traffic again if aircraft was once outside 3/4 of display radius
@@ -364,33 +432,60 @@ def new_traffic(json_str):
         rlog.log(AIRCRAFT_DEBUG, "KeyError decoding:" + json_str)
 
 
-def update_time(time_str):  # time_str has format "2021-04-18T15:58:58.1Z"
-    global last_bt_checktime
-
+def gps_timestamp(time_str):  # time_str has format "2021-04-18T15:58:58.1Z", returns None if invalid
     try:
         gps_datetime = datetime.strptime(time_str, "%Y-%m-%dT%H:%M:%S.%fZ")
     except ValueError:
         # stratux will deliver "0001-01-01T00:00:00Z" if not time signal is valid, this will also raise an ValueError
-        # rlog.debug("Radar: ERROR converting GPS-Time: " + time_str)
         # also full seconds, will not give fractions and raise this, but it's ok
-        return
-    gps_datetime = gps_datetime.replace(tzinfo=timezone.utc)  # make sure that time is interpreted as utc
-    if abs(time.time() - gps_datetime.timestamp()) > MAX_TIMER_OFFSET:
-        # raspi system timer differs from received GPSTime
-        rlog.debug("Setting Time from GPS-Time to: " + time_str + ". System time was " +
-                   time.strftime("%H:%M:%S", time.gmtime()))
-        res = subprocess.run(["sudo", "date", "--utc", "-s", "@" + str(gps_datetime.timestamp())])
-        if res.returncode != 0:
-            rlog.debug("Radar: Error setting system time")
-        else:
-            timerui.reset_timer()  # all timers are reset to be on the safe side!
-            last_bt_checktime = 0.0  # reset timer
+        return None
+    return gps_datetime.replace(tzinfo=timezone.utc).timestamp()  # make sure that time is interpreted as utc
+
+
+async def set_system_time(timestamp):   # returns True if successful
+    try:
+        time.clock_settime(time.CLOCK_REALTIME, timestamp)   # only permitted if running as root
+        return True
+    except (PermissionError, OSError):
+        pass
+    try:
+        proc = await asyncio.create_subprocess_exec("sudo", "date", "--utc", "-s", "@" + str(timestamp))
+    except OSError as e:   # e.g. sudo not available
+        rlog.debug("Setting system time failed: " + str(e))
+        return False
+    return await proc.wait() == 0
+
+
+async def time_sync():
+    # checks at a low rate whether system time differs from the last received GPS-Time, corrects it without
+    # blocking the loop and notifies the display task via time_synced
+    try:
+        while True:
+            await asyncio.sleep(TIME_SYNC_INTERVAL)
+            if gps_time is None:
+                continue
+            timestamp, received = gps_time
+            age = time.monotonic() - received
+            if age > TIME_SYNC_INTERVAL:
+                continue   # no current gps time
+            if abs(time.time() - (timestamp + age)) > MAX_TIMER_OFFSET:
+                # raspi system timer differs from received GPSTime
+                rlog.debug("Setting Time from GPS-Time to: " +
+                           time.strftime("%H:%M:%S", time.gmtime(timestamp + age)) + ". System time was " +
+                           time.strftime("%H:%M:%S", time.gmtime()))
+                if await set_system_time(timestamp + time.monotonic() - received):
+                    time_synced.set()
+                else:
+                    rlog.debug("Radar: Error setting system time")
+    except asyncio.CancelledError:
+        rlog.debug("Time sync task terminating ...")
 
 
 def new_situation(json_str):
     global vertical_max
     global vertical_min
     global global_mode
+    global gps_time
 
     rlog.log(SITUATION_DEBUG, "New Situation" + json_str)
     sit = json.loads(json_str)
@@ -455,13 +550,20 @@ def new_situation(json_str):
                 situation['was_changed'] = True
                 vertical_max = 0  # invalidate min/max
                 vertical_min = 0
+        if variotone:
+            if situation['baro_valid'] and sound_on:
+                audioengine.set_vario(situation['vertical_speed'])
+            else:
+                audioengine.set_vario(None)
         # set system time if not synchronized properly
         if situation['gps_active']:
             if sit['GPSLastFixLocalTime'].split('.')[0] == sit['GPSLastGPSTimeStratuxTime'].split('.')[0]:
                 # take GPSTime only if last fix time and last stratux time match (in seconds),
                 # sometimes a fix is there, but
                 # not yet an update time value from GPS, but the old one is transmitted by stratux
-                update_time(sit['GPSTime'])
+                timestamp = gps_timestamp(sit['GPSTime'])
+                if timestamp is not None:
+                    gps_time = (timestamp, time.monotonic())   # evaluated by time_sync
         # ahrs
         if ahrs['pitch'] != round(sit['AHRSPitch']):
             ahrs['pitch'] = round(sit['AHRSPitch'])
@@ -572,13 +674,11 @@ async def listen_forever(path, name, callback, logger):
 
 
 async def user_interface():
-    global bt_devices
     global sound_on
     global ui_changed
     global global_mode
     global vertical_max
     global vertical_min
-    global last_bt_checktime
 
     next_mode = 1
 
@@ -630,22 +730,29 @@ async def user_interface():
                 ui_changed = True
                 rlog.debug("User Interface: global mode changing from: " + str(global_mode) + " to " + str(next_mode))
                 global_mode = next_mode
-
-            current_time = time.time()
-            if bluetooth_active and current_time > last_bt_checktime + BLUEZ_CHECK_TIME:
-                last_bt_checktime = current_time
-                new_devices, devnames = radarbluez.connected_devices()
-                if new_devices > 0:
-                    rlog.debug("User Interface: Bluetooth " + str(new_devices) + " devices connected.")
-                if new_devices != bt_devices:
-                    if new_devices > bt_devices:  # new or additional device
-                        radarbluez.speak("Radar connected")
-                    bt_devices = new_devices
-                    ui_changed = True
     except asyncio.CancelledError:
         rlog.debug("UI task terminating ...")
 
 
+async def bluetooth_watcher():
+    global bt_devices
+    global ui_changed
+
+    bt_devices, _ = radarbluez.connected_devices()
+    try:
+        while True:
+            new_devices, devnames = await radarbluez.wait_for_device_change()
+            if new_devices > 0:
+                rlog.debug("Bluetooth watcher: " + str(new_devices) + " devices connected.")
+            if new_devices != bt_devices:
+                if new_devices > bt_devices:  # new or additional device
+                    radarbluez.speak("Radar connected")
+                bt_devices = new_devices
+                ui_changed = True
+    except asyncio.CancelledError:
+        rlog.debug("Bluetooth watcher terminating ...")
+
+
 async def display_and_cutoff():
     global aircraft_changed
     global global_mode
@@ -656,14 +763,26 @@ async def display_and_cutoff():
     try:
         while True:
             await asyncio.sleep(MIN_DISPLAY_REFRESH_TIME)
+            if time_synced.is_set():
+                time_synced.clear()
+                timerui.reset_timer()  # all timers are reset to be on the safe side!
+                ui_changed = True
             if display_control.is_busy():
-                await asyncio.sleep(display_refresh_time / 3)
+                await asyncio.sleep(displaytiming.refresh_time(display_refresh_time) / 3)
                 # try it several times to be as fast as possible
+            elif global_mode in AUTO_REFRESH_MODES and display_control.ghosting_refresh_due() and display_idle():
+                # automatic refresh against ghosting. Done in a thread, refresh blocks for seconds and traffic
+                # has to be received and announced meanwhile
+                rlog.debug("Display driver - automatic refresh against ghosting")
+                await asyncio.get_running_loop().run_in_executor(None, display_control.refresh)
+                ui_changed = True
+                situation['was_changed'] = True
+                aircraft_changed = True
             else:
                 if global_mode == 1:  # Radar
                     draw_display()
                 elif global_mode == 2:  # Timer'
-                    timerui.draw_timer(display_control, display_refresh_time)
+                    timerui.draw_timer(display_control, displaytiming.refresh_time(display_refresh_time))
                 elif global_mode == 3:  # shutdown
                     final_shutdown = shutdownui.draw_shutdown(display_control)
                     if final_shutdown:
@@ -786,7 +905,11 @@ async def coroutines():
     sensor_reader = asyncio.create_task(cowarner.read_sensors())
     ground_sensor_reader = asyncio.create_task(grounddistance.read_ground_sensor())
     u_interface = asyncio.create_task(user_interface())
-    await asyncio.gather(tr_handler, sit_handler, dis_cutoff, u_interface, sensor_reader, ground_sensor_reader)
+    bt_watcher = asyncio.create_task(bluetooth_watcher())
+    t_sync = asyncio.create_task(time_sync())
+    s_flusher = asyncio.create_task(storage.flusher())
+    await asyncio.gather(tr_handler, sit_handler, dis_cutoff, u_interface, sensor_reader, ground_sensor_reader,
+                         bt_watcher, t_sync, s_flusher)
     # With python 3.11 a TaskGroup could be used to ensure theat coroutine exceptions are propagated to main task
 
 
@@ -799,18 +922,20 @@ def main():
     global bluetooth_active
 
     print("Stratux Radar Display " + RADAR_VERSION + " running ...")
+    stratuxclient.init(url_settings_get)
     if not radarui.init(url_settings_set):
         print("GPIO Error, is  another radar process running? Terminating.")
         return 1
     shutdownui.init(url_shutdown, url_reboot)
     timerui.init(global_config)
-    extsound_active, bluetooth_active = radarbluez.sound_init(global_config, bluetooth, sound_mixer)
+    extsound_active, bluetooth_active = radarbluez.sound_init(global_config, bluetooth, sound_mixer, alsa_period,
+                                                                  use_pygame)
     max_pixel, zerox, zeroy, display_refresh_time = display_control.init(fullcircle)
     ahrsui.init(url_calibrate, url_caging)
     statusui.init(CONFIG_FILE, url_status_get, url_host_base, display_refresh_time, global_config)
     gmeterui.init(url_gmeter_reset)
     stratuxstatus.init(url_status_ws, url_settings_get, url_settings_set)
-    flighttime.init(measure_flighttime, SAVED_FLIGHTS)
+    flighttime.init(measure_flighttime, SAVED_FLIGHTS, SAVED_FLIGHTLOG)
     cowarner.init(co_warner_activated, global_config, SITUATION_DEBUG, co_indication)
     grounddistance.init(grounddistance_activated, SAVED_STATISTICS, SITUATION_DEBUG,
                         groundbeep, situation, simulation_mode, global_config)
@@ -818,6 +943,7 @@ def main():
     checklist.init(xml_checklist)
     radarbuttons.init_gear_indicator(global_config, gear_indication)
     display_control.startup(RADAR_VERSION, url_host_base, 4)
+    displaytiming.reset()   # startup screen is not a regular frame
     try:
         asyncio.run(coroutines())
     except asyncio.CancelledError:
@@ -833,6 +959,9 @@ def quit_gracefully(*arguments):
     except RuntimeError:
         pass
     radarbluez.sound_terminate()
+    stratuxclient.terminate()
+    storage.terminate()   # write pending files
+    displaytiming.log_histograms()
     rlog.debug("CleanUp Display ...")
     display_control.cleanup()
     return 0
@@ -916,16 +1045,33 @@ if __name__ == "__main__":
                     action="store_true", default=False)
     ap.add_argument("-gb", "--groundbeep", required=False, help="Indicate ground distance via sound",
                     action="store_true", default=False)
+    ap.add_argument("-vt", "--variotone", required=False, help="Indicate vertical speed via vario tones",
+                    action="store_true", default=False)
     ap.add_argument("-gi", "--gearindicate", required=False, help="Indicate gear warning",
                     action="store_true", default=False)
     ap.add_argument("-sim", "--simulation", required=False, help="Simulation mode for testing",
                     action="store_true", default=False)
     ap.add_argument("-mx", "--mixer", required=False, help="Mixer name to be used for sound output",
                     default=DEFAULT_MIXER)
+    ap.add_argument("-ap", "--alsaperiod", type=int, required=False,
+                    help="Period size in frames of alsa sound output, smaller means lower latency",
+                    default=audioengine.PERIOD_SIZE)
+    ap.add_argument("-pg", "--pygame", required=False, help="Use pygame instead of alsa for speech output",
+                    action="store_true", default=False)
     ap.add_argument("-modes", "--displaymodes", required=False,
                     help="Select display modes that you want to see ""R=radar T=timer A=ahrs D=display-status "
                          "G=g-meter K=compass V=vsi I=flighttime S=stratux-status C=co-sensor "
                          "M=distance measurement L=checklist  Example: -modes RADCM", default="RTAGKVICMDSL")
+    ap.add_argument("-vd", "--virtualdisplay", required=False,
+                    help="Geometry of virtual display (-d Virtual): Epaper_3in7, Epaper_1in54 or Oled_1in5",
+                    default="Epaper_3in7")
+    ap.add_argument("-vp", "--virtualpng", required=False, help="Directory to store frames of virtual display as png",
+                    default=None)
+    ap.add_argument("-vfb", "--virtualfb", required=False, help="File for mmap'd raw framebuffer of virtual display",
+                    default=None)
+    ap.add_argument("-vnt", "--virtualnotiming", required=False,
+                    help="Virtual display without emulation of refresh and busy times", action="store_true",
+                    default=False)
 
     args = vars(ap.parse_args())
     # set up logging
@@ -946,6 +1092,13 @@ if __name__ == "__main__":
         print("Error: Controller for device '{0}' not found. Aborting. ".format(args['device']))
         syslog.syslog(syslog.LOG_ERR, "Error: Controller for device '{0}' not found. Aborting. ".format(args['device']))
         sys.exit(1)
+    if args['device'] == 'Virtual':
+        try:
+            display_control.configure(args['virtualdisplay'], args['virtualpng'], args['virtualfb'],
+                                      not args['virtualnotiming'])
+        except ValueError as e:
+            print("Error: {0}. Aborting.".format(e))
+            sys.exit(1)
     bluetooth = args['bluetooth']
     basemode = args['north']
     fullcircle = args['fullcircle']
@@ -954,6 +1107,7 @@ if __name__ == "__main__":
     co_indication = args['coindicate']
     grounddistance_activated = args['grounddistance']
     groundbeep = args['groundbeep']
+    variotone = args['variotone']
     gear_indication = args ['gearindicate']
     simulation_mode = args['simulation']
     xml_checklist = args['checklist']
@@ -978,6 +1132,8 @@ if __name__ == "__main__":
     if args['startchecklist']:
         global_mode = 23  # start in checklist
     sound_mixer = args['mixer']
+    alsa_period = args['alsaperiod']
+    use_pygame = args['pygame']
     radarmodes.parse_modes(args['displaymodes'])
     if global_mode == 1:  # no mode override set, take first mode in mode_sequence
         global_mode = radarmodes.first_mode_sequence()
@@ -988,6 +1144,7 @@ if __name__ == "__main__":
         global_config['sound_volume'] = 50  # set to a medium value if strange number used
     # check config file, if extistent use config from there
     url_host_base = args['connect']
+    storage.init()   # write-behind for config, flights and statistics, before any of them is read
     saved_config = statusui.read_config(CONFIG_FILE)
     if saved_config is not None:
         if 'stratux_ip' in saved_config:
@@ -37,15 +37,30 @@ import logging
 import subprocess
 import alsaaudio
 from os import environ
-environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'  # disable pygame hello message
-import pygame
-from queue import Queue
+import heapq
+import itertools
 import threading    # for pico2wave so that there is no blocking of other sensor functions during that time
 import time
+import asyncio
+from gi.repository import GLib   # main loop for dbus signals, part of pydbus installation
+import ttscache
+import ttsengine
+import audioengine
 
 # DBus object paths
 BLUEZ_SERVICE = 'org.bluez'
 ADAPTER_PATH = '/org/bluez/hci0'
+DEVICE_INTERFACE = 'org.bluez.Device1'
+DEVICE_PATH = re.compile(r'/org/bluez/hci\d*/dev_(.*)')
+# to match strings like /org/bluez/hci0/dev_58_C9_35_2F_A1_EF
+
+# speech priorities, lower value is more urgent
+PRIO_GROUND = 0     # gear and ground warnings
+PRIO_CO = 1         # co alarm
+PRIO_TRAFFIC = 2    # traffic callouts
+PRIO_INFO = 3       # information, e.g. "Radar connected"
+SPEECH_DEADLINE = {PRIO_GROUND: 2.0, PRIO_CO: 20.0, PRIO_TRAFFIC: 5.0, PRIO_INFO: 30.0}
+# max age in secs of a message before it is dropped unspoken
 
 # global variables
 rlog = None
@@ -54,13 +69,66 @@ manager = None
 adapter = None
 bluetooth_active = False
 extsound_active = False
-bt_devices = 0          # no of active bluetooth devices last time checked via connected devices
+bt_devices = 0          # no of connected bluetooth devices, maintained by dbus signals
+known_devices = {}      # object path -> name of all bluetooth devices known by bluez
+connected = {}          # object path -> name of connected bluetooth devices
+devices_lock = threading.Lock()   # devices are updated in the glib thread
+glib_loop = None        # glib main loop, dispatches dbus signals in its own thread
+event_loop = None       # asyncio loop which is notified about changes
+devices_changed = None  # asyncio.Event, set if connected devices changed
 mixer = None
 global_config = None
-sound_queue = None    # external sound queue
+sound_queue = None    # external sound queue, SpeechQueue
+playing_priority = PRIO_INFO   # priority of the sound currently played
 sound_thread = None
 sound_card = None     # number of sound card, is initialized if external_sound_output is True
 audio_device = None   # name of audio device selected by mixer name
+pygame = None         # pygame module, only imported if requested as fallback for sound output
+
+class SpeechQueue:
+    # priority queue for speech: most urgent first, messages older than their deadline are dropped,
+    # a message with the same key (e.g. icao address) supersedes the one waiting
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.stopped = False
+
+    def put(self, parts, speed, priority, key=None):
+        with self.cond:
+            if key is not None:
+                self.heap = [e for e in self.heap if e[4] != key]
+                heapq.heapify(self.heap)
+            deadline = time.monotonic() + SPEECH_DEADLINE[priority]
+            heapq.heappush(self.heap, (priority, next(self.counter), deadline, parts, key, speed))
+            self.cond.notify()
+
+    def requeue(self, entry):   # message taken, but not yet spoken
+        with self.cond:
+            heapq.heappush(self.heap, entry)
+            self.cond.notify()
+
+    def get(self):   # blocks, returns the most urgent message which is not outdated, None if stopped
+        with self.cond:
+            while True:
+                if self.stopped:
+                    return None
+                while self.heap:
+                    entry = heapq.heappop(self.heap)
+                    if time.monotonic() <= entry[2]:
+                        return entry
+                    rlog.debug("Radarbluez: Outdated message dropped: " + " ".join(entry[3]))
+                self.cond.wait()
+
+    def more_urgent(self, priority):   # True if a message more urgent than priority is waiting
+        with self.cond:
+            return len(self.heap) > 0 and self.heap[0][0] < priority
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
 
 def find_mixer(mixer_name):    # searches for an "Audio" mixer, independent whether it was selected
     found = False
@@ -97,7 +165,7 @@ def find_mixer(mixer_name):    # searches for an "Audio" mixer, independent whet
     return cardno, mix, devicename
 
 
-def sound_init(config, bluetooth, mixer_name):
+def sound_init(config, bluetooth, mixer_name, period_size=audioengine.PERIOD_SIZE, use_pygame=False):
     global bluetooth_active
     global extsound_active
     global mixer
@@ -107,6 +175,7 @@ def sound_init(config, bluetooth, mixer_name):
     global audio_device
     global rlog
     global global_config
+    global pygame
 
     extsound_active = False
     bluetooth_active = False
@@ -123,16 +192,27 @@ def sound_init(config, bluetooth, mixer_name):
         bluetooth_active = bluez_init()
 
     if bluetooth_active or extsound_active:
-        try:
-            pygame.mixer.init()  # for what reason soever, init with a devicename only works after a sucessful init
-            #  pygame.mixer.init(devicename=audio_device)  # initialize pygame mixer with devicename
-        except pygame.error as error:
-            rlog.debug(f"SoundInit: Error pygame.init - {error} ")
-        # rlog.debug(f"SoundInit: Mixer initialized with device '{audio_device}'")
-        sound_queue = Queue()
+        if use_pygame:
+            environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'  # disable pygame hello message
+            import pygame as pygame_module
+            pygame = pygame_module
+            try:
+                pygame.mixer.init(frequency=ttscache.SAMPLE_RATE, size=-16, channels=ttscache.CHANNELS,
+                                  allowedchanges=0)
+                # same format as the synthesised pcm, so it can be played from memory. No changes allowed, SDL
+                # converts if the device does not support it, otherwise raw pcm would be played at a wrong pitch
+            except pygame.error as error:
+                rlog.debug(f"SoundInit: Error pygame.init - {error} ")
+        # alsa stream for tones, and for speech if pygame is not used. With bluetooth, output goes via the
+        # sound server, otherwise directly to the card of the selected mixer if possible
+        if bluetooth_active or sound_card < 0 or not audioengine.init("plughw:" + str(sound_card), period_size):
+            audioengine.init(audioengine.ALSA_DEVICE, period_size)
+        ttscache.init()
+        sound_queue = SpeechQueue()
         sound_thread = threading.Thread(target=audio_speaker, args=(sound_queue,))  # external thread that speaks
         sound_thread.start()
-        speak("Stratux Radar connected")
+        speak("Stratux Radar connected", priority=PRIO_INFO)
+        ttscache.start_presynthesis()   # traffic fragments, only synthesised if not yet in disk cache
     rlog.debug("SoundInit: Bluetooth active:" + str(bluetooth_active) + " ExtSound active: " + str(extsound_active) +
                " ExtSound volume: " + str(global_config['sound_volume']) + ".")
     return extsound_active, bluetooth_active
@@ -140,9 +220,13 @@ def sound_init(config, bluetooth, mixer_name):
 
 def sound_terminate():
     if sound_queue:
-        sound_queue.put('STOP')
+        sound_queue.stop()
     if sound_thread:
         sound_thread.join()    # wait for termination
+    ttsengine.terminate()
+    audioengine.terminate()
+    if glib_loop is not None:
+        glib_loop.quit()
 
 
 def bluez_init():
@@ -150,6 +234,7 @@ def bluez_init():
     global manager
     global adapter
     global bluetooth_active
+    global glib_loop
 
     bus = pydbus.SystemBus()
 
@@ -162,87 +247,193 @@ def bluez_init():
     except (KeyError, TypeError):
         rlog.debug("Bluetooth: BLUEZ-SERVICE not initialised")
         return False
+    # track devices via signals, state is only read once here
+    manager.InterfacesAdded.connect(interfaces_added)
+    manager.InterfacesRemoved.connect(interfaces_removed)
+    bus.subscribe(sender=BLUEZ_SERVICE, iface='org.freedesktop.DBus.Properties', signal='PropertiesChanged',
+                  arg0=DEVICE_INTERFACE, signal_fired=properties_changed)
+    for path, interfaces in manager.GetManagedObjects().items():
+        interfaces_added(path, interfaces)
+    glib_loop = GLib.MainLoop()
+    threading.Thread(target=glib_loop.run, daemon=True).start()
     bluetooth_active = True
-    rlog.debug("Bluetooth: BLUEZ-SERVICE successfully activated.")
-    connected_devices()     # check if already devices are connected
+    rlog.debug("Bluetooth: BLUEZ-SERVICE successfully activated, " + str(bt_devices) + " devices connected.")
     return True
 
 
+def notify_change():   # called in glib thread, wakes up wait_for_device_change
+    if event_loop is not None and devices_changed is not None:
+        event_loop.call_soon_threadsafe(devices_changed.set)
+
+
+def update_device(path, props):   # props of DEVICE_INTERFACE, all of them or only the changed ones
+    global bt_devices
+
+    if DEVICE_PATH.match(path) is None:
+        return
+    changed = False
+    with devices_lock:
+        name = props.get('Name', props.get('Alias'))
+        if name is not None:
+            known_devices[path] = name
+            if path in connected:
+                connected[path] = name
+        if 'Connected' in props:
+            if props['Connected'] and path not in connected:
+                connected[path] = known_devices.get(path, '')
+                changed = True
+            elif not props['Connected'] and path in connected:
+                del connected[path]
+                changed = True
+        bt_devices = len(connected)
+    if changed:
+        rlog.debug("Bluetooth: " + str(bt_devices) + " devices connected.")
+        notify_change()
+
+
+def interfaces_added(path, interfaces):
+    if DEVICE_INTERFACE in interfaces:
+        update_device(path, interfaces[DEVICE_INTERFACE])
+
+
+def interfaces_removed(path, interfaces):
+    global bt_devices
+
+    if DEVICE_INTERFACE in interfaces:
+        with devices_lock:
+            known_devices.pop(path, None)
+            was_connected = connected.pop(path, None) is not None
+            bt_devices = len(connected)
+        if was_connected:
+            notify_change()
+
+
+def properties_changed(sender, path, iface, signal, params):
+    interface, changed_props, invalidated = params
+    if interface == DEVICE_INTERFACE:
+        update_device(path, changed_props)
+
+
 def setvolume(new_volume):
     if mixer is not None:
         mixer.setvolume(new_volume)
 
 
-def speak(text, speed_percent = 100):
+def speak(text, speed_percent=100, priority=PRIO_INFO, key=None):
     if (extsound_active and global_config['sound_volume'] > 0) or (bluetooth_active and bt_devices > 0):
-        output_text = f"<speed level='{speed_percent}'> {text} </speed>"    # include string for setting speed
-        sound_queue.put(output_text)
+        sound_queue.put((text,), speed_percent, priority, key)
     rlog.debug("Speak: "+text)
 
 
-def prepare_sounds_tuple(int_tuple):  # done during init without parallel coroutines
-    out = None
+def speak_fragments(parts, speed_percent=100, priority=PRIO_TRAFFIC, key=None):
+    # phrase composed of cached fragments, e.g. traffic callouts with icao address as key
+    if (extsound_active and global_config['sound_volume'] > 0) or (bluetooth_active and bt_devices > 0):
+        sound_queue.put(tuple(parts), speed_percent, priority, key)
+    rlog.debug("Speak: " + " ".join(parts))
+
+
+def prepare_sounds(texts):   # done during init, list of sounds (None if not available), synthesised in parallel
     if bluetooth_active or extsound_active:
         out = []
-        for i in int_tuple:
-            pico_result = subprocess.run(["pico2wave", "-w", "/tmp/radar.wav", str(i)])  # generate wave
-            if pico_result.returncode == 0:
-                out.append(pygame.mixer.Sound("/tmp/radar.wav"))
+        for text, pcm in zip(texts, ttscache.phrases_parallel(texts)):
+            if pcm is not None:
+                if pygame is not None:
+                    out.append(pygame.mixer.Sound(buffer=pcm))
+                else:
+                    out.append(pcm)   # played directly from memory via alsa
             else:
-                rlog.debug("Radarbluez: Error creating sound for tuple.")
-    return out
-
-def prepare_sounds_string(tospeak):   # done during init without parallel coroutines
-    if bluetooth_active or extsound_active:
-        pico_result = subprocess.run(["pico2wave", "-w", "/tmp/radar.wav", tospeak])  # generate wave
-        if pico_result.returncode == 0:
-            return pygame.mixer.Sound("/tmp/radar.wav")
-        else:
-            rlog.debug("Radarbluez: Error creating sound string.")
+                rlog.debug("Radarbluez: Error creating sound for '" + text + "'.")
+                out.append(None)
+        return out
     return None
 
+
+def play(sound):   # sound is pcm bytes or a pygame sound, if pygame is used
+    if pygame is not None:
+        if isinstance(sound, bytes):
+            sound = pygame.mixer.Sound(buffer=sound)
+        sound.play()
+    else:
+        audioengine.play(sound)
+
+
+def stop_playing():
+    if pygame is not None:
+        pygame.mixer.stop()
+    else:
+        audioengine.stop_voices()
+
+
+def is_playing():
+    if pygame is not None:
+        return pygame.mixer.get_busy()
+    return audioengine.busy()
+
+
 def speak_sound(sound, text=""):    # used to instantly speak sounds which are already prepared (warnings, heights)
+    global playing_priority
+
     if (extsound_active and global_config['sound_volume'] > 0) or (bluetooth_active and bt_devices > 0):
-        pygame.mixer.stop()    # stop conflicting sounds
-        sound.play()
+        stop_playing()    # stop conflicting sounds
+        playing_priority = PRIO_GROUND
+        play(sound)
     rlog.debug("SpeakSound: " + text)
 
 
 def audio_speaker(queue):
+    global playing_priority
+
     rlog.debug("Radarbluez: Audio-Speaker thread active.")
     while True:
-        msg = queue.get()
-        if msg == 'STOP':
+        entry = queue.get()
+        if entry is None:
             break
+        priority, _, deadline, parts, _, speed = entry
+        if len(parts) == 1:
+            pcm = ttscache.phrase(parts[0], speed)
         else:
-            pico_result = subprocess.run(["pico2wave", "-w", "/tmp/radar.wav", msg])  # generate wave
-            if pico_result.returncode == 0:
-                if (bluetooth_active and bt_devices > 0) or (extsound_active and global_config['sound_volume'] > 0):
-                    while pygame.mixer.get_busy():
-                        time.sleep(0.05)    # is a different thread, other threads continue, just audio speaker waits
-                    pygame.mixer.Sound("/tmp/radar.wav").play()   # serialized via this thread
-            else:
-                rlog.debug("Radarbluez: Error using pico2wave TTS")
+            pcm = ttscache.fragments(parts, speed)
+        if pcm is None:
+            rlog.debug("Radarbluez: Error using pico2wave TTS")
+            continue
+        if (bluetooth_active and bt_devices > 0) or (extsound_active and global_config['sound_volume'] > 0):
+            while is_playing():
+                if priority < playing_priority:
+                    rlog.debug("Radarbluez: Speech interrupted by more urgent message")
+                    stop_playing()
+                    break
+                if queue.more_urgent(priority):
+                    queue.requeue(entry)   # speak the more urgent one first
+                    entry = None
+                    break
+                time.sleep(0.05)    # is a different thread, other threads continue, just audio speaker waits
+            if entry is None:
+                continue
+            if time.monotonic() > deadline:
+                rlog.debug("Radarbluez: Outdated message dropped: " + " ".join(parts))
+                continue
+            playing_priority = priority
+            play(pcm)   # serialized via this thread
     rlog.debug("Radarbluez: Audio-Speaker thread terminated.")
 
 
-def connected_devices():
-    global bt_devices
-
+def connected_devices():   # from memory, does not block
     if not bluetooth_active:
         return 0, []
-    managed_objects = manager.GetManagedObjects()
-    r = re.compile('\/org\/bluez\/hci\d*\/dev_(.*)')
-    # to match strings like /org/bluez/hci0/dev_58_C9_35_2F_A1_EF
-    device_names = []
-    for key, value in managed_objects.items():
-        m = r.match(key)
-        if m is not None:
-            if 'org.bluez.Device1' in value:
-                if value['org.bluez.Device1']['Connected']:
-                    device_names.append(value['org.bluez.Device1']['Name'])
-    bt_devices = len(device_names)
-    return bt_devices, device_names
+    with devices_lock:
+        return bt_devices, list(connected.values())
+
+
+async def wait_for_device_change():   # returns connected devices, as soon as they changed
+    global event_loop
+    global devices_changed
+
+    if devices_changed is None:
+        event_loop = asyncio.get_running_loop()
+        devices_changed = asyncio.Event()
+    await devices_changed.wait()
+    devices_changed.clear()
+    return connected_devices()
 
 
 def trust_pair_connect(bt_addr):
@@ -32,7 +32,7 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import logging
-import requests
+import stratuxclient
 import radarbuttons
 import radarmodes
 
@@ -58,10 +58,8 @@ def init(url):
 
 def communicate_limits(radarrange, threshold):
     rlog.debug("COMMUNICATE LIMITS: Radius " + str(radarrange) + " Height " + str(threshold))
-    try:
-        requests.post(url_settings_set, json={'RadarLimits': threshold, 'RadarRange': radarrange})
-    except requests.exceptions.RequestException as e:
-        rlog.debug("Posting limits exception", e)
+    stratuxclient.post_settings_nowait(url_settings_set, {'RadarLimits': threshold, 'RadarRange': radarrange},
+                                       key='RadarLimits')   # only the last of rapid changes is sent
 
 
 def user_input(rrange, rlimits):   # return Nextmode, toogleSound  (Bool)
@@ -35,7 +35,8 @@ import os
 import subprocess
 import radarbuttons
 import time
-import requests
+import stratuxclient
+import storage
 import logging
 import radarmodes
 
@@ -93,22 +94,17 @@ def draw_shutdown(display_control):
         display_control.display()
     if clear_before_shutoff:   # this is signal for display driver to initiate shutdown/reboot
         display_control.cleanup()
+        storage.flush()   # pending files have to be on the sd card before power off
 
         if shutdown_mode == 0:   # shutdown display and stratux
             rlog.debug("Posting shutdown.")
-            try:
-                requests.post(url_shutdown)
-            except requests.exceptions.RequestException as e:
-                rlog.debug("Posting shutdown exception: ", e)
+            stratuxclient.post_sync(url_shutdown)   # blocking, has to be sent before own shutdown
             os.popen("sudo shutdown --poweroff now").read()
         elif shutdown_mode == 1:   # only display shutdown
             os.popen("sudo shutdown --poweroff now").read()
         elif shutdown_mode == 2:   # reboot display and stratux
             rlog.debug("Posting reboot.")
-            try:
-                requests.post(url_reboot)
-            except requests.exceptions.RequestException as e:
-                rlog.debug("Posting shutdown exception: ", e)
+            stratuxclient.post_sync(url_reboot)   # blocking, has to be sent before own reboot
             os.popen("sudo shutdown --reboot now").read()
 
         clear_before_shutoff = False
@@ -37,6 +37,10 @@
 
 import logging
 import json
+import os
+import time
+import datetime
+from pathlib import Path
 
 rlog = None  # radar specific logger
 simulation_mode = False
@@ -52,6 +56,31 @@ SIM_DATA_FILE = "simulation_data.json"
 #    "gear_down": false
 # }
 #
+# Instead of fixed values the file may contain a scenario, which is played from the time the file was (re)loaded:
+# {
+#    "speed": 4,          # optional, time factor for accelerated playback
+#    "loop": false,       # optional, restart at the end, otherwise the last values are kept
+#    "scenario": [        # list of keyframes, "t" in secs scenario time. Numbers are interpolated linearly,
+#       {"t": 0, "gps_speed": 0, "g_distance": 0, "gear_down": true},   # other values taken from last keyframe
+#       {"t": 20, "gps_speed": 60, "g_distance": 0}, ...
+#    ]
+# }
+# "scenario" can also be a filename of a file containing this list, relative to the config directory, e.g.
+# {"speed": 4, "scenario": "simulation_touch_and_go.example.json"}
+# If the file itself contains only the list of keyframes, it is played as scenario with speed 1
+CHECK_INTERVAL = 0.5   # secs between two checks whether the file was modified
+SCENARIO_DIR = Path(__file__).resolve().parent.parent.joinpath("config")   # base of scenario filenames
+
+# globals
+sim_data = None       # static values of last read
+scenario = None       # list of keyframes sorted by time, None if no scenario is played
+scenario_speed = 1.0
+scenario_loop = False
+scenario_start = 0.0  # time.monotonic() when playback started
+scenario_start_time = None   # utc datetime when playback started
+file_mtime = None     # modification time of SIM_DATA_FILE when it was read
+next_check = 0.0
+
 
 def init(sim_mode):
     global rlog
@@ -61,18 +90,97 @@ def init(sim_mode):
     rlog = logging.getLogger('stratux-radar-log')
     if simulation_mode:
         rlog.debug('Simulation mode activated - Reading sim data from: ' + SIM_DATA_FILE + '.')
-        sim_data = read_simulation_data()
-        if sim_data is not None:
-            rlog.debug('Initial simulation data: ' + json.dumps(sim_data))
+        data = read_simulation_data()
+        if data is not None:
+            rlog.debug('Initial simulation data: ' + json.dumps(data))
         else:
             rlog.debug('Error reading simulation data in file ' + SIM_DATA_FILE + '.')
 
 
+def load_scenario(content):   # returns list of keyframes, content is the list or a filename
+    if isinstance(content, str):
+        with open(SCENARIO_DIR.joinpath(content)) as f:
+            content = json.load(f)
+    if not isinstance(content, list) or len(content) == 0:
+        raise ValueError("scenario is not a list of keyframes")
+    return sorted(content, key=lambda k: k['t'])
+
+
+def load_file():
+    global sim_data
+    global scenario
+    global scenario_speed
+    global scenario_loop
+    global scenario_start
+    global scenario_start_time
+
+    with open(SIM_DATA_FILE) as f:
+        data = json.load(f)
+    if isinstance(data, list):   # plain list of keyframes
+        data = {'scenario': data}
+    if 'scenario' in data:
+        scenario = load_scenario(data['scenario'])
+        scenario_speed = data.get('speed', 1.0)
+        scenario_loop = data.get('loop', False)
+        scenario_start = time.monotonic()
+        scenario_start_time = datetime.datetime.now(datetime.timezone.utc)
+        sim_data = None
+        rlog.debug("Simulation: playing scenario with {0} keyframes, speed {1}".format(len(scenario), scenario_speed))
+    else:
+        scenario = None
+        sim_data = data
+
+
+def scenario_time():   # secs since start of the scenario, in scenario time
+    return (time.monotonic() - scenario_start) * scenario_speed
+
+
+def now():
+    # current utc time, during a scenario the accelerated scenario time, so that durations match the scenario
+    if scenario is None:
+        return datetime.datetime.now(datetime.timezone.utc)
+    return scenario_start_time + datetime.timedelta(seconds=scenario_time())
+
+
+def scenario_values():   # values of the scenario at the current scenario time
+    t = scenario_time()
+    end = scenario[-1]['t']
+    if scenario_loop and end > scenario[0]['t']:   # a single point in time can not loop
+        t = scenario[0]['t'] + (t - scenario[0]['t']) % (end - scenario[0]['t'])
+    values = {}
+    after = None
+    for keyframe in scenario:
+        if keyframe['t'] > t:
+            after = keyframe
+            break
+        values.update(keyframe)
+    if after is not None and 't' in values:
+        fraction = (t - values['t']) / (after['t'] - values['t'])
+        for key, value in after.items():
+            if key in values and isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                    isinstance(values[key], (int, float)) and not isinstance(values[key], bool):
+                values[key] = values[key] + fraction * (value - values[key])
+    values.pop('t', None)
+    return values
+
+
 def read_simulation_data():  # returns dictionary with all contents of the SIM_DATA_FILE, None if file operation failed
-    try:
-        with open(SIM_DATA_FILE) as f:
-            sim_data = json.load(f)
-    except (OSError, IOError, ValueError) as e:
-        rlog.debug("Simulation: Error " + str(e) + " reading " + SIM_DATA_FILE)
-        return None
+    global file_mtime
+    global next_check
+    global sim_data
+    global scenario
+
+    if time.monotonic() >= next_check:   # file is only read again if it was modified
+        next_check = time.monotonic() + CHECK_INTERVAL
+        try:
+            mtime = os.stat(SIM_DATA_FILE).st_mtime_ns
+            if mtime != file_mtime:
+                file_mtime = mtime
+                load_file()
+        except (OSError, IOError, ValueError, KeyError, TypeError) as e:
+            rlog.debug("Simulation: Error " + str(e) + " reading " + SIM_DATA_FILE)
+            sim_data = None
+            scenario = None
+    if scenario is not None:
+        return scenario_values()
     return sim_data
@@ -32,7 +32,7 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import logging
-import requests
+import stratuxclient
 import radarbuttons
 import time
 import radarbluez
@@ -45,6 +45,8 @@ import json
 import os
 import datetime
 import radarmodes
+import displaytiming
+import storage
 
 # constants
 STATUS_TIMEOUT = 0.3
@@ -90,7 +92,7 @@ def read_config(config_file):
     if rlog is None:   # may be called before init
         rlog = logging.getLogger('stratux-radar-log')
     try:
-        with open(config_file) as f:
+        with open(storage.current_path(config_file)) as f:
             config = json.load(f)
     except (OSError, IOError, ValueError) as e:
         rlog.debug("StatusUI: Error " + str(e) + " reading " + config_file)
@@ -106,11 +108,7 @@ def write_config(config):
 
     if rlog is None:   # may be called before init
         rlog = logging.getLogger('stratux-radar-log')
-    try:
-        with open(g_config_file, 'wt') as out:
-            json.dump(config, out, sort_keys=True, indent=4, default=default)
-    except (OSError, IOError, ValueError) as e:
-        rlog.debug("StatusUI: Error " + str(e) + " writing " + g_config_file)
+    storage.save_json(g_config_file, config, default=default)   # atomic, written by the storage thread
     rlog.debug("StatusUI: Configuration saved to " + g_config_file + ": " + json.dumps(config, sort_keys=True, indent=4,
                                                                                        default=default))
 
@@ -138,16 +136,8 @@ def init(config_file, url, target_ip, refresh, config):   # prepare everything
     new_wifi = DEFAULT_WIFI
 
 
-def get_status():
-    global status_url
-
-    try:
-        answer = requests.get(status_url)
-        status_answer = answer.json()
-    except (requests.exceptions.RequestException, ValueError) as e:
-        rlog.debug("Status UI: Status GET exception", e)
-        return None
-    return status_answer
+async def get_status():
+    return await stratuxclient.get_json(status_url)   # None if request failed
 
 
 def draw_status(display_control, bluetooth_active, extsound_active):
@@ -165,7 +155,12 @@ def draw_status(display_control, bluetooth_active, extsound_active):
         #    last_status_get = now
         # status_answer = get_status()  not used for now
         status_text = "Strx: " + format(stratux_ip) + "\n"
-        status_text += "DispRefresh: " + str(round(refresh_time, 2)) + " s\n"
+        status_text += "DispRefresh: " + str(round(displaytiming.refresh_time(refresh_time), 2)) + " s\n"
+        timing = displaytiming.summary()
+        if timing['render'] is not None:
+            status_text += "Frame: {0}+{1}+{2} ms\n".format(timing['render'], timing['transfer'],
+                                                           timing['busy'] if timing['busy'] is not None else 0)
+        status_text += "Part/Full: {0}/{1}\n".format(timing['partial_count'], timing['full_count'])
         bt_devices, bt_names = radarbluez.connected_devices()
         if bt_devices is not None:
             status_text += "BT-Devices: " + str(bt_devices) + "\n"
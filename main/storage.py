@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+
+# Storage of the files in the config directory (configuration, flights, ground statistics) on the sd card.
+# - save_json writes a whole document atomically: temp file, fsync, rename. After a power loss either the old or
+#   the new version is there, never a truncated file. Multiple saves of the same file before it is written are
+#   coalesced, only the last content is written.
+# - Journal is an append-only file with one json record per line. A torn last line after a power loss is skipped
+#   when reading. Owners compact it (rewrite atomically with the current state) when it gets too long.
+# All writes are done in one writer thread in the order they were requested, so the asyncio loop never waits
+# for the sd card. The content is serialized in the calling thread, later changes of the object are not written.
+# Write-behind: after init, writes go to a copy of the file in tmpfs (STAGING_DIR). Modified files are copied to
+# the sd card in one batch (temp file, fsync, rename, one fsync per directory) every FLUSH_INTERVAL, when the
+# aircraft stopped (persist_nowait) and at shutdown (flush). Readers use current_path to get the latest version.
+# Files only changed by append_lines and replace_tail (flight log, journals) are not copied as a whole, only the
+# part after the bytes that are already on the sd card is written (and fsync'ed).
+# A staged copy left over by a process which was killed is written to the sd card during init.
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+# constants
+COMPACT_LINES = 200    # default number of journal lines after which compaction is due
+FLUSH_TIMEOUT = 5.0    # max secs to wait for pending writes during terminate
+STAGING_DIR = "/dev/shm/stratux-radar"   # tmpfs directory for write-behind
+FLUSH_INTERVAL = 120.0   # max secs modified files stay only in tmpfs
+
+# globals
+rlog = logging.getLogger('stratux-radar-log')
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+pending = {}           # path -> content of a save_json which is not yet written
+pending_lock = threading.Lock()
+staging = None         # staging directory, None: write-through to the sd card
+staged = set()         # persistent paths which have a copy in the staging directory
+dirty = set()          # persistent paths whose staged copy is newer than the file on the sd card
+synced = {}            # path -> no of bytes at the beginning of an appended staged file that are on the sd card
+
+
+def init():   # activates write-behind, called before any file of the config directory is read
+    global staging
+
+    try:
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        leftovers = os.listdir(STAGING_DIR)
+    except OSError as e:
+        rlog.debug("Storage: No staging directory " + STAGING_DIR + ", writing through: " + str(e))
+        return
+    for name in leftovers:   # staged files of a process which did not terminate, they are the latest version
+        sp = os.path.join(STAGING_DIR, name)
+        if not name.endswith('.tmp') and _copy_to_disk(sp, unquote(name)):
+            _fsync_dir(unquote(name))
+            rlog.debug("Storage: recovered " + unquote(name) + " from staging directory")
+        try:
+            os.remove(sp)
+        except OSError:
+            pass
+    staging = STAGING_DIR
+    rlog.debug("Storage: write-behind via " + STAGING_DIR + ", flush interval " + str(FLUSH_INTERVAL) + " secs")
+
+
+def staged_path(path):
+    return os.path.join(staging, quote(os.path.abspath(path), safe=''))
+
+
+def current_path(path):   # path to read the latest version of the file from
+    if path in staged:
+        return staged_path(path)
+    return path
+
+
+def _stage(path, copy=True):
+    # writer thread, returns path to write to, copies the file to tmpfs on first write. Without copy the caller
+    # adds path to staged after the staged file was written
+    if staging is None:
+        return path
+    sp = staged_path(path)
+    if path not in staged and copy:
+        if os.path.exists(path):
+            shutil.copyfile(path, sp)
+        synced[path] = os.path.getsize(sp) if os.path.exists(sp) else 0
+        staged.add(path)   # only after copy, readers may use the staged file from now on
+    dirty.add(path)
+    return sp
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_file(target, text, sync):   # atomic replace of target
+    tmp = target + '.tmp'
+    with open(tmp, 'wb' if isinstance(text, bytes) else 'wt') as out:
+        out.write(text)
+        if sync:
+            out.flush()
+            os.fsync(out.fileno())
+    os.replace(tmp, target)
+
+
+def _copy_to_disk(source, path):   # writer thread or init, directory is synced by caller
+    try:
+        with open(source, 'rb') as f:
+            _write_file(path, f.read(), True)
+    except (OSError, IOError) as e:
+        rlog.debug("Storage: Error " + str(e) + " writing " + path)
+        return False
+    return True
+
+
+def _append_to_disk(source, path, offset):
+    # writer thread, writes the part of source after offset to path, returns new size on disk, None on error
+    try:
+        with open(source, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as out:
+            out.truncate(offset)
+            out.seek(offset)
+            out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+    except (OSError, IOError) as e:
+        rlog.debug("Storage: Error " + str(e) + " appending to " + path)
+        return None
+    return offset + len(data)
+
+
+def write_atomic(path, text):   # synchronous, used by the writer thread, text may also be bytes
+    try:
+        target = _stage(path, copy=False)
+        _write_file(target, text, staging is None)
+        if staging is None:
+            _fsync_dir(path)
+        else:
+            synced.pop(path, None)   # whole file is copied by persist
+            staged.add(path)   # only now the staged file exists
+    except (OSError, IOError) as e:
+        rlog.debug("Storage: Error " + str(e) + " writing " + path)
+        return False
+    return True
+
+
+def append_lines(path, text):   # synchronous, used by the writer thread, text may also be bytes
+    try:
+        target = _stage(path)
+        with open(target, 'ab' if isinstance(text, bytes) else 'at') as out:
+            out.write(text)
+            if staging is None:
+                out.flush()
+                os.fsync(out.fileno())
+    except (OSError, IOError) as e:
+        rlog.debug("Storage: Error " + str(e) + " appending to " + path)
+        return False
+    return True
+
+
+def replace_tail(path, offset, data):   # synchronous, cuts the file at offset and appends data (bytes)
+    try:
+        target = _stage(path)
+        if path in synced:
+            synced[path] = min(synced[path], offset)   # tail on the sd card is outdated
+        with open(target, 'r+b') as out:
+            out.truncate(offset)
+            out.seek(offset)
+            out.write(data)
+            if staging is None:
+                out.flush()
+                os.fsync(out.fileno())
+    except (OSError, IOError) as e:
+        rlog.debug("Storage: Error " + str(e) + " rewriting end of " + path)
+        return False
+    return True
+
+
+def persist():   # writer thread, copies all modified files from tmpfs to the sd card in one batch
+    if len(dirty) == 0:
+        return
+    directories = set()
+    for path in sorted(dirty):
+        if path in synced:   # only appended, write the new part
+            size = _append_to_disk(staged_path(path), path, synced[path])
+            if size is not None:
+                synced[path] = size
+                directories.add(os.path.dirname(os.path.abspath(path)))   # in case it was created
+        elif _copy_to_disk(staged_path(path), path):
+            synced[path] = os.path.getsize(staged_path(path))   # following appends only write the new part
+            directories.add(os.path.dirname(os.path.abspath(path)))
+    for d in directories:   # one directory sync for all renames
+        _fsync_dir(os.path.join(d, ''))
+    rlog.debug("Storage: {0} files written to disk".format(len(dirty)))
+    dirty.clear()
+
+
+def submit(function, *args):   # any other write, done in order with all writes of the writer thread
+    return executor.submit(function, *args)
+
+
+def _write_pending(path):
+    with pending_lock:
+        text = pending.pop(path, None)
+    if text is not None:
+        write_atomic(path, text)
+
+
+def save_json(path, obj, default=None):   # atomic write of a whole document, done in the writer thread
+    text = json.dumps(obj, sort_keys=True, indent=4, default=default)
+    with pending_lock:
+        scheduled = path in pending
+        pending[path] = text
+    if not scheduled:   # otherwise the write already scheduled takes the new content
+        executor.submit(_write_pending, path)
+
+
+def load_json(path):   # returns the document or None if not readable
+    try:
+        with open(current_path(path)) as f:
+            return json.load(f)
+    except (OSError, IOError, ValueError) as e:
+        rlog.debug("Storage: Error " + str(e) + " reading " + path)
+        return None
+
+
+class Journal:
+    def __init__(self, path, compact_lines=COMPACT_LINES):
+        self.path = path
+        self.compact_lines = compact_lines
+        self.lines = 0     # number of records in the file, known after read
+
+    def read(self):
+        # returns list of all records. Also reads files of concatenated (pretty printed) json documents,
+        # as written by older versions. A damaged record (e.g. a torn last line) is skipped up to the next line
+        try:
+            with open(current_path(self.path)) as f:
+                text = f.read()
+        except (OSError, IOError) as e:
+            rlog.debug("Storage: Error " + str(e) + " reading " + self.path)
+            return []
+        decoder = json.JSONDecoder()
+        records = []
+        damaged = False
+        pos = 0
+        while True:
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+            if pos >= len(text):
+                break
+            try:
+                record, end = decoder.raw_decode(text, pos)
+            except ValueError:
+                record, end = None, pos
+            if not isinstance(record, dict):
+                rlog.debug("Storage: Damaged record in " + self.path + " at " + str(pos) + ", skipped")
+                damaged = True
+                end = text.find('\n', pos)
+                pos = len(text) if end < 0 else end + 1
+                continue
+            records.append(record)
+            pos = end
+        if damaged:   # rewritten without the damaged lines, otherwise next appends could continue a torn line
+            self.compact(records)
+        self.lines = len(records)
+        return records
+
+    def append(self, record, default=None):
+        text = json.dumps(record, default=default) + '\n'
+        self.lines += 1
+        executor.submit(append_lines, self.path, text)
+
+    def compaction_due(self):
+        return self.lines > self.compact_lines
+
+    def compact(self, records, default=None):   # replaces the journal with records
+        text = ''.join(json.dumps(r, default=default) + '\n' for r in records)
+        self.lines = len(records)
+        executor.submit(write_atomic, self.path, text)
+
+
+def flush(timeout=FLUSH_TIMEOUT):   # waits until all writes requested so far are done and on the sd card
+    try:
+        executor.submit(persist).result(timeout)
+    except (TimeoutError, RuntimeError) as e:
+        rlog.debug("Storage: Error " + str(e) + " flushing writes")
+
+
+def persist_nowait():   # e.g. when aircraft stopped, a good moment to write to the sd card
+    try:
+        executor.submit(persist)
+    except RuntimeError:   # already terminated
+        pass
+
+
+async def flusher():   # coroutine, regularly writes modified files to the sd card
+    try:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            persist_nowait()
+    except (asyncio.CancelledError, RuntimeError):
+        rlog.debug("Storage flusher terminating ...")
+
+
+def terminate():
+    flush()
+    executor.shutdown(wait=False)
+    if len(dirty) == 0:   # everything is on the sd card, staged copies are not needed any more
+        for path in list(staged):
+            try:
+                os.remove(staged_path(path))
+            except OSError:
+                pass
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+
+# Shared http client for the REST endpoints of Stratux. One requests session with keep-alive connection pool,
+# timeouts and retries. Requests run in a small thread pool, so the asyncio loop (display, websockets) is never
+# blocked by a slow Stratux. Requests with the same key are coalesced: rapid changes (e.g. radar range) only
+# send the final value.
+# The getSettings document is cached: it is refreshed in the background if older than SETTINGS_TTL and updated
+# locally after a successful setSettings, so reading a setting never does network I/O.
+
+import asyncio
+import logging
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# constants
+TIMEOUT = (2.0, 4.0)     # connect and read timeout in secs
+RETRIES = 2              # retries on connection errors
+BACKOFF = 0.3            # backoff factor for retries in secs
+WORKERS = 2              # parallel requests, also size of connection pool
+COALESCE_DELAY = 0.3     # secs to wait for further changes before a coalesced request is sent
+SETTINGS_TTL = 30.0      # secs after which the cached settings are refreshed
+
+# globals
+rlog = None
+session = None
+executor = None
+background_tasks = set()   # references to running tasks, otherwise they might be garbage collected
+coalesced = {}             # key -> task which is sending for this key
+rerun = set()              # keys which were requested again while their task was running
+pending_posts = {}         # key -> (url, json) of the latest coalesced post
+settings_url = None        # url of getSettings
+settings = None            # cached getSettings document, None if not yet received
+settings_time = 0.0        # time.monotonic() of last refresh of settings
+
+
+def init(url_settings_get=None):
+    global rlog
+    global session
+    global executor
+    global settings_url
+
+    settings_url = url_settings_get
+    rlog = logging.getLogger('stratux-radar-log')
+    session = requests.Session()
+    retry = Retry(total=RETRIES, connect=RETRIES, read=RETRIES, status=0, backoff_factor=BACKOFF,
+                  allowed_methods=None)   # None: retry also posts, all stratux settings are idempotent
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS, max_retries=retry)
+    session.mount('http://', adapter)
+    executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="http")
+    rlog.debug("StratuxClient: initialized with timeout " + str(TIMEOUT) + " and " + str(RETRIES) + " retries")
+
+
+def terminate():
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if session is not None:
+        session.close()
+
+
+def _request(method, url, json_data):   # runs in executor, returns response or None
+    try:
+        response = session.request(method, url, json=json_data, timeout=TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        rlog.debug("StratuxClient: {0} {1} failed: {2}".format(method, url, e))
+        return None
+    if response.status_code != 200:
+        rlog.debug("StratuxClient: {0} {1} failed, status code {2}".format(method, url, response.status_code))
+        return None
+    return response
+
+
+async def get_json(url):   # returns decoded json or None
+    response = await asyncio.get_running_loop().run_in_executor(executor, _request, 'GET', url, None)
+    if response is None:
+        return None
+    try:
+        return response.json()
+    except ValueError as e:
+        rlog.debug("StratuxClient: invalid json from {0}: {1}".format(url, e))
+        return None
+
+
+async def post(url, json_data=None):   # returns True if successful
+    response = await asyncio.get_running_loop().run_in_executor(executor, _request, 'POST', url, json_data)
+    return response is not None
+
+
+def post_sync(url, json_data=None):   # blocking, only where nothing else has to run anymore, e.g. shutdown
+    return _request('POST', url, json_data) is not None
+
+
+def run_nowait(coro):   # starts coroutine in background, called from code running in the asyncio loop
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def _coalesced(key, coro_function):
+    try:
+        while True:
+            await asyncio.sleep(COALESCE_DELAY)   # collect further changes
+            rerun.discard(key)
+            await coro_function()
+            if key not in rerun:
+                break
+    finally:
+        del coalesced[key]
+
+
+def run_coalesced(key, coro_function):   # coro_function is awaited once for all calls in short succession
+    if key in coalesced:
+        rerun.add(key)
+        return
+    coalesced[key] = run_nowait(_coalesced(key, coro_function))
+
+
+def post_nowait(url, json_data=None, key=None):   # with a key, only the latest post for this key is sent
+    if key is None:
+        run_nowait(post(url, json_data))
+        return
+    pending_posts[key] = (url, json_data)
+
+    async def send_latest():
+        if key in pending_posts:
+            latest_url, latest_json = pending_posts.pop(key)
+            await post(latest_url, latest_json)
+    run_coalesced(key, send_latest)
+
+
+async def refresh_settings():   # reads getSettings into the cache
+    global settings
+    global settings_time
+
+    if settings_url is None:
+        return
+    started = time.monotonic()
+    document = await get_json(settings_url)
+    if document is not None and settings_time < started:   # otherwise a post changed settings meanwhile
+        settings = document
+        settings_time = time.monotonic()
+        rlog.debug("StratuxClient: settings refreshed")
+
+
+def setting(name, default=None):   # cached value, never blocks. Expired settings are refreshed in background
+    if settings is None or time.monotonic() - settings_time > SETTINGS_TTL:
+        run_coalesced('getSettings', refresh_settings)
+    if settings is None:
+        return default
+    return settings.get(name, default)
+
+
+async def post_settings(url, changes):   # setSettings, cache is updated if successful
+    global settings_time
+
+    if not await post(url, changes):
+        return False
+    if settings is not None:
+        settings.update(changes)
+        settings_time = time.monotonic()
+    return True
+
+
+def post_settings_nowait(url, changes, key):   # coalesced setSettings, only the latest changes for key are sent
+    pending_posts[key] = (url, changes)
+
+    async def send_latest():
+        if key in pending_posts:
+            latest_url, latest_changes = pending_posts.pop(key)
+            await post_settings(latest_url, latest_changes)
+    run_coalesced(key, send_latest)
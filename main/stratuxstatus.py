@@ -37,7 +37,7 @@ import radarbuttons
 import asyncio
 import json
 import radarmodes
-import requests
+import stratuxclient
 
 # constants
 SITUATION_DEBUG = logging.DEBUG-2
@@ -48,6 +48,7 @@ status_url = ""
 settings_url_get = ""
 settings_url_set = ""
 rlog = None
+offset_difference = 0   # changes of AltitudeOffset by user, not yet sent to stratux
 status_listener = None  # couroutine task for querying statux
 strx = {'was_changed': True, 'version': "0.0", 'ES_messages_last_minute': 0, 'ES_messages_max': 0,
         'OGN_connected': False, 'OGN_messages_last_minute': 0, 'OGN_messages_max': 0,
@@ -140,36 +141,26 @@ def draw_status(display_control, ui_changed, connected, altitude, gps_alt, gps_q
         strx['was_changed'] = False
 
 
-def get_current_altoffset():
-    try:
-        response = requests.get(settings_url_get)
-        if response.status_code == 200:   # Check if the request was successful (status code 200)
-            current_offset = response.json().get('AltitudeOffset', 0)
-            rlog.log(SITUATION_DEBUG, "Received AltitudeOffset: {0} ft".format(current_offset))
-            return current_offset
-        else:
-            rlog.debug("Failed to retrieve current settings. Status code: {0}".format(response.status_code))
-            return None
-    except requests.exceptions.RequestException as req_exc:
-        rlog.debug("Failed to retrieve current settings. Request Exception {0}".format(req_exc))
-        return None
-    except Exception as req_exc:
-        rlog.debug("Failed to retrieve current settings. Request Exception {0}".format(req_exc))
-        return None
-
-
-def set_altitude_offset(new_value):
-    try:
-        # Send a POST request to update the AltitudeOffset
-        response = requests.post(settings_url_set, json={'AltitudeOffset': new_value})
-        if response.status_code == 200:  # Check if the request was successful (status code 200)
-            rlog.debug("Set new altitude offset: {0} ft".format(new_value))
-        else:
-            rlog.debug("Failed to set new settings. Status code: {0}".format(response.status_code))
-    except requests.exceptions.RequestException as req_exc:
-        rlog.debug("Failed to set current settings. Request Exception {0}".format(req_exc))
-    except Exception as req_exc:
-        rlog.debug("Failed to set current settings. Request Exception {0}".format(req_exc))
+async def send_altoffset():   # sends all changes made since last sending, based on the cached value of stratux
+    global offset_difference
+
+    alt_offset = stratuxclient.setting('AltitudeOffset')
+    if alt_offset is None:   # settings not yet received
+        await stratuxclient.refresh_settings()
+        alt_offset = stratuxclient.setting('AltitudeOffset')
+        if alt_offset is None:
+            rlog.debug("Failed to retrieve current settings.")
+            return
+    difference = offset_difference
+    offset_difference = 0
+    new_value = alt_offset + difference
+    if await stratuxclient.post_settings(settings_url_set, {'AltitudeOffset': new_value}):
+        rlog.debug("Set new altitude offset: {0} ft".format(new_value))
+    else:
+        offset_difference += difference   # try again with next change
+        rlog.debug("Failed to set new settings.")
+    strx['AltitudeOffset'] = stratuxclient.setting('AltitudeOffset', alt_offset) + offset_difference
+    strx['was_changed'] = True
 
 
 def status_callback(json_str):
@@ -211,18 +202,18 @@ def status_callback(json_str):
         strx['CPUTempMax'] = stat['CPUTempMax']
     else:
         strx['CPUTemp'] = -300
-    alt_offset = get_current_altoffset()
-    if alt_offset is not None:   # None would mean failure, update only with successful get request
-        strx['AltitudeOffset'] = alt_offset
-    # this is somehow dirty, but we assume that every change of altOffset via UI will also change
-    # status by changing altitude, will return 0 if request fails
+    alt_offset = stratuxclient.setting('AltitudeOffset')   # cached, no network access here
+    if alt_offset is not None:   # None means settings not yet received
+        strx['AltitudeOffset'] = alt_offset + offset_difference   # changes not yet sent stay visible
 
 
 def change_value(difference):
-    alt_offset = get_current_altoffset()
-    if alt_offset is not None:
-        strx['AltitudeOffset'] = alt_offset + difference
-        set_altitude_offset(strx['AltitudeOffset'])
+    global offset_difference
+
+    offset_difference += difference
+    strx['AltitudeOffset'] += difference   # displayed immediately
+    strx['was_changed'] = True
+    stratuxclient.run_coalesced('AltitudeOffset', send_altoffset)   # rapid changes are sent at once
 
 
 def user_input():
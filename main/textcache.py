@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+
+# Text layer for the display controllers. Most labels come from a small vocabulary (heights like "+12↗", course,
+# FL, range), so widths are memoised per (text, font) and labels consisting only of digits, signs and arrows are
+# composed from a pre-rasterised 1-bit glyph atlas per font and pasted as bitmap instead of being rendered by
+# FreeType on every frame. The atlas is only used for 1-bit images (epaper), the oled renders antialiased.
+
+from collections import OrderedDict
+from PIL import Image, ImageDraw
+
+# constants
+MAX_METRICS = 2048    # max number of memoised text widths
+MAX_LABELS = 256      # max number of composed label bitmaps
+ATLAS_CHARS = "0123456789+-.,:/° ↑↓↗↘"   # digits, signs and arrows
+
+# globals
+metrics = OrderedDict()   # (text, font, fontmode) -> width
+labels = OrderedDict()    # (text, font) -> 1-bit bitmap of the complete label
+atlases = {}              # font -> {char: (bitmap, advance)}
+
+
+def _lru_get(cache, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _lru_put(cache, key, value, max_entries):
+    cache[key] = value
+    if len(cache) > max_entries:
+        cache.popitem(last=False)
+
+
+def textlength(draw, text, font):   # same as draw.textlength, but memoised
+    key = (text, font, draw.fontmode)
+    width = _lru_get(metrics, key)
+    if width is None:
+        width = draw.textlength(text, font)
+        _lru_put(metrics, key, width, MAX_METRICS)
+    return width
+
+
+def atlas(font):   # glyph atlas of a font, rasterised once
+    glyphs = atlases.get(font)
+    if glyphs is None:
+        glyphs = {}
+        for ch in ATLAS_CHARS:
+            bbox = font.getbbox(ch)
+            advance = font.getlength(ch)
+            bitmap = Image.new('1', (max(int(bbox[2]), int(advance)) + 1, max(int(bbox[3]), 1) + 1), 0)
+            ImageDraw.Draw(bitmap).text((0, 0), ch, font=font, fill=1)
+            glyphs[ch] = (bitmap, advance)
+        atlases[font] = glyphs
+    return glyphs
+
+
+def label(text, font):   # 1-bit bitmap of the label composed from the atlas
+    key = (text, font)
+    bitmap = _lru_get(labels, key)
+    if bitmap is None:
+        glyphs = atlas(font)
+        width = 0
+        height = 0
+        xpos = 0.0
+        for ch in text:
+            glyph, advance = glyphs[ch]
+            width = max(width, round(xpos) + glyph.width)
+            height = max(height, glyph.height)
+            xpos += advance
+        bitmap = Image.new('1', (max(width, 1), max(height, 1)), 0)
+        xpos = 0.0
+        for ch in text:
+            glyph, advance = glyphs[ch]
+            bitmap.paste(1, (round(xpos), 0), mask=glyph)
+            xpos += advance
+        _lru_put(labels, key, bitmap, MAX_LABELS)
+    return bitmap
+
+
+def text(draw, xy, t, font, fill):
+    # draw.text replacement for labels, pasted from the atlas if possible, otherwise rendered as usual
+    if draw.fontmode != '1' or t == '' or any(ch not in ATLAS_CHARS for ch in t):
+        draw.text(xy, t, font=font, fill=fill)
+        return
+    draw.bitmap((round(xy[0]), round(xy[1])), label(t, font), fill=fill)
+
+
+def clear():   # e.g. if fonts are created again
+    metrics.clear()
+    labels.clear()
+    atlases.clear()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+
+# Cache for text to speech. Phrases are synthesised by pico2wave only once, afterwards they are taken from an
+# in-memory LRU cache or from the disk cache (key is text and speed), so alerts start without a synthesis.
+# Traffic callouts are composed of fragments ("Traffic", "2 o'clock", "plus 500 feet", "3 miles") which are
+# pre-synthesised and concatenated to one PCM buffer.
+# Synthesis is done by ttsengine, PCM format is the one of pico2wave: 16 bit signed, mono, 16 kHz.
+
+import hashlib
+import logging
+import os
+import threading
+import wave
+from collections import OrderedDict
+from pathlib import Path
+import numpy
+import ttsengine
+
+# constants
+CACHE_DIR = str(Path(__file__).resolve().parent.parent.joinpath("cache", "tts"))
+MAX_PHRASES = 64          # max number of phrases kept in memory
+SAMPLE_RATE = ttsengine.SAMPLE_RATE
+SAMPLE_WIDTH = ttsengine.SAMPLE_WIDTH
+CHANNELS = ttsengine.CHANNELS
+SILENCE_LEVEL = 300       # samples below this level at begin and end of a fragment are cut off
+FRAGMENT_GAP = 0.08       # pause between fragments in secs
+FRAGMENT_MARGIN = 0.02    # silence kept at begin and end of a fragment in secs
+MAX_PRESYNTH_HEIGHT = 3000   # traffic heights in feet which are synthesised in advance
+MAX_PRESYNTH_DISTANCE = 10   # traffic distances in miles which are synthesised in advance
+
+# globals
+rlog = None
+cache_dir = CACHE_DIR
+phrases = OrderedDict()   # (text, speed) -> pcm bytes
+phrases_lock = threading.Lock()   # speaker thread and presynthesis thread use the cache
+
+
+def init(directory=CACHE_DIR):
+    global rlog
+    global cache_dir
+
+    rlog = logging.getLogger('stratux-radar-log')
+    ttsengine.init()
+    cache_dir = directory
+    try:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        rlog.debug("TTSCache: Could not create cache directory " + cache_dir + ": " + str(e))
+
+
+def cache_file(text, speed):   # content addressed file name for text and speed
+    key = hashlib.sha1((str(speed) + "|" + text).encode('utf-8')).hexdigest()
+    return str(Path(cache_dir).joinpath(key + ".wav"))
+
+
+def read_wav(filename):   # returns pcm bytes or None
+    try:
+        with wave.open(filename, 'rb') as w:
+            if w.getsampwidth() != SAMPLE_WIDTH or w.getnchannels() != CHANNELS or w.getframerate() != SAMPLE_RATE:
+                rlog.debug("TTSCache: Unexpected format of " + filename)
+                return None
+            return w.readframes(w.getnframes())
+    except (OSError, EOFError, wave.Error):
+        return None
+
+
+def write_wav(filename, pcm):   # atomic, a partly written file is never found in the cache
+    tmp_filename = filename + "." + str(threading.get_ident()) + ".tmp"
+    try:
+        with wave.open(tmp_filename, 'wb') as w:
+            w.setnchannels(CHANNELS)
+            w.setsampwidth(SAMPLE_WIDTH)
+            w.setframerate(SAMPLE_RATE)
+            w.writeframes(pcm)
+        os.replace(tmp_filename, filename)
+    except OSError as e:
+        rlog.debug("TTSCache: Could not write " + filename + ": " + str(e))
+
+
+def synthesize(text, speed):   # synthesis by ttsengine, result is stored in the disk cache, returns pcm or None
+    pcm = ttsengine.synthesize(text, speed)
+    if pcm is not None:
+        write_wav(cache_file(text, speed), pcm)
+    return pcm
+
+
+def _cached(text, speed):   # pcm from memory or disk cache, None if not cached
+    key = (text, speed)
+    with phrases_lock:
+        pcm = phrases.get(key)
+        if pcm is not None:
+            phrases.move_to_end(key)
+            return pcm
+    pcm = read_wav(cache_file(text, speed))
+    if pcm is not None:
+        _remember(text, speed, pcm)
+    return pcm
+
+
+def _remember(text, speed, pcm):
+    with phrases_lock:
+        phrases[(text, speed)] = pcm
+        if len(phrases) > MAX_PHRASES:
+            phrases.popitem(last=False)
+
+
+def phrase(text, speed=100):   # pcm of a complete phrase, from memory, disk or synthesised
+    pcm = _cached(text, speed)
+    if pcm is None:
+        pcm = synthesize(text, speed)
+        if pcm is not None:
+            _remember(text, speed, pcm)
+    return pcm
+
+
+def phrases_parallel(texts, speed=100):
+    # list of pcm (None if synthesis failed) for all texts, missing ones are synthesised in parallel
+    result = {}
+    futures = {}
+    for t in texts:
+        pcm = _cached(t, speed)
+        if pcm is not None:
+            result[t] = pcm
+        elif t not in futures:
+            futures[t] = ttsengine.submit(t, speed)
+    for t, f in futures.items():
+        pcm = f.result()
+        if pcm is not None:
+            write_wav(cache_file(t, speed), pcm)
+            _remember(t, speed, pcm)
+            result[t] = pcm
+    if futures:
+        rlog.debug("TTSCache: " + str(len(futures)) + " of " + str(len(texts)) + " sounds synthesised in parallel.")
+    return [result.get(t) for t in texts]
+
+
+def trim_silence(pcm):   # cut off silence at begin and end of a fragment
+    samples = numpy.frombuffer(pcm, dtype='<i2')
+    loud = numpy.flatnonzero(numpy.abs(samples.astype(numpy.int32)) > SILENCE_LEVEL)
+    if len(loud) == 0:
+        return b''
+    margin = int(FRAGMENT_MARGIN * SAMPLE_RATE)
+    start = max(0, loud[0] - margin)
+    end = min(len(samples), loud[-1] + margin)
+    return samples[start:end].tobytes()
+
+
+def fragments(parts, speed=100):
+    # pcm of a phrase composed of pre-synthesised fragments, the result is also cached as phrase
+    text = " ".join(parts)
+    key = (text, speed)
+    with phrases_lock:
+        pcm = phrases.get(key)
+        if pcm is not None:
+            phrases.move_to_end(key)
+            return pcm
+    gap = bytes(int(FRAGMENT_GAP * SAMPLE_RATE) * SAMPLE_WIDTH)
+    out = []
+    for p in parts:
+        frag = phrase(p, speed)
+        if frag is None:
+            return None
+        out.append(trim_silence(frag))
+    pcm = gap.join(out)
+    _remember(text, speed, pcm)
+    return pcm
+
+
+def presynthesize(speed=100):   # synthesises all fragments of radar.speaktraffic to the disk cache, runs as background thread
+    texts = ['Traffic']
+    texts += [str(o) + ' o\'clock' for o in range(1, 13)]
+    for feet in range(0, MAX_PRESYNTH_HEIGHT + 100, 100):
+        texts += ['plus ' + str(feet) + ' feet', 'minus ' + str(feet) + ' feet']
+    texts += [str(d) + ' miles' for d in range(1, MAX_PRESYNTH_DISTANCE + 1)]
+    count = 0
+    for t in texts:
+        if not Path(cache_file(t, speed)).exists():
+            if synthesize(t, speed) is not None:
+                count += 1
+    rlog.debug("TTSCache: " + str(count) + " fragments synthesised, " + str(len(texts)) + " fragments available.")
+
+
+def start_presynthesis(speed=100):
+    threading.Thread(target=presynthesize, args=(speed,), daemon=True).start()
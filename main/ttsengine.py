@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PYTHON_ARGCOMPLETE_OK
+#
+# BSD 3-Clause License
+# Copyright (c) 2020, Thomas Breitbach
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE
+
+
+# Text to speech engine. Synthesis runs in a pool of long-lived worker threads and the result is returned
+# as PCM bytes in memory. pico2wave can only write to a wav file that it seeks in, so every worker uses its
+# own file in shared memory (/dev/shm), which is read and removed directly after synthesis. There is no
+# shared file anymore that could be overwritten by a parallel synthesis.
+# PCM format is the one of pico2wave: 16 bit signed, mono, 16 kHz.
+
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# constants
+TTS_WORKERS = max(2, os.cpu_count() or 1)   # number of parallel synthesis workers (pico2wave processes)
+SHM_DIR = "/dev/shm"      # ram based, used if available
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+
+# globals
+rlog = None
+pool = None
+work_dir = None
+
+
+def init(workers=TTS_WORKERS):
+    global rlog
+    global pool
+    global work_dir
+
+    rlog = logging.getLogger('stratux-radar-log')
+    if pool is not None:
+        return
+    if Path(SHM_DIR).is_dir():
+        work_dir = SHM_DIR
+    else:
+        work_dir = tempfile.gettempdir()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+    rlog.debug("TTSEngine: " + str(workers) + " workers started, working directory " + work_dir)
+
+
+def terminate():
+    global pool
+
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+        pool = None
+
+
+def _pico(text, speed):   # runs in a worker, returns pcm bytes or None
+    filename = str(Path(work_dir).joinpath("radar-tts-{0}-{1}.wav".format(os.getpid(), threading.get_ident())))
+    try:
+        pico_result = subprocess.run(["pico2wave", "-w", filename, f"<speed level='{speed}'> {text} </speed>"])
+        if pico_result.returncode != 0:
+            rlog.debug("TTSEngine: Error using pico2wave TTS for '" + text + "'")
+            return None
+        with wave.open(filename, 'rb') as w:
+            return w.readframes(w.getnframes())
+    except (OSError, EOFError, wave.Error) as e:
+        rlog.debug("TTSEngine: Error reading synthesised sound: " + str(e))
+        return None
+    finally:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def submit(text, speed=100):   # returns a future with the pcm bytes (or None)
+    return pool.submit(_pico, text, speed)
+
+
+def synthesize(text, speed=100):   # blocking, returns pcm bytes or None
+    return submit(text, speed).result()